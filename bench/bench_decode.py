@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Decode Backend Benchmark
+Decodes each video with every available backend (OpenCV / PyAV / ffmpeg
+pipe) and reports throughput, decoded frame count and timestamp range.
+
+    python bench/bench_decode.py input/a.mp4 [--max-side 640] [--threads 0] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mosaic_core.decode import available_backends, open_video, probe_video  # noqa: E402
+
+
+def bench_backend(path: str, backend: str, max_side=None, threads: int = 0) -> dict:
+    """Decode every frame of `path` with `backend` into a reused buffer."""
+    cap = open_video(path, backend, max_side=max_side, threads=threads)
+    buf = np.empty((cap.height, cap.width, 3), dtype=np.uint8)
+    frames = 0
+    first_ts = last_ts = None
+    start = time.perf_counter()
+    try:
+        while True:
+            ret, _ = cap.read(buf)
+            if not ret:
+                break
+            frames += 1
+            if first_ts is None:
+                first_ts = cap.timestamp
+            last_ts = cap.timestamp
+    finally:
+        cap.release()
+    elapsed = time.perf_counter() - start
+    return {
+        'backend': backend,
+        'frames': frames,
+        'seconds': round(elapsed, 3),
+        'fps': round(frames / elapsed, 1) if elapsed > 0 else 0.0,
+        'first_ts': first_ts,
+        'last_ts': last_ts,
+        'size': [cap.width, cap.height],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Decode backend benchmark")
+    parser.add_argument('videos', nargs='+', help="Input video files")
+    parser.add_argument('--backends', nargs='+', default=None,
+                        help="Backends to run (default: all available)")
+    parser.add_argument('--max-side', type=int, default=None, help="Decode-time downscale (long side)")
+    parser.add_argument('--threads', type=int, default=0, help="Decoder threads (0 = backend default)")
+    parser.add_argument('--json', default=None, help="Write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backends = args.backends or available_backends()
+    results = []
+    for path in args.videos:
+        info = probe_video(path)
+        print(f"\n{os.path.basename(path)}: {info['width']}x{info['height']} "
+              f"{info['fps']:.2f} fps, {info['frame_count']} frames (container)")
+        print(f"  {'backend':<8} {'frames':>7} {'fps':>8} {'first_ts':>9} {'last_ts':>9}")
+        for backend in backends:
+            try:
+                r = bench_backend(path, backend, args.max_side, args.threads)
+            except (IOError, RuntimeError) as e:
+                print(f"  {backend:<8} [ERROR] {e}")
+                continue
+            r['video'] = path
+            results.append(r)
+
+            def ts(v):
+                return f"{v:.3f}" if v is not None else "n/a"
+            print(f"  {backend:<8} {r['frames']:>7} {r['fps']:>8.1f} {ts(r['first_ts']):>9} {ts(r['last_ts']):>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[INFO] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Image Encode Benchmark
+Times mosaic-image.py's output encoders (encode_image) against the former
+plain PIL save() per format, with the file size and, for JPEG, the mean
+pixel difference to the source decode (re-encoding loss).
+
+    python bench/bench_encode.py [--size 4000x3000] [--source-quality 85] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_patterns import test_frame, time_call  # noqa: E402
+from mosaic_core.image_encode import EncodeOptions, encode_image, load_image  # noqa: E402
+
+
+def _loss(path: str, base: np.ndarray) -> float:
+    out = np.asarray(Image.open(path).convert("RGB")).astype(np.int16)
+    return round(float(np.abs(out - base).mean()), 3)
+
+
+def bench_format(src_path: str, ext: str, repeat: int, tmp_dir: str) -> list:
+    """Time PIL's default save and encode_image() variants for one output format."""
+    img = load_image(src_path)
+    base = np.asarray(img).astype(np.int16)
+    cases = [('PIL save()', None)]
+    if ext == '.jpg':
+        cases += [('keep tables', EncodeOptions()), ('quality 90', EncodeOptions(jpeg_quality=90))]
+    elif ext == '.png':
+        cases += [(f'level {level}', EncodeOptions(png_level=level)) for level in (1, 3, 6)]
+    cases.append(('lossless WebP', EncodeOptions(webp_lossless=True)))
+    results = []
+    for name, options in cases:
+        out_ext = '.webp' if options is not None and options.webp_lossless else ext
+        path = os.path.join(tmp_dir, 'out' + out_ext)
+        if options is None:
+            fn = lambda: img.save(path)  # noqa: E731
+        else:
+            fn = lambda options=options: encode_image(img, path, options)  # noqa: E731
+        ms = time_call(fn, repeat if out_ext != '.webp' else 1)
+        r = {'format': ext, 'encoder': name, 'ms': round(ms, 1), 'bytes': os.path.getsize(path)}
+        if ext == '.jpg':
+            r['mean_diff'] = _loss(path, base)
+        results.append(r)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Image output encoder benchmark")
+    parser.add_argument('--size', default='4000x3000', help="Image size WxH")
+    parser.add_argument('--source-quality', type=int, default=85, help="Quality of the synthetic JPEG source")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case (the fastest is kept)")
+    parser.add_argument('--json', default=None, help="Write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    rgb = test_frame(width, height)[:, :, ::-1]
+    results = []
+    print(f"{'format':<6} {'encoder':<14} {'ms':>8} {'bytes':>11} {'diff':>6}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for ext in ('.jpg', '.png'):
+            src_path = os.path.join(tmp_dir, 'src' + ext)
+            Image.fromarray(np.ascontiguousarray(rgb)).save(src_path, quality=args.source_quality)
+            for r in bench_format(src_path, ext, args.repeat, tmp_dir):
+                results.append(r)
+                diff = f"{r['mean_diff']:.2f}" if 'mean_diff' in r else '-'
+                print(f"{r['format']:<6} {r['encoder']:<14} {r['ms']:>8.1f} {r['bytes']:>11} {diff:>6}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'size': [width, height], 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Mosaic Pattern Benchmark
+Times every mosaic pattern per box across box sizes, on a view of a frame
+the way the render loop paints it (apply_pattern_array) and through the PIL
+path (apply_pattern). For ぼかし the original PIL GaussianBlur is timed too,
+with the mean / max pixel difference of the fast blur against it.
+
+    python bench/bench_patterns.py [--frame 3840x2160] [--sizes 64 256 1024] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mosaic_core.render import PATTERNS, apply_pattern, apply_pattern_array, blur_sigma  # noqa: E402
+
+BLUR = "ぼかし"
+
+
+def test_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Smooth colour field with shapes and grain (blur error shows on edges and gradients)."""
+    rng = np.random.default_rng(seed)
+    frame = cv2.resize(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8), (width, height),
+                       interpolation=cv2.INTER_CUBIC)
+    for _ in range(12):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(10, max(11, min(width, height) // 6)))
+        cv2.circle(frame, (x, y), r, tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    grain = rng.integers(-12, 13, frame.shape)
+    return np.clip(frame.astype(np.int16) + grain, 0, 255).astype(np.uint8)
+
+
+def reference_blur(region: Image.Image) -> Image.Image:
+    """The ぼかし pattern as originally implemented (PIL GaussianBlur)."""
+    w, h = region.size
+    return region.filter(ImageFilter.GaussianBlur(radius=blur_sigma(w, h)))
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-`repeat` milliseconds of fn()."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+def bench_size(frame: np.ndarray, size: int, patterns, repeat: int) -> list:
+    """Time each pattern on a centred size x size box of `frame`."""
+    h, w = frame.shape[:2]
+    bw, bh = min(size, w), min(size, h)
+    x1, y1 = (w - bw) // 2, (h - bh) // 2
+    box = (x1, y1, x1 + bw, y1 + bh)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    region_img = Image.fromarray(rgb).crop(box)
+    results = []
+    for pattern in patterns:
+        work = frame.copy()
+        view = work[y1:y1 + bh, x1:x1 + bw]
+
+        def run_array():
+            view[:] = frame[y1:y1 + bh, x1:x1 + bw]
+            apply_pattern_array(view, pattern)
+
+        r = {
+            'pattern': pattern,
+            'box': size,
+            'array_ms': round(time_call(run_array, repeat), 3),
+            'pil_ms': round(time_call(lambda: apply_pattern(region_img, pattern), repeat), 3),
+        }
+        if pattern == BLUR:
+            r['reference_ms'] = round(time_call(lambda: reference_blur(region_img), repeat), 3)
+            ref = cv2.cvtColor(np.array(reference_blur(region_img)), cv2.COLOR_RGB2BGR).astype(np.int16)
+            diff = np.abs(view.astype(np.int16) - ref)
+            r['mean_diff'] = round(float(diff.mean()), 3)
+            r['max_diff'] = int(diff.max())
+        results.append(r)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mosaic pattern microbenchmark")
+    parser.add_argument('--frame', default='3840x2160', help="Frame size WxH")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[32, 64, 128, 256, 512, 1024, 2048],
+                        help="Square box sizes (clipped to the frame)")
+    parser.add_argument('--patterns', nargs='+', default=list(PATTERNS), help="Patterns to run")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per case (the fastest is kept)")
+    parser.add_argument('--json', default=None, help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+    for p in args.patterns:
+        if p not in PATTERNS:
+            parser.error(f"Unknown pattern: {p}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(v) for v in args.frame.lower().split('x'))
+    frame = test_frame(width, height)
+    results = []
+    print(f"{'pattern':<8} {'box':>5} {'array ms':>9} {'PIL ms':>8} {'orig ms':>8} {'diff mean/max':>14}")
+    for size in args.sizes:
+        for r in bench_size(frame, size, args.patterns, args.repeat):
+            results.append(r)
+            orig = f"{r['reference_ms']:.2f}" if 'reference_ms' in r else '-'
+            diff = f"{r['mean_diff']:.2f}/{r['max_diff']}" if 'mean_diff' in r else '-'
+            print(f"{r['pattern']:<8} {r['box']:>5} {r['array_ms']:>9.2f} {r['pil_ms']:>8.2f} {orig:>8} {diff:>14}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'frame': [width, height], 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Benchmark Comparison
+Compares two bench/run_bench.py result files case by case (fps, peak RSS and
+the stage whose mean time moved the most). Exits with 1 when any case got
+slower than the threshold, so it can gate a change.
+
+    python bench/compare.py output/bench/bench_old.json output/bench/bench_new.json [--threshold 5]
+"""
+
+import argparse
+import json
+import sys
+
+CASE_KEYS = ('video', 'layers', 'pattern', 'mode', 'workers', 'encoder')
+
+
+def load_runs(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('meta', {}), {tuple(r[k] for k in CASE_KEYS): r for r in data.get('runs', [])}
+
+
+def stage_shift(old: dict, new: dict):
+    """(stage, old mean ms, new mean ms) with the largest absolute change, or None."""
+    shifts = []
+    for name in set(old.get('stages', {})) & set(new.get('stages', {})):
+        a, b = old['stages'][name]['mean_ms'], new['stages'][name]['mean_ms']
+        shifts.append((abs(b - a), name, a, b))
+    if not shifts:
+        return None
+    _, name, a, b = max(shifts)
+    return name, a, b
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=5.0, help="Regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    old_meta, old_runs = load_runs(args.old)
+    new_meta, new_runs = load_runs(args.new)
+    print(f"old: {old_meta.get('commit')} ({old_meta.get('detector')})  "
+          f"new: {new_meta.get('commit')} ({new_meta.get('detector')})")
+    if old_meta.get('cpus') != new_meta.get('cpus') or old_meta.get('detector') != new_meta.get('detector'):
+        print("[WARNING] Runs used different machines or detectors; deltas may not be comparable.")
+
+    regressions = 0
+    for key in sorted(set(old_runs) & set(new_runs)):
+        a, b = old_runs[key], new_runs[key]
+        delta = (b['fps'] - a['fps']) / a['fps'] * 100 if a['fps'] else 0.0
+        flag = ''
+        if delta < -args.threshold:
+            flag = '  <-- REGRESSION'
+            regressions += 1
+        shift = stage_shift(a, b)
+        stage = f", {shift[0]} {shift[1]:.2f}->{shift[2]:.2f} ms" if shift else ''
+        print(f"{' '.join(map(str, key))}: {a['fps']:.1f} -> {b['fps']:.1f} fps ({delta:+.1f}%), "
+              f"RSS {a.get('rss_peak_mb')} -> {b.get('rss_peak_mb')} MB{stage}{flag}")
+    for key in sorted(set(old_runs) ^ set(new_runs)):
+        print(f"{' '.join(map(str, key))}: only in {'old' if key in old_runs else 'new'}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:g}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Golden Coverage Check
+Records the covered boxes of every frame from a reference run over the
+synthetic videos, then checks a candidate configuration against it:
+per-frame pixel recall of the reference mask, frames newly left uncovered
+and extra covered area, next to the speedup. Fails (exit code 1) beyond the
+tolerances, so speed work can't silently drop coverage.
+
+    python bench/golden.py record                       # reference: serial, layers 1,2,4
+    python bench/golden.py check --mode pooled --workers 2 --latency-ms 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_ROOT = os.path.dirname(_BENCH_DIR)
+sys.path.insert(0, _REPO_ROOT)
+
+from run_bench import DEFAULT_VIDEO_DIR, NullWriter, make_factory, parse_layers  # noqa: E402
+from synthetic import VideoSpec, make_video  # noqa: E402
+from mosaic_core.decode import BACKEND_OPENCV, DECODE_BACKENDS, open_video  # noqa: E402
+from mosaic_core.detection import LAYER_HISTORY, clip_box  # noqa: E402
+from mosaic_core.detection_cache import VideoDetectionCache  # noqa: E402
+from mosaic_core.frame_cache import FrameFingerprintCache  # noqa: E402
+from mosaic_core.render import LiveDetection, render_video  # noqa: E402
+from mosaic_core.thread_budget import MODE_PROCESSES, configure_threads, plan_threads  # noqa: E402
+from mosaic_core.worker_pool import DetectionWorkerPool, render_video_pooled  # noqa: E402
+
+DEFAULT_GOLDEN_DIR = os.path.join(_REPO_ROOT, 'cache', 'golden')
+DEFAULT_VIDEOS = ['640x360@30:6', '1280x720@24:4']
+GOLDEN_PATTERN = "黒塗り"  # Pattern does not change the boxes; the cheapest one keeps runs short
+
+# Default tolerances
+MIN_MEAN_RECALL = 0.995
+FRAME_RECALL = 0.98       # A frame below this recall counts as uncovered
+MAX_UNCOVERED_FRAMES = 0
+MAX_EXTRA_AREA = 0.25     # Extra covered area relative to the reference area
+
+
+def run_config(video_path: str, config: dict):
+    """
+    Run the video loop with `config` and record its boxes.
+
+    Returns:
+        (VideoDetectionCache recorder, elapsed seconds)
+    """
+    configure_threads(report=False)
+    factory = make_factory(parse_layers(config['layers']), config['latency_ms'], config['real'])
+    recorder = VideoDetectionCache({'config': config})
+    frame_cache = tmp_dir = pool = None
+    if config['frame_cache']:
+        tmp_dir = tempfile.TemporaryDirectory(prefix='golden_')
+        frame_cache = FrameFingerprintCache(os.path.join(tmp_dir.name, 'fp.sqlite'), 'golden')
+    if config['mode'] == 'pooled':
+        pool = DetectionWorkerPool(factory, config['workers'], plan_threads(MODE_PROCESSES, config['workers']))
+    else:
+        detector = factory()
+    cap = open_video(video_path, config['decoder'])
+    try:
+        start = time.perf_counter()
+        if pool is not None:
+            render_video_pooled(cap, NullWriter(), pool, GOLDEN_PATTERN, recorder=recorder,
+                                frame_cache=frame_cache)
+        else:
+            render_video(cap, NullWriter(), LiveDetection(detector, frame_cache=frame_cache),
+                         GOLDEN_PATTERN, recorder=recorder)
+        elapsed = time.perf_counter() - start
+    finally:
+        cap.release()
+        if pool is not None:
+            pool.close()
+        if frame_cache is not None:
+            frame_cache.close()
+            tmp_dir.cleanup()
+    return recorder, elapsed
+
+
+def frame_mask(boxes, width: int, height: int) -> np.ndarray:
+    """Union of the (clipped) boxes as a boolean mask, as painted by paint_boxes_array."""
+    mask = np.zeros((height, width), dtype=bool)
+    for box in boxes:
+        clipped = clip_box(box, width, height)
+        if clipped is not None:
+            x1, y1, x2, y2 = clipped
+            mask[y1:y2, x1:x2] = True
+    return mask
+
+
+def coverage(reference: VideoDetectionCache, candidate: VideoDetectionCache,
+             width: int, height: int, frame_recall: float = FRAME_RECALL,
+             ignore_history: bool = False) -> dict:
+    """
+    Per-frame coverage of the reference union mask by the candidate's boxes.
+
+    With ignore_history the reference mask leaves out Layer 3 hold-over boxes,
+    which depend on how the tracker assigned IDs rather than on what was detected.
+    """
+    frames = max(reference.frame_count, candidate.frame_count)
+    recalls = []
+    uncovered = []
+    ref_area = extra_area = 0
+    for i in range(frames):
+        ref_boxes = reference.frame_boxes(i)
+        if ignore_history:
+            ref_boxes = [b for b in ref_boxes if b[4] != LAYER_HISTORY]
+        ref = frame_mask(ref_boxes, width, height)
+        cand = frame_mask(candidate.frame_boxes(i), width, height)
+        area = int(ref.sum())
+        ref_area += area
+        extra_area += int((cand & ~ref).sum())
+        if area:
+            recall = int((ref & cand).sum()) / area
+            recalls.append(recall)
+            if recall < frame_recall:
+                uncovered.append(i)
+    return {
+        'frames': frames,
+        'frame_count_match': reference.frame_count == candidate.frame_count,
+        'covered_frames': len(recalls),
+        'mean_recall': float(np.mean(recalls)) if recalls else 1.0,
+        'min_recall': float(np.min(recalls)) if recalls else 1.0,
+        'uncovered_frames': len(uncovered),
+        'first_uncovered': uncovered[:10],
+        'extra_area': extra_area / ref_area if ref_area else 0.0,
+    }
+
+
+def golden_path(golden_dir: str, spec: VideoSpec) -> str:
+    return os.path.join(golden_dir, spec.name + ".npz")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Golden-output coverage regression check")
+    parser.add_argument('command', choices=('record', 'check'))
+    parser.add_argument('--videos', nargs='+', default=DEFAULT_VIDEOS, help="Synthetic video specs WxH[@fps[:seconds]]")
+    parser.add_argument('--golden-dir', default=DEFAULT_GOLDEN_DIR)
+    parser.add_argument('--video-dir', default=DEFAULT_VIDEO_DIR)
+    # Run configuration (reference for `record`, candidate for `check`)
+    parser.add_argument('--mode', choices=('serial', 'pooled'), default='serial')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--layers', default='1,2,4', help="Model layers, e.g. 2 or 1,2,4")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Stub detector latency per layer call")
+    parser.add_argument('--decoder', choices=DECODE_BACKENDS, default=BACKEND_OPENCV)
+    parser.add_argument('--frame-cache', action='store_true', help="Use a (fresh) frame fingerprint cache")
+    parser.add_argument('--real', action='store_true', help="Use the real YOLO / NudeNet models")
+    # Tolerances
+    parser.add_argument('--min-recall', type=float, default=MIN_MEAN_RECALL, help="Minimum mean per-frame recall")
+    parser.add_argument('--frame-recall', type=float, default=FRAME_RECALL,
+                        help="Per-frame recall below which a frame counts as uncovered")
+    parser.add_argument('--max-uncovered', type=int, default=MAX_UNCOVERED_FRAMES,
+                        help="Maximum frames newly uncovered per video")
+    parser.add_argument('--max-extra', type=float, default=MAX_EXTRA_AREA,
+                        help="Maximum extra covered area (fraction of the reference area)")
+    parser.add_argument('--ignore-history', action='store_true',
+                        help="Leave Layer 3 hold-over boxes out of the reference mask "
+                             "(e.g. when comparing the worker pool's IoU tracking against ByteTrack)")
+    parser.add_argument('--json', default=None, help="Write the check results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {k: getattr(args, k) for k in ('mode', 'workers', 'layers', 'latency_ms', 'decoder',
+                                            'frame_cache', 'real')}
+    specs = [VideoSpec.parse(v) for v in args.videos]
+    results = []
+    failed = False
+
+    for spec in specs:
+        video_path = make_video(spec, args.video_dir)
+        path = golden_path(args.golden_dir, spec)
+
+        if args.command == 'record':
+            recorder, elapsed = run_config(video_path, config)
+            recorder.meta.update(seconds=elapsed, video=spec.name)
+            recorder.save(path)
+            print(f"[INFO] Golden recorded: {path} ({recorder.frame_count} frames, {elapsed:.2f}s)")
+            continue
+
+        if not os.path.exists(path):
+            print(f"[ERROR] No golden file for {spec.name}; run `record` first: {path}")
+            failed = True
+            continue
+        reference = VideoDetectionCache.load(path)
+        recorder, elapsed = run_config(video_path, config)
+        with tempfile.TemporaryDirectory(prefix='golden_') as tmp:
+            # Round-trip through the file format so both sides are read the same way
+            recorder.save(os.path.join(tmp, 'candidate.npz'))
+            candidate = VideoDetectionCache.load(os.path.join(tmp, 'candidate.npz'))
+        cov = coverage(reference, candidate, spec.width, spec.height, args.frame_recall, args.ignore_history)
+        speedup = reference.meta['seconds'] / elapsed if elapsed > 0 else 0.0
+        problems = []
+        if not cov['frame_count_match']:
+            problems.append(f"frame count {candidate.frame_count} != {reference.frame_count}")
+        if cov['mean_recall'] < args.min_recall:
+            problems.append(f"mean recall {cov['mean_recall']:.4f} < {args.min_recall}")
+        if cov['uncovered_frames'] > args.max_uncovered:
+            problems.append(f"{cov['uncovered_frames']} uncovered frames (first: {cov['first_uncovered']})")
+        if cov['extra_area'] > args.max_extra:
+            problems.append(f"extra area {cov['extra_area']:.1%} > {args.max_extra:.0%}")
+        failed = failed or bool(problems)
+        print(f"[{'FAIL' if problems else 'OK'}] {spec.name}: speedup x{speedup:.2f} | recall mean "
+              f"{cov['mean_recall']:.4f} min {cov['min_recall']:.4f} | uncovered {cov['uncovered_frames']} "
+              f"| extra {cov['extra_area']:.1%}" + (f" | {'; '.join(problems)}" if problems else ''))
+        results.append({'video': spec.name, 'reference': reference.meta.get('config'), 'candidate': config,
+                        'speedup': speedup, 'seconds': elapsed, 'problems': problems, **cov})
+
+    if args.json and results:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.json}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Pipeline Benchmark
+Runs the video loop over synthetic videos for every combination of model
+layers, mosaic pattern, pipeline mode and encoder, and writes fps, per-stage
+times and memory to JSON (compare runs with bench/compare.py). Uses the stub
+detector by default, the real models with --real.
+
+    python bench/run_bench.py --videos 1280x720@30:5 1920x1080@30:5 --layers 2 1,2,4 \
+        --modes serial pooled --encoders null mp4v x264
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from functools import partial
+
+import cv2
+import numpy as np
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_ROOT = os.path.dirname(_BENCH_DIR)
+sys.path.insert(0, _REPO_ROOT)
+
+from bench_decode import bench_backend  # noqa: E402
+from synthetic import VideoSpec, make_stub_detector, make_video  # noqa: E402
+from mosaic_core.decode import available_backends, open_video  # noqa: E402
+from mosaic_core.ffmpeg_io import FfmpegPipeWriter  # noqa: E402
+from mosaic_core.metrics import RssMonitor  # noqa: E402
+from mosaic_core.profiler import profiler  # noqa: E402
+from mosaic_core.render import LiveDetection, PATTERNS, render_video  # noqa: E402
+from mosaic_core.thread_budget import MODE_PROCESSES, configure_threads, plan_threads  # noqa: E402
+from mosaic_core.worker_pool import DetectionWorkerPool, render_video_pooled  # noqa: E402
+
+MODE_SERIAL = 'serial'
+MODE_POOLED = 'pooled'
+ENCODERS = ('null', 'mp4v', 'x264', 'x264-ultrafast')
+YOLO_WEIGHTS = os.path.join(_REPO_ROOT, 'erax_nsfw_yolo11m.pt')
+DEFAULT_VIDEO_DIR = os.path.join(_REPO_ROOT, 'cache', 'bench_videos')
+DEFAULT_OUT_DIR = os.path.join(_REPO_ROOT, 'output', 'bench')
+_MB = 1024 * 1024
+
+
+class NullWriter:
+    """書き込みを捨てるライター (エンコードを除いた計測用)"""
+
+    def write(self, frame):
+        pass
+
+    def release(self):
+        return True
+
+
+def open_writer(encoder: str, path: str, width: int, height: int, fps: float):
+    if encoder == 'null':
+        return NullWriter()
+    if encoder == 'mp4v':
+        return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if encoder == 'x264':
+        return FfmpegPipeWriter(path, width, height, fps)
+    if encoder == 'x264-ultrafast':
+        return FfmpegPipeWriter(path, width, height, fps, preset='ultrafast')
+    raise ValueError(f"Unknown encoder: {encoder}")
+
+
+def git_revision():
+    """(short commit, dirty) of the repository, or (None, None) outside git."""
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=_REPO_ROOT,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    cwd=_REPO_ROOT, capture_output=True, text=True).stdout.strip())
+        return rev, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def parse_layers(text: str):
+    layers = tuple(sorted(int(v) for v in text.split(',')))
+    if not set(layers) <= {1, 2, 4}:
+        raise argparse.ArgumentTypeError(f"Layers must be from 1, 2, 4: {text}")
+    return layers
+
+
+def make_factory(layers, latency_ms: float, real: bool):
+    """Detector factory (picklable, for the worker pool too)."""
+    if real:
+        from mosaic_core.detection import load_detector
+        return partial(load_detector, YOLO_WEIGHTS, os.path.join(_REPO_ROOT, 'tmp'),
+                       tracking=1 in layers, nudenet=4 in layers)
+    return partial(make_stub_detector, layers, latency_ms)
+
+
+def run_case(video_path: str, spec: VideoSpec, detector, pool, pattern: str, encoder: str,
+             out_dir: str, case_name: str) -> dict:
+    """One timed pass of the video loop. Returns the measurements."""
+    cap = open_video(video_path)
+    out_path = os.path.join(out_dir, f"_bench_{os.getpid()}.mp4")
+    writer = open_writer(encoder, out_path, spec.width, spec.height, spec.fps)
+    monitor = RssMonitor(interval=10)
+    profiler.begin_video(case_name)
+    try:
+        if pool is not None:
+            stats = render_video_pooled(cap, writer, pool, pattern, spec.frames, monitor=monitor)
+        else:
+            stats = render_video(cap, writer, LiveDetection(detector), pattern, spec.frames, monitor=monitor)
+        # Include the encoder flush in the timing
+        with profiler.span('release'):
+            writer.release()
+    finally:
+        cap.release()
+    summary = profiler.end_video(stats['frames'], max(monitor.samples) if monitor.samples else None,
+                                 report=False)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    return {
+        'frames': stats['frames'],
+        'detected_frames': stats['detected_frames'],
+        'seconds': summary['seconds'],
+        'fps': summary['fps'],
+        'rss_steady_mb': round(monitor.steady / _MB, 1) if monitor.steady is not None else None,
+        'rss_peak_mb': summary['peak_rss_mb'],
+        'stages': summary['stages'],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic-video pipeline benchmark")
+    parser.add_argument('--videos', nargs='+', default=['640x360@30:5', '1280x720@30:5', '1920x1080@30:5'],
+                        help="Synthetic video specs WxH[@fps[:seconds]]")
+    parser.add_argument('--rects', type=int, default=3, help="Moving rectangles per video")
+    parser.add_argument('--layers', nargs='+', type=parse_layers, default=[(1, 2, 4)],
+                        help="Layer sets to run, e.g. 2 1,2 1,2,4")
+    parser.add_argument('--patterns', nargs='+', default=["モザイク中"],
+                        help=f"Mosaic patterns ({', '.join(PATTERNS)}) or 'all'")
+    parser.add_argument('--modes', nargs='+', choices=(MODE_SERIAL, MODE_POOLED), default=[MODE_SERIAL])
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes for the pooled mode")
+    parser.add_argument('--encoders', nargs='+', choices=ENCODERS, default=['null', 'mp4v'])
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Stub detector latency per layer call")
+    parser.add_argument('--real', action='store_true', help="Use the real YOLO / NudeNet models")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case (the fastest is kept)")
+    parser.add_argument('--no-decode', action='store_true', help="Skip the decode backend comparison")
+    parser.add_argument('--video-dir', default=DEFAULT_VIDEO_DIR, help="Where synthetic videos are cached")
+    parser.add_argument('--out', default=None, help="Result JSON (default: output/bench/bench_<commit>_<time>.json)")
+    args = parser.parse_args(argv)
+    if args.patterns == ['all']:
+        args.patterns = list(PATTERNS)
+    for p in args.patterns:
+        if p not in PATTERNS:
+            parser.error(f"Unknown pattern: {p}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.real and not os.path.exists(YOLO_WEIGHTS):
+        print(f"[ERROR] --real needs the YOLO weights: {YOLO_WEIGHTS}")
+        return 1
+    layout = configure_threads()
+    profiler.enable()
+    rev, dirty = git_revision()
+    os.makedirs(DEFAULT_OUT_DIR, exist_ok=True)
+    out_json = args.out or os.path.join(
+        DEFAULT_OUT_DIR, f"bench_{rev or 'nogit'}{'-dirty' if dirty else ''}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    specs = [replace(VideoSpec.parse(v), rects=args.rects) for v in args.videos]
+    videos = []
+    for spec in specs:
+        path = make_video(spec, args.video_dir)
+        videos.append((spec, path))
+        print(f"[INFO] Video: {path} ({spec.frames} frames)")
+
+    results = {
+        'meta': {
+            'commit': rev,
+            'dirty': dirty,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'cpus': os.cpu_count(),
+            'threads': layout.describe(),
+            'detector': 'real' if args.real else f"stub ({args.latency_ms:g} ms/layer)",
+        },
+        'decode': [],
+        'runs': [],
+    }
+
+    if not args.no_decode:
+        for (spec, path), backend in itertools.product(videos, available_backends()):
+            r = bench_backend(path, backend)
+            r['video'] = spec.name
+            results['decode'].append(r)
+            print(f"[INFO] decode {spec.name} {backend}: {r['fps']:.1f} fps")
+
+    for layers, mode in itertools.product(args.layers, args.modes):
+        factory = make_factory(layers, args.latency_ms, args.real)
+        pool = detector = None
+        if mode == MODE_POOLED:
+            pool = DetectionWorkerPool(factory, args.workers, plan_threads(MODE_PROCESSES, args.workers))
+        else:
+            detector = factory()
+        try:
+            for (spec, path), pattern, encoder in itertools.product(videos, args.patterns, args.encoders):
+                case = {
+                    'video': spec.name,
+                    'layers': ','.join(map(str, layers)),
+                    'pattern': pattern,
+                    'pattern_index': PATTERNS.index(pattern),
+                    'mode': mode,
+                    'workers': args.workers if mode == MODE_POOLED else 1,
+                    'encoder': encoder,
+                }
+                name = ' '.join(f"{k}={case[k]}" for k in ('video', 'layers', 'pattern_index', 'mode', 'encoder'))
+                best = None
+                for _ in range(max(1, args.repeat)):
+                    r = run_case(path, spec, detector, pool, pattern, encoder, DEFAULT_OUT_DIR, name)
+                    if best is None or r['fps'] > best['fps']:
+                        best = r
+                results['runs'].append({**case, **best})
+                print(f"[INFO] {name}: {best['fps']:.1f} fps, RSS peak {best['rss_peak_mb']} MB")
+        finally:
+            if pool is not None:
+                pool.close()
+
+    with open(out_json, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Results written to {out_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
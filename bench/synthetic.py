@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Synthetic Benchmark Inputs
+Deterministic test videos (saturated rectangles bouncing over a grey
+gradient) and a stub MultiLayerDetector that finds them by colour, with a
+configurable per-layer latency. Neither needs model weights or real footage.
+"""
+
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mosaic_core.detection import IouTracker, MultiLayerDetector  # noqa: E402
+
+Box = Tuple[int, int, int, int]
+
+# BGR, all strongly saturated so the stub can threshold on HSV saturation
+_COLOURS = [(40, 40, 230), (40, 200, 40), (230, 60, 40), (30, 200, 230), (200, 40, 200), (230, 200, 30)]
+_MIN_AREA = 64
+
+
+@dataclass(frozen=True)
+class VideoSpec:
+    """合成テスト動画の仕様"""
+    width: int = 1280
+    height: int = 720
+    fps: float = 30.0
+    seconds: float = 10.0
+    rects: int = 3
+    seed: int = 0
+
+    @property
+    def frames(self) -> int:
+        return int(round(self.fps * self.seconds))
+
+    @property
+    def name(self) -> str:
+        return f"synth_{self.width}x{self.height}_{self.fps:g}fps_{self.seconds:g}s_r{self.rects}_s{self.seed}"
+
+    @classmethod
+    def parse(cls, text: str) -> 'VideoSpec':
+        """'1280x720@30:10' -> 1280x720, 30 fps, 10 seconds (fps / seconds optional)."""
+        size, _, rest = text.partition('@')
+        w, h = (int(v) for v in size.lower().split('x'))
+        fps, _, seconds = rest.partition(':')
+        return cls(w, h, float(fps or 30.0), float(seconds or 10.0))
+
+
+def _motion(spec: VideoSpec):
+    """Per-rectangle (size, start position, velocity in px/frame), fixed by the seed."""
+    rng = np.random.default_rng(spec.seed)
+    short = min(spec.width, spec.height)
+    sizes = rng.uniform(0.12, 0.3, (spec.rects, 2)) * short
+    starts = rng.uniform(0.0, 1.0, (spec.rects, 2)) * (np.array([spec.width, spec.height]) - sizes)
+    speed = short / spec.fps * 0.25  # A quarter of the short side per second
+    angles = rng.uniform(0, 2 * np.pi, spec.rects)
+    velocity = np.stack([np.cos(angles), np.sin(angles)], axis=1) * speed
+    return sizes, starts, velocity
+
+
+def _bounce(start: np.ndarray, velocity: np.ndarray, span: np.ndarray, t: int) -> np.ndarray:
+    pos = np.abs((start + velocity * t) % (2 * span))
+    return np.where(pos > span, 2 * span - pos, pos)
+
+
+def synthetic_boxes(spec: VideoSpec, frame_idx: int) -> List[Box]:
+    """Ground-truth rectangle boxes (x1, y1, x2, y2) on a frame (0-based)."""
+    sizes, starts, velocity = _motion(spec)
+    span = np.array([spec.width, spec.height]) - sizes
+    boxes = []
+    for size, start, vel, sp in zip(sizes, starts, velocity, span):
+        x, y = _bounce(start, vel, sp, frame_idx)
+        boxes.append((int(x), int(y), int(x + size[0]), int(y + size[1])))
+    return boxes
+
+
+def render_frame(spec: VideoSpec, frame_idx: int, background: Optional[np.ndarray] = None) -> np.ndarray:
+    """One BGR frame of the synthetic video."""
+    if background is None:
+        background = _background(spec)
+    frame = background.copy()
+    for i, (x1, y1, x2, y2) in enumerate(synthetic_boxes(spec, frame_idx)):
+        cv2.rectangle(frame, (x1, y1), (x2 - 1, y2 - 1), _COLOURS[i % len(_COLOURS)], -1)
+    return frame
+
+
+def _background(spec: VideoSpec) -> np.ndarray:
+    # Low-saturation gradient plus fixed texture, so encoders have real work to do
+    x = np.linspace(40, 140, spec.width, dtype=np.float32)
+    y = np.linspace(0, 40, spec.height, dtype=np.float32)[:, None]
+    grey = x[None, :] + y
+    texture = np.random.default_rng(spec.seed + 1).integers(0, 12, (spec.height, spec.width))
+    grey = np.clip(grey + texture, 0, 255).astype(np.uint8)
+    return cv2.merge([grey, grey, grey])
+
+
+def make_video(spec: VideoSpec, out_dir: str) -> str:
+    """Write the synthetic video (once) and return its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, spec.name + ".mp4")
+    if os.path.exists(path):
+        return path
+    tmp_path = path + ".part.mp4"
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'mp4v'), spec.fps, (spec.width, spec.height))
+    if not writer.isOpened():
+        raise IOError(f"Cannot create synthetic video: {path}")
+    background = _background(spec)
+    for i in range(spec.frames):
+        writer.write(render_frame(spec, i, background))
+    writer.release()
+    os.replace(tmp_path, path)
+    return path
+
+
+def find_rects(frame_rgb: np.ndarray) -> List[Box]:
+    """Boxes of the saturated rectangles in a frame (sorted, deterministic)."""
+    hsv = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2HSV)
+    mask = cv2.inRange(hsv, (0, 128, 60), (180, 255, 255))
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    boxes = [(int(x), int(y), int(x + w), int(y + h)) for x, y, w, h, area in stats[1:n] if area >= _MIN_AREA]
+    return sorted(boxes)
+
+
+class StubDetector(MultiLayerDetector):
+    """重みファイル不要のスタブ検出器 (色で矩形を検出し、指定の遅延を加える)"""
+
+    def __init__(self, layers: Sequence[int] = (1, 2, 4), latency_ms: float = 0.0,
+                 nn_tmp_path: Optional[str] = None):
+        """
+        Args:
+            layers: Enabled model layers (1 = tracking, 2 = detection, 4 = NudeNet)
+            latency_ms: Sleep added to every enabled layer call (simulated inference)
+            nn_tmp_path: Unused; accepted like the real detector's
+        """
+        enabled = object()
+        super().__init__(model=enabled if 1 in layers else None,
+                         model_detect=enabled if 2 in layers else None,
+                         model_nudenet=enabled if 4 in layers else None,
+                         nn_tmp_path=nn_tmp_path)
+        self.latency = latency_ms / 1000.0
+        self._tracker = IouTracker()
+
+    def _infer(self, frame_rgb) -> List[Box]:
+        if self.latency:
+            time.sleep(self.latency)
+        return find_rects(frame_rgb)
+
+    def track(self, frame_rgb, conf=None):
+        if self.model is None:
+            return []
+        return self._tracker.update(self._infer(frame_rgb))
+
+    def detect(self, frame_rgb, conf=None, imgsz=None):
+        if self.model_detect is None:
+            return []
+        return [(b, 0.9) for b in self._infer(frame_rgb)]
+
+    def nudenet(self, frame_rgb):
+        if self.model_nudenet is None:
+            return []
+        # Slightly larger boxes, like a second model disagreeing at the edges
+        return [((x1 - 4, y1 - 4, x2 + 4, y2 + 4), 0.8) for x1, y1, x2, y2 in self._infer(frame_rgb)]
+
+    def reset_tracker(self):
+        self._tracker = IouTracker()
+
+
+def make_stub_detector(layers: Sequence[int] = (1, 2, 4), latency_ms: float = 0.0,
+                       nn_tmp_name: Optional[str] = None) -> StubDetector:
+    """Picklable detector factory for DetectionWorkerPool (see functools.partial)."""
+    return StubDetector(layers, latency_ms)
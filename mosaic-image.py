@@ -7,10 +7,32 @@ import tkinter.filedialog as tkFileDialog
 from PIL import Image
 from PIL import ImageFilter
 from ultralytics import YOLO
+from mosaic_core.image_cache import ImageDetectionCache
+from mosaic_core.image_encode import (
+    IMAGE_JPEG_QUALITY, IMAGE_PNG_LEVEL, EncodeOptions, encode_image, load_image, output_name, parse_jpeg_quality,
+)
+from mosaic_core.image_pipeline import (
+    IMAGE_DECODE_WORKERS, IMAGE_ENCODE_WORKERS, IMAGE_MEMORY_BUDGET, ImagePipeline,
+)
+from mosaic_core.animation import (
+    animation_bytes, cover_boxes, detect_animation, is_animated, read_animation, save_animation,
+)
+from mosaic_core.hashing import model_hash
+from mosaic_core.images import (
+    IMAGE_BATCH_SIZE, IMAGE_CONF, IMAGE_IOU, IMAGE_SHRINK, IMAGE_SKIP_CLASSES, detect_images, group_duplicates,
+    image_size, link_or_copy, list_images, mosaic_boxes, plan_batches, to_model_input,
+)
+from mosaic_core.processed import PROCESSED_MANIFEST, ProcessedManifest
+from mosaic_core.thread_budget import configure_threads
+from mosaic_core.tiling import (
+    IMAGE_PIXEL_LIMIT_FACTOR, IMAGE_TILE_OVERLAP, IMAGE_TILE_PIXELS, IMAGE_TILE_SIZE, detect_tiled, open_large,
+)
 # EraX-NSFW-V1.0のクラス名（https://huggingface.co/erax-ai/EraX-NSFW-V1.0?not-for-all-audiences=true）
 names = ['anus', 'make_love', 'nipple', 'penis', 'vagina']
 # モデルの初期化（https://huggingface.co/erax-ai/EraX-NSFW-V1.0/blob/main/erax_nsfw_yolo11m.pt）
 yolo_model_path = os.path.join(os.path.dirname(__file__), 'erax_nsfw_yolo11m.pt')
+IMAGE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'image_detections.sqlite')
+configure_threads()
 model = YOLO(yolo_model_path)
 
 def ask_mosaic_pattern():
@@ -87,51 +109,59 @@ def apply_pattern(region, pattern):
     else:
         return region
 
-def auto_apply_mosaic(image, pattern):
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-        image.save(tmp.name)
-        tmp_path = tmp.name
-    # オブジェクト検出モデルを実行し、結果を取得
-    # conf: 信頼度閾値, iou: IoU閾値
-    results = model(tmp_path, conf=0.15, iou=0.3)
+def auto_apply_mosaic(image, pattern, detections=None):
+    """Apply the pattern to the detected areas. detections: this image's detect_images() result
+    (from a batch); when None the image is detected on its own."""
+    if detections is None:
+        # オブジェクト検出モデルを実行し、結果を取得 (conf: 信頼度閾値, iou: IoU閾値)
+        detections = detect_images(model, [to_model_input(image)], names)[0]
     # 処理対象の画像サイズを出力
     print(f"画像サイズ: {image.width}x{image.height}")
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-            conf = float(box.conf[0])
-            cls_idx = int(box.cls[0])
-            cls_name = names[cls_idx] if cls_idx < len(names) else ""
-            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-            print(f"検出: class={cls_name}, conf={conf:.2f}, box=(x1={x1}, y1={y1}, x2={x2}, y2={y2}), center=({cx}, {cy})")
-            if cls_name in ["make_love", "nipple"]:
-                continue
-            w, h = x2 - x1, y2 - y1
-            if w < 10 or h < 10:
-                continue
-            # --- モザイクの範囲を一回り小さく ---
-            shrink_ratio_w = 0.75  # ヨコの範囲を75%ずつ内側に
-            shrink_ratio_h = 0.45  # タテの範囲を45%ずつ内側に
-            dx = int(w * shrink_ratio_w / 2)
-            dy = int(h * shrink_ratio_h / 2)
-            sx1 = x1 + dx
-            sy1 = y1 + dy
-            sx2 = x2 - dx
-            sy2 = y2 - dy
-            if sx2 <= sx1 or sy2 <= sy1:
-                continue
-            region = image.crop((sx1, sy1, sx2, sy2))
-            mosaic = apply_pattern(region, pattern)
-            image.paste(mosaic, (sx1, sy1, sx2, sy2))
-    os.remove(tmp_path)
+    for (x1, y1, x2, y2), cls_name, conf in detections:
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        print(f"検出: class={cls_name}, conf={conf:.2f}, box=(x1={x1}, y1={y1}, x2={x2}, y2={y2}), center=({cx}, {cy})")
+    # --- モザイクの範囲を一回り小さく (ヨコ75% / タテ45% 内側に) ---
+    for box in mosaic_boxes(detections):
+        region = image.crop(box)
+        mosaic = apply_pattern(region, pattern)
+        image.paste(mosaic, box)
     return image
 
-def main():
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="画像自動モザイク")
+    parser.add_argument('folder', nargs='?', help="画像フォルダ (省略時はダイアログで選択)")
+    parser.add_argument('--batch', type=int, default=IMAGE_BATCH_SIZE,
+                        help=f"1回の推論でまとめて検出する画像数 (default: {IMAGE_BATCH_SIZE})")
+    parser.add_argument('--force', action='store_true',
+                        help="処理済みマニフェストを無視して全ての画像を再処理")
+    parser.add_argument('--tile-pixels', type=int, default=IMAGE_TILE_PIXELS,
+                        help=f"この画素数を超える画像をタイル分割で検出・処理 (default: {IMAGE_TILE_PIXELS})")
+    parser.add_argument('--tile-size', type=int, default=IMAGE_TILE_SIZE,
+                        help=f"タイル分割時のタイルの一辺 px (default: {IMAGE_TILE_SIZE})")
+    parser.add_argument('--jpeg-quality', type=parse_jpeg_quality, default=IMAGE_JPEG_QUALITY,
+                        help=f"JPEG 出力の品質 1-100、keep は元画像の量子化テーブルを再利用 (default: {IMAGE_JPEG_QUALITY})")
+    parser.add_argument('--png-level', type=int, choices=range(10), default=IMAGE_PNG_LEVEL, metavar='0-9',
+                        help=f"PNG 出力の圧縮レベル (default: {IMAGE_PNG_LEVEL})")
+    parser.add_argument('--webp-lossless', action='store_true',
+                        help="静止画を可逆 WebP (.webp) で保存")
+    parser.add_argument('--decode-workers', type=int, default=IMAGE_DECODE_WORKERS,
+                        help=f"画像を先読みデコードするスレッド数 (default: {IMAGE_DECODE_WORKERS})")
+    parser.add_argument('--encode-workers', type=int, default=IMAGE_ENCODE_WORKERS,
+                        help=f"処理済み画像を保存するスレッド数 (default: {IMAGE_ENCODE_WORKERS})")
+    parser.add_argument('--memory-mb', type=int, default=IMAGE_MEMORY_BUDGET // (1024 * 1024),
+                        help=f"先読み・保存待ちの画像に使うメモリ上限 MB (default: {IMAGE_MEMORY_BUDGET // (1024 * 1024)})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     import tkinter.messagebox as tkMessageBox
     from tkinter import ttk
+    args = parse_args(argv)
+    # Scans / panoramas are legitimately huge (the tiled path bounds their cost): raise PIL's
+    # decompression-bomb limit with the tile threshold instead of the 89 MP default
+    Image.MAX_IMAGE_PIXELS = IMAGE_PIXEL_LIMIT_FACTOR * args.tile_pixels
     # 引数がなければGUIでフォルダ選択
-    if len(sys.argv) == 1:
+    if args.folder is None:
         root = tk.Tk()
         root.withdraw()
         folder = tkFileDialog.askdirectory(title="画像フォルダを選択してください")
@@ -139,25 +169,49 @@ def main():
         if not folder:
             print("フォルダが選択されませんでした。処理を中止します。")
             sys.exit(1)
-    elif len(sys.argv) == 2:
-        folder = sys.argv[1]
     else:
-        print("使い方: python mosaic-auto.py <画像フォルダ>")
-        sys.exit(1)
+        folder = args.folder
     if not os.path.isdir(folder):
         print("指定されたパスはフォルダではありません")
         sys.exit(1)
+    folder = os.path.normpath(folder)
     out_folder = folder + "_mc"
-    exts = (".jpg", ".jpeg", ".png", ".gif")
-    files = [f for f in sorted(os.listdir(folder)) if f.lower().endswith(exts)]
-    if not files:
+    # Sub-folders are mirrored into out_folder
+    all_files = list_images(folder)
+    if not all_files:
         print("画像ファイルが見つかりません")
         sys.exit(1)
     pattern = ask_mosaic_pattern()
     if pattern is None:
         print("キャンセルされました。処理を中止します。")
         return
-    out_folder_created = False
+
+    # Skip images whose output is up to date (same source, model and settings; O(stat) per file)
+    processed = ProcessedManifest(os.path.join(out_folder, PROCESSED_MANIFEST), save_interval=5.0)
+    detection_hash = model_hash(yolo_model_path)
+    settings = {'pattern': pattern, 'conf': IMAGE_CONF, 'iou': IMAGE_IOU,
+                'shrink': IMAGE_SHRINK, 'skip_classes': sorted(IMAGE_SKIP_CLASSES)}
+    encode_options = EncodeOptions(args.jpeg_quality, args.png_level, args.webp_lossless)
+    settings['encode'] = encode_options.settings()
+    files = []
+    for f in all_files:
+        if args.force or processed.check(os.path.join(folder, f), os.path.join(out_folder, output_name(f, encode_options)),
+                                         detection_hash, settings) is not None:
+            files.append(f)
+    skipped = len(all_files) - len(files)
+    if skipped:
+        print(f"[INFO] {skipped} image(s) unchanged since the last run, skipped (--force to redo)")
+    # Byte-identical images are rendered once; the copies get a link (or copy) of the output
+    duplicates = group_duplicates(folder, files)
+    copies = {f for dups in duplicates.values() for f in dups}
+    if copies:
+        print(f"[INFO] {len(copies)} duplicate image(s) will reuse the output of an identical file")
+    files = [f for f in files if f not in copies]
+    if not files:
+        processed.flush()  # mtime refreshes from check()
+        print("処理が必要な画像はありません")
+        tkMessageBox.showinfo("完了", f"全ての画像が処理済みです（{skipped}枚スキップ）。")
+        return
 
     # --- 進捗バー用ウィンドウ ---
     progress_root = tk.Tk()
@@ -185,29 +239,178 @@ def main():
     percent_label.pack(pady=2)
     progress_root.update()
 
-    for idx, fname in enumerate(files, 1):
-        in_path = os.path.join(folder, fname)
-        out_path = os.path.join(out_folder, fname)
-        status_label.config(text=f"{fname} ({idx}/{len(files)})")
-        percent = int(idx / len(files) * 100)
-        percent_label.config(text=f"進捗: {percent}%")
+    # Batches of similar aspect ratio, detected in one call each (sizes come from the headers)
+    sizes = {f: image_size(os.path.join(folder, f)) for f in files}
+    # Very large images are detected in tiles, one at a time, outside the batches
+    large = [f for f in files if sizes[f] is not None and sizes[f][0] * sizes[f][1] > args.tile_pixels]
+    # Animated GIF / WebP: every frame, with tracking across frames
+    large_set = set(large)
+    animated = [f for f in files if f not in large_set and is_animated(os.path.join(folder, f))]
+    special = large_set | set(animated)
+    small = [f for f in files if f not in special]
+
+    # Detections of images seen before (same content, same model) come from the cache:
+    # a new pattern / shrink / class filter only decodes and composites
+    cache = ImageDetectionCache(IMAGE_CACHE_PATH, f"{detection_hash}:{IMAGE_CONF}:{IMAGE_IOU}", names)
+    contents = {}
+    for f in files:
+        try:
+            contents[f] = cache.content_key(os.path.join(folder, f))
+        except OSError:
+            contents[f] = None
+    cached = {}
+    for f in small:
+        hit = cache.get(contents[f]) if contents[f] is not None else None
+        if hit is not None:
+            cached[f] = hit[0]
+    to_detect = [f for f in small if f not in cached]
+    if cached:
+        print(f"[INFO] {len(cached)} image(s) have cached detections")
+    batches = [[to_detect[i] for i in batch] for batch in plan_batches([sizes[f] for f in to_detect], args.batch)]
+    hits = [f for f in small if f in cached]
+    batches += [hits[k:k + args.batch] for k in range(0, len(hits), max(1, args.batch))]
+
+    def decode(fname):
+        return load_image(os.path.join(folder, fname))
+
+    def finish(fname, save):
+        """Write fname's output with save(out_path), record it and link its duplicates."""
+        out_path = os.path.join(out_folder, output_name(fname, encode_options))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        # Never write through a hard link left by a previous run's duplicate
+        if os.path.lexists(out_path):
+            os.remove(out_path)
+        save(out_path)
+        processed.record(os.path.join(folder, fname), out_path, detection_hash, settings)
+        for dup in duplicates.get(fname, ()):
+            dup_path = os.path.join(out_folder, output_name(dup, encode_options))
+            link_or_copy(out_path, dup_path)
+            processed.record(os.path.join(folder, dup), dup_path, detection_hash, settings)
+
+    def encode(fname, img):
+        finish(fname, lambda out_path: encode_image(img, out_path, encode_options))
+
+    def cost(fname):
+        # PIL holds RGB images as 4 bytes per pixel
+        w, h = sizes[fname] or (0, 0)
+        return w * h * 4
+
+    # Decoder threads read ahead and encoder threads save, within a memory budget;
+    # this (Tk) thread only detects and composites
+    pipeline = ImagePipeline(decode, encode, cost, args.decode_workers, args.encode_workers,
+                             args.memory_mb * 1024 * 1024)
+    idx = 0
+    for images in pipeline.decoded(batches, on_idle=progress_root.update):
+        for fname, _, error in images:
+            if error is not None:
+                print(f"エラー: {fname}: {error}")
+                idx += 1
+        images = [(fname, img) for fname, img, error in images if error is None]
+        new = [(fname, img) for fname, img in images if fname not in cached]
+        try:
+            found = detect_images(model, [to_model_input(img) for _, img in new], names)
+        except Exception as e:
+            print(f"エラー: 検出に失敗しました ({', '.join(f for f, _ in new)}): {e}")
+            for fname, _ in images:
+                pipeline.discard(fname)
+            idx += len(images)
+            continue
+        for (fname, _), dets in zip(new, found):
+            cached[fname] = dets
+            if contents[fname] is not None:
+                cache.put(contents[fname], [dets])
+        detections = [cached.pop(fname) for fname, _ in images]
+        for (fname, img), dets in zip(images, detections):
+            idx += 1
+            status_label.config(text=f"{fname} ({idx}/{len(files)})")
+            percent = int(idx / len(files) * 100)
+            percent_label.config(text=f"進捗: {percent}%")
+            progress_var.set(idx-1)
+            progress_root.update()
+            try:
+                img = auto_apply_mosaic(img, pattern, dets)
+                pipeline.write(fname, img)
+            except Exception as e:
+                print(f"エラー: {fname}: {e}")
+                pipeline.discard(fname)
+    status_label.config(text="保存中...")
+    pipeline.close(on_idle=progress_root.update)
+    written = pipeline.written
+    for fname in large:
+        idx += 1
+        percent_label.config(text=f"進捗: {int(idx / len(files) * 100)}%")
         progress_var.set(idx-1)
-        progress_root.update()
+
+        def on_tiles(done, total, fname=fname, n=idx):
+            status_label.config(text=f"{fname} ({n}/{len(files)}) タイル {done}/{total}")
+            progress_root.update()
+
+        on_tiles(0, 0)
+        try:
+            img = open_large(os.path.join(folder, fname))
+            variant = f"tiled:{args.tile_size}"
+            hit = cache.get(contents[fname], variant) if contents[fname] is not None else None
+            if hit is not None:
+                dets = hit[0]
+            else:
+                dets = detect_tiled(model, img, names, args.tile_size, IMAGE_TILE_OVERLAP, args.batch, on_tiles)
+                if contents[fname] is not None:
+                    cache.put(contents[fname], [dets], variant)
+            img = auto_apply_mosaic(img, pattern, dets)
+            finish(fname, lambda out_path: encode_image(img, out_path, encode_options))
+            written += 1
+        except Exception as e:
+            print(f"エラー: {fname}: {e}")
+        img = None
+    for fname in animated:
+        idx += 1
+        percent_label.config(text=f"進捗: {int(idx / len(files) * 100)}%")
+        progress_var.set(idx-1)
+
+        def on_frames(done, total, fname=fname, n=idx):
+            status_label.config(text=f"{fname} ({n}/{len(files)}) フレーム {done}/{total}")
+            progress_root.update()
+
+        on_frames(0, 0)
+        nbytes = 0
         try:
-            img = Image.open(in_path).convert("RGB")
-            img = auto_apply_mosaic(img, pattern)
-            if not out_folder_created:
-                os.makedirs(out_folder, exist_ok=True)
-                out_folder_created = True
-            img.save(out_path)
+            # Every frame stays decoded until the save: charge them all to the memory budget
+            nbytes = animation_bytes(os.path.join(folder, fname))
+            if nbytes > pipeline.budget.limit:
+                print(f"[WARNING] {fname}: decoded frames need {nbytes / (1024 * 1024):.0f} MB "
+                      f"(--memory-mb {args.memory_mb})")
+            pipeline.budget.acquire(nbytes)
+            anim = read_animation(os.path.join(folder, fname))
+            frame_dets = cache.get(contents[fname], 'animation') if contents[fname] is not None else None
+            if frame_dets is None or len(frame_dets) != len(anim.frames):
+                frame_dets = detect_animation(model, anim, names, args.batch, on_frames)
+                print(f"[INFO] {fname}: {anim.info['frames']} frames, detected on {anim.info['inferred']} "
+                      f"({anim.info['partial']} changed area only), {anim.info['unchanged']} unchanged")
+                if contents[fname] is not None:
+                    cache.put(contents[fname], frame_dets, 'animation')
+            boxes = cover_boxes(frame_dets)
+            for frame, frame_boxes in zip(anim.frames, boxes):
+                for box in frame_boxes:
+                    frame.paste(apply_pattern(frame.crop(box), pattern), box)
+            finish(fname, lambda out_path, anim=anim: save_animation(anim, out_path))
+            written += 1
         except Exception as e:
             print(f"エラー: {fname}: {e}")
+        pipeline.budget.release(nbytes)
+        anim = None
+    processed.flush()
+    print(f"[INFO] {cache.report()}")
+    cache.close()
+    for fname, e in pipeline.errors:
+        print(f"エラー: {fname}: 保存に失敗しました: {e}")
+    print(f"[INFO] {written}/{len(files)} images saved (peak decoded memory {pipeline.budget.peak / (1024 * 1024):.0f} MB), "
+          f"{len(copies)} duplicate(s) linked, {skipped} skipped")
     progress_var.set(len(files))
     status_label.config(text="完了")
     percent_label.config(text="進捗: 100%")
     progress_root.update()
-    tkMessageBox.showinfo("完了", "全ての画像の処理が完了しました。", parent=progress_root)
+    tkMessageBox.showinfo("完了", f"全ての画像の処理が完了しました。\n処理: {len(files)}枚 / 重複: {len(copies)}枚 / スキップ: {skipped}枚", parent=progress_root)
     progress_root.destroy()
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,136 @@
+import os
+import tkinter as tk
+import tkinter.filedialog as tkFileDialog
+import tkinter.messagebox as tkMessageBox
+from tkinter import ttk
+
+from mosaic_core.decode import BACKEND_OPENCV, DECODE_BACKENDS
+from mosaic_core.detection import load_detector
+from mosaic_core.thread_budget import configure_threads
+from mosaic_core.triage import TRIAGE_SAMPLE_FPS, triage_video, write_triage_report
+
+# --- Constants for Directories ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMP_DIR = os.path.join(BASE_DIR, 'tmp')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+TRIAGE_DIR = os.path.join(OUTPUT_DIR, 'triage')
+
+VIDEO_EXTS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(TRIAGE_DIR, exist_ok=True)
+
+
+def collect_videos(paths):
+    """Expand files/folders into a list of source videos (mosaic outputs are skipped)."""
+    videos = []
+    for p in paths:
+        if os.path.isdir(p):
+            for f in sorted(os.listdir(p)):
+                name = os.path.splitext(f)[0]
+                if f.lower().endswith(VIDEO_EXTS) and not name.lower().endswith("_mc"):
+                    videos.append(os.path.join(p, f))
+        elif os.path.isfile(p):
+            videos.append(p)
+    return videos
+
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="動画トリアージ (低fps・低解像度の事前スキャン)")
+    parser.add_argument('paths', nargs='*', help="動画ファイルまたはフォルダ (省略時はフォルダ選択)")
+    parser.add_argument('--decoder', choices=DECODE_BACKENDS, default=BACKEND_OPENCV,
+                        help=f"デコードバックエンド (default: {BACKEND_OPENCV})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 引数がなければGUIでフォルダ選択
+    if args.paths:
+        paths = args.paths
+    else:
+        root = tk.Tk(); root.withdraw()
+        folder = tkFileDialog.askdirectory(title="トリアージする動画フォルダを選択してください")
+        root.destroy()
+        if not folder:
+            print("フォルダが選択されませんでした。処理を中止します。")
+            return
+        paths = [folder]
+
+    video_paths = collect_videos(paths)
+    if not video_paths:
+        print("対応動画が見つかりません")
+        return
+
+    # Triage only needs Layer 2 + Layer 4 (no tracking at low fps)
+    yolo_model_path = os.path.join(BASE_DIR, 'erax_nsfw_yolo11m.pt')
+    configure_threads()
+    try:
+        detector = load_detector(yolo_model_path, TEMP_DIR, tracking=False, nn_tmp_name='_nn_triage_tmp.jpg')
+    except Exception as e:
+        print(f"[ERROR] YOLOモデルの読み込みに失敗しました: {e}")
+        return
+
+    # 進捗バー
+    progress_root = tk.Tk()
+    progress_root.title("トリアージ進捗")
+    progress_root.geometry("440x170")
+    progress_root.configure(bg="#23272e")
+    style = ttk.Style(progress_root)
+    style.theme_use("clam")
+    style.layout("Triage.Horizontal.TProgressbar",
+        [('Horizontal.Progressbar.trough', {'children': [
+            ('Horizontal.Progressbar.pbar', {'side': 'left', 'sticky': 'ns'})], 'sticky': 'nswe'})])
+    style.configure("Triage.Horizontal.TProgressbar",
+        troughcolor="#181a20", bordercolor="#23272e", background="#2ecc71", lightcolor="#2ecc71", darkcolor="#1e8449", thickness=22, borderwidth=2, relief="flat")
+    tk.Label(progress_root, text="トリアージ中...", font=("Segoe UI", 15, "bold"), bg="#23272e", fg="#fff").pack(pady=12)
+    progress_var = tk.DoubleVar()
+    progress = ttk.Progressbar(progress_root, variable=progress_var, maximum=100, length=380, style="Triage.Horizontal.TProgressbar")
+    progress.pack(pady=8)
+    status_label = tk.Label(progress_root, text="", font=("Segoe UI", 12), bg="#23272e", fg="#fff")
+    status_label.pack(pady=2)
+    percent_label = tk.Label(progress_root, text="", font=("Segoe UI", 12), bg="#23272e", fg="#fff")
+    percent_label.pack(pady=2)
+    progress_root.update()
+
+    timelines = []
+    for n, video_path in enumerate(video_paths, 1):
+        name = os.path.basename(video_path)
+        status_label.config(text=f"{name} ({n}/{len(video_paths)})")
+
+        def on_progress(idx, total):
+            percent = int(idx / total * 100) if total > 0 else 0
+            percent_label.config(text=f"進捗: {percent}%")
+            progress_var.set(percent)
+            progress_root.update()
+
+        try:
+            tl = triage_video(video_path, detector, sample_fps=TRIAGE_SAMPLE_FPS, progress_cb=on_progress,
+                              decoder=args.decoder)
+        except Exception as e:
+            print(f"[ERROR] Triage failed: {name}: {e}")
+            continue
+        timelines.append(tl)
+        print(f"[INFO] {name}: {len(tl['intervals'])} intervals, flagged {tl['flagged_seconds']:.1f}s / {tl['duration']:.1f}s, "
+              f"peak {tl['peak_confidence']:.2f}, {tl['realtime_factor']:.1f}x realtime")
+    progress_root.destroy()
+
+    if not timelines:
+        return
+    report_path = write_triage_report(timelines, TRIAGE_DIR)
+    flagged = sum(1 for t in timelines if t['intervals'])
+    print(f"[INFO] Triage report: {report_path}")
+
+    root = tk.Tk(); root.withdraw()
+    tkMessageBox.showinfo(
+        "トリアージ完了",
+        f"{len(timelines)}本中 {flagged}本でNSFW区間を検出しました。\n"
+        f"レポート: {report_path}\n\n"
+        "動画モザイク処理時にこの結果を使って優先順位付け・区間限定検出ができます。",
+        parent=root)
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
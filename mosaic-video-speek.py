@@ -3,7 +3,6 @@ import sys
 import cv2
 import numpy as np
 from PIL import Image
-from ultralytics import YOLO
 import tkinter as tk
 import tkinter.filedialog as tkFileDialog
 import tkinter.messagebox as tkMessageBox
@@ -11,25 +10,29 @@ from tkinter import ttk
 import tempfile
 import ffmpeg
 import shutil
-from collections import deque
-
-# NudeNet (Layer 4) - optional
-try:
-    from nudenet import NudeDetector
-except ImportError:
-    NudeDetector = None
-
-# NudeNet NSFW labels that require mosaic
-NUDENET_NSFW_LABELS = {
-    'FEMALE_GENITALIA_EXPOSED',
-    'MALE_GENITALIA_EXPOSED', 
-    'ANUS_EXPOSED',
-}
+import time
+
+from mosaic_core.decode import probe_video
+from mosaic_core.detection import load_detector, merge_boxes
+from mosaic_core.detection_cache import cache_path
+from mosaic_core.encode_queue import ENCODE_WORKERS, EncodeQueue
+from mosaic_core.ffmpeg_io import FfmpegPipeWriter, probe_media, video_output_args
+from mosaic_core.frame_cache import FrameFingerprintCache
+from mosaic_core.hashing import file_quick_hash, model_hash
+from mosaic_core.manifest import VIDEO_EXTS, BatchJob, load_manifest
+from mosaic_core.metrics import RssMonitor
+from mosaic_core.processed import PROCESSED_MANIFEST, ProcessedManifest, is_rendered_output
+from mosaic_core.render import PATTERNS, paint_boxes, prepare_source, render_video
+from mosaic_core.thread_budget import configure_threads
+from mosaic_core.triage import dense_frame_ranges, load_timeline, prioritize
 
 # --- Constants for Directories ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMP_DIR = os.path.join(BASE_DIR, 'tmp')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+TRIAGE_DIR = os.path.join(OUTPUT_DIR, 'triage')
+CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'detections')
+FRAME_CACHE_PATH = os.path.join(BASE_DIR, 'cache', 'frame_fingerprints.sqlite')
 
 # Ensure directories exist
 os.makedirs(TEMP_DIR, exist_ok=True)
@@ -52,7 +55,7 @@ def ask_mosaic_pattern():
     # ...existing code from mosaic-video.py...
     import tkinter as tk
     from tkinter import ttk
-    patterns = ["モザイク小", "モザイク中", "モザイク大", "ぼかし", "黒塗り"]
+    patterns = PATTERNS
     selected = [patterns[0]]
     cancelled = [False]
     def on_select(event=None):
@@ -115,71 +118,6 @@ def ask_audio_file():
     root.destroy()
     return path
 
-def apply_pattern(region, pattern):
-    
-    w, h = region.size
-    if pattern == "モザイク大":
-        small = region.resize((max(1, w // 32), max(1, h // 32)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "モザイク中":
-        small = region.resize((max(1, w // 16), max(1, h // 16)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "モザイク小":
-        small = region.resize((max(1, w // 8), max(1, h // 8)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "ぼかし":
-        from PIL import ImageFilter
-        blur_radius = max(8, min(w, h) // 10)
-        return region.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    elif pattern == "黒塗り":
-        return Image.new("RGB", (w, h), (0, 0, 0))
-    else:
-        return region
-
-# --- Class-based shrink ratios for optimal mosaic coverage ---
-SHRINK_RATIOS = {
-    'penis':  (0.70, 0.55),
-    'vagina': (0.70, 0.55),
-    'anus':   (0.65, 0.65),
-}
-DEFAULT_SHRINK = (0.60, 0.50)
-
-def shrink_box(x1, y1, x2, y2, cls_name=''):
-    """Shrink detection box to mosaic area based on detected class."""
-    w, h = x2 - x1, y2 - y1
-    if w < 10 or h < 10:
-        return None
-    ratio_w, ratio_h = SHRINK_RATIOS.get(cls_name, DEFAULT_SHRINK)
-    dx = int(w * ratio_w / 2)
-    dy = int(h * ratio_h / 2)
-    sx1 = x1 + dx; sy1 = y1 + dy
-    sx2 = x2 - dx; sy2 = y2 - dy
-    if sx2 > sx1 and sy2 > sy1:
-        return (sx1, sy1, sx2, sy2)
-    return None
-
-def merge_boxes(all_boxes, iou_threshold=0.3):
-    """De-duplicate overlapping boxes using IoU. Keeps larger box on overlap."""
-    merged = []
-    for box in all_boxes:
-        is_duplicate = False
-        for i, existing in enumerate(merged):
-            ix1 = max(box[0], existing[0]); iy1 = max(box[1], existing[1])
-            ix2 = min(box[2], existing[2]); iy2 = min(box[3], existing[3])
-            if ix1 < ix2 and iy1 < iy2:
-                inter_area = (ix2 - ix1) * (iy2 - iy1)
-                box_area = (box[2] - box[0]) * (box[3] - box[1])
-                existing_area = (existing[2] - existing[0]) * (existing[3] - existing[1])
-                union_area = box_area + existing_area - inter_area
-                if union_area > 0 and inter_area / union_area > iou_threshold:
-                    is_duplicate = True
-                    if box_area > existing_area:
-                        merged[i] = box
-                    break
-        if not is_duplicate:
-            merged.append(box)
-    return merged
-
 
 def ask_video_mode():
     import tkinter as tk
@@ -203,92 +141,145 @@ def ask_video_mode():
     root.destroy()
     return mode['value']
 
-def adjust_audio_to_video(audio_path, video_path, output_path):
-    import ffmpeg # 関数内で再度インポートしていますが、グローバルでもOK
-    import tempfile
-    import os
+def ask_use_triage(video_paths, answer=None):
+    """If triage timelines exist for the selected videos, ask whether to use them
+    (`answer` given: no dialog). Returns {video_path: timeline} (empty when unused)."""
+    timelines = {}
+    for path in video_paths:
+        if path:
+            tl = load_timeline(TRIAGE_DIR, path)
+            if tl is not None:
+                timelines[path] = tl
+    if not timelines:
+        return {}
+    if answer is not None:
+        print(f"[INFO] トリアージ結果 ({len(timelines)}本): {'使用します' if answer else '使用しません (--use-triage で使用)'}")
+        return timelines if answer else {}
+    root = tk.Tk(); root.withdraw()
+    use = tkMessageBox.askyesno(
+        "トリアージ結果",
+        f"{len(timelines)}本の動画にトリアージ結果があります。\n"
+        "検出区間の多い動画から処理し、検出区間(前後マージン付き)のみ精密検出しますか？",
+        parent=root)
+    root.destroy()
+    return timelines if use else {}
 
-    probe_v = ffmpeg.probe(video_path)
-    probe_a = ffmpeg.probe(audio_path)
-    v_duration = float(probe_v['format']['duration'])
-    a_duration = float(probe_a['format']['duration'])
+def show_message(kind, title, message, unattended=False):
+    """tkMessageBox.show<kind>('info' / 'warning' / 'error'), or only a log line in unattended (manifest) runs."""
+    if unattended:
+        level = {'warning': 'WARNING', 'error': 'ERROR'}.get(kind, 'INFO')
+        print(f"[{level}] {title}: {message}")
+        return
+    getattr(tkMessageBox, 'show' + kind)(title, message)
+
+def adapted_audio(audio_path, v_duration, a_duration):
+    """Audio stream of `audio_path` fitted to `v_duration` (trim / atempo / loop)."""
+    audio = ffmpeg.input(audio_path)['a']
+    if abs(v_duration - a_duration) < 0.01: # ほぼ同じ長さ
+        print("[DEBUG] 音声長さほぼ同じ: AAC変換のみ")
+    elif a_duration > v_duration: # 音声が長い場合、トリミング
+        print("[DEBUG] 音声が長い: トリミングしてAAC変換")
+        audio = audio.filter('atrim', duration=v_duration).filter('asetpts', 'N/SR/TB')
+    else: # 音声が短い場合
+        tempo_ratio = a_duration / v_duration # 再生速度 = 元の長さ / 目標の長さ (<1 で引き伸ばし)
+        if 0.5 <= tempo_ratio <= 2.0: # atempoが対応可能な範囲 (0.5倍速から2倍速)
+            print(f"[DEBUG] 音声が短い: atempo ({tempo_ratio:.2f}) でAAC変換")
+            audio = audio.filter('atempo', tempo_ratio).filter('asetpts', 'N/SR/TB')
+        else: # atempoの範囲外ならループしてトリミング
+            print("[DEBUG] 音声が短い (atempo範囲外): ループしてトリミング、AAC変換")
+            audio = (
+                audio
+                .filter_('aloop', loop=-1, size=2**24) # 無限ループ、sizeは十分な値を指定
+                .filter_('atrim', duration=v_duration)
+                .filter_('asetpts', 'N/SR/TB')
+            )
+    return audio
+
+def _print_ffmpeg_error(e, what):
+    print(f"ffmpeg error during {what}:")
+    stdout = e.stdout.decode(errors='replace') if e.stdout else "No stdout"
+    stderr = e.stderr.decode(errors='replace') if e.stderr else "No stderr"
+    print(f"FFMPEG STDOUT:\n{stdout}")
+    print(f"FFMPEG STDERR:\n{stderr}")
+
+def adjust_audio_to_video(audio_path, video_path, output_path, video_info=None, audio_info=None):
+    """
+    Fit the audio to the video length (trim / atempo / loop) and mux it in a
+    single ffmpeg pass. An H.264 video is stream-copied; anything else is
+    encoded with libx264. Probe results can be passed in to skip ffprobe.
+    """
+    video_info = video_info or probe_media(video_path)
+    audio_info = audio_info or probe_media(audio_path)
+    audio = adapted_audio(audio_path, video_info['duration'], audio_info['duration'])
+
+    # 映像 (コピー or H.264) と調整済み音声を1回のffmpegで多重化
+    video_args = video_output_args(video_info)
+    print(f"[DEBUG] Mux開始: video={video_path} ({video_info['video_codec']} -> {video_args['vcodec']}), "
+          f"audio={audio_path}, out={output_path}")
+    try:
+        (
+            ffmpeg
+            .output(ffmpeg.input(video_path)['v'], audio, output_path,
+                    acodec='aac', audio_bitrate='192k', **video_args)
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        print("[DEBUG] Mux完了")
+    except ffmpeg.Error as e:
+        _print_ffmpeg_error(e, f"audio adjustment or mux (video: {video_path}, audio_in: {audio_path})")
+        raise # エラーを再送出して呼び出し元で処理できるようにする
 
-    temp_audio_path = "" # 初期化
+def prepare_audio(audio_path, v_duration, audio_info=None):
+    """
+    Render the audio fitted to `v_duration` seconds into a temp AAC file.
+    Runs in the background while the video is still being rendered.
+
+    Returns:
+        Path of the temp .m4a (the caller removes it)
+    """
+    start = time.perf_counter()
+    audio_info = audio_info or probe_media(audio_path)
+    with tempfile.NamedTemporaryFile(suffix='.m4a', delete=False, dir=TEMP_DIR) as tmp_audio_file:
+        temp_audio_path = tmp_audio_file.name
     try:
-        # 一時音声ファイルを作成 (削除は finally で行う)
-        with tempfile.NamedTemporaryFile(suffix='.m4a', delete=False, dir=TEMP_DIR) as tmp_audio_file:
-            temp_audio_path = tmp_audio_file.name
-        
-        print(f"[DEBUG] temp_audio_path: {temp_audio_path}")
-
-        # 音声の長さを調整して一時ファイルに保存
-        if abs(v_duration - a_duration) < 0.01: # ほぼ同じ長さ
-            print("[DEBUG] 音声長さほぼ同じ: AAC変換のみ (m4a)")
-            stream = ffmpeg.input(audio_path)
-        elif a_duration > v_duration: # 音声が長い場合、トリミング
-            print("[DEBUG] 音声が長い: トリミングしてAAC変換 (m4a)")
-            stream = ffmpeg.input(audio_path).filter('atrim', duration=v_duration).filter('asetpts', 'N/SR/TB')
-        else: # 音声が短い場合
-            tempo_ratio = v_duration / a_duration # 目標の長さ / 元の長さ
-            if 0.5 <= tempo_ratio <= 2.0: # atempoが対応可能な範囲 (0.5倍速から2倍速)
-                print(f"[DEBUG] 音声が短い: atempo ({tempo_ratio:.2f}) でAAC変換 (m4a)")
-                stream = ffmpeg.input(audio_path).filter('atempo', tempo_ratio).filter('asetpts', 'N/SR/TB')
-            else: # atempoの範囲外ならループしてトリミング
-                print(f"[DEBUG] 音声が短い (atempo範囲外): ループしてトリミング、AAC変換 (m4a)")
-                stream = (
-                    ffmpeg
-                    .input(audio_path)
-                    .filter_('aloop', loop=-1, size=2**24) # 無限ループ、sizeは十分な値を指定
-                    .filter_('atrim', duration=v_duration)
-                    .filter_('asetpts', 'N/SR/TB')
-                )
-        
-        # 共通の出力設定で一時音声ファイルに書き出し
         (
-            stream
+            adapted_audio(audio_path, v_duration, audio_info['duration'])
             .output(temp_audio_path, acodec='aac', audio_bitrate='192k', format='ipod')
             .overwrite_output()
             .run(capture_stdout=True, capture_stderr=True)
         )
-        print(f"[DEBUG] 一時音声ファイル {temp_audio_path} の生成完了。")
-
-        # 映像と調整済み音声をmux（多重化）
-        print(f"[DEBUG] Mux開始: video={video_path}, audio={temp_audio_path}, out={output_path}")
-        print(f"[DEBUG] ffmpeg muxコマンド (相当): ffmpeg -y -i \"{video_path}\" -i \"{temp_audio_path}\" -c:v copy -c:a aac -b:a 192k \"{output_path}\"")
-        
-        input_video = ffmpeg.input(video_path)
-        input_audio = ffmpeg.input(temp_audio_path)
-        
+    except ffmpeg.Error as e:
+        _print_ffmpeg_error(e, f"audio preparation (audio_in: {audio_path})")
+        if os.path.exists(temp_audio_path): os.remove(temp_audio_path)
+        raise
+    print(f"[INFO] 音声の事前調整完了 ({time.perf_counter() - start:.1f}s): {temp_audio_path}")
+    return temp_audio_path
+
+def mux_prepared_audio(video_path, prepared_audio_path, output_path, video_info=None):
+    """Mux an already fitted AAC track: both streams are copied (video re-encoded only if not H.264)."""
+    video_info = video_info or probe_media(video_path)
+    print(f"[DEBUG] Mux開始 (調整済み音声): video={video_path}, audio={prepared_audio_path}, out={output_path}")
+    try:
         (
             ffmpeg
-            .output(input_video['v'], input_audio['a'], output_path, vcodec='libx264', pix_fmt='yuv420p', crf=23, acodec='aac', audio_bitrate='192k') # H.264変換
+            .output(ffmpeg.input(video_path)['v'], ffmpeg.input(prepared_audio_path)['a'], output_path,
+                    acodec='copy', **video_output_args(video_info))
             .overwrite_output()
             .run(capture_stdout=True, capture_stderr=True)
         )
         print("[DEBUG] Mux完了")
-
     except ffmpeg.Error as e:
-        print(f"ffmpeg error during audio adjustment or mux (video: {video_path}, audio_in: {audio_path}):")
-        stdout = e.stdout.decode(errors='replace') if e.stdout else "No stdout"
-        stderr = e.stderr.decode(errors='replace') if e.stderr else "No stderr"
-        print(f"FFMPEG STDOUT:\n{stdout}")
-        print(f"FFMPEG STDERR:\n{stderr}")
-        raise # エラーを再送出して呼び出し元で処理できるようにする
-    finally:
-        if os.path.exists(temp_audio_path):
-            try:
-                os.remove(temp_audio_path)
-                print(f"[DEBUG] 一時音声ファイル {temp_audio_path} を削除しました。")
-            except OSError as e:
-                print(f"[ERROR] 一時音声ファイル {temp_audio_path} の削除に失敗しました: {e}")
+        _print_ffmpeg_error(e, f"mux (video: {video_path}, audio_in: {prepared_audio_path})")
+        raise
 
-def transcode_to_h264(input_path, output_path):
-    import ffmpeg
+def transcode_to_h264(input_path, output_path, video_info=None):
+    """Save as H.264 (remux only when the input already is H.264)."""
     try:
+        video_info = video_info or probe_media(input_path)
         (
             ffmpeg
             .input(input_path)
-            .output(output_path, vcodec='libx264', pix_fmt='yuv420p', crf=23)
+            .output(output_path, **video_output_args(video_info))
             .overwrite_output()
             .run(quiet=True)
         )
@@ -298,24 +289,21 @@ def transcode_to_h264(input_path, output_path):
         return False
 
 # Helper for muxing ORIGINAL audio if no extra audio added
-def mux_original_audio(video_path, audio_source, output_path):
-    import ffmpeg
+def mux_original_audio(video_path, audio_source, output_path, video_info=None):
+    temp_mux_out = output_path + ".temp_mux.mp4"
     try:
         # Check if audio source has audio stream
-        probe = ffmpeg.probe(audio_source)
-        audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
-        if not audio_streams:
+        if not probe_media(audio_source)['has_audio']:
             return False # No audio to mux
-        
-        # Create temp output for muxing
-        temp_mux_out = output_path + ".temp_mux.mp4"
-        
+        video_info = video_info or probe_media(video_path)
+
         input_video = ffmpeg.input(video_path)
         input_audio = ffmpeg.input(audio_source)
 
         (
             ffmpeg
-            .output(input_video['v'], input_audio['a'], temp_mux_out, vcodec='libx264', pix_fmt='yuv420p', crf=23, acodec='aac')
+            .output(input_video['v'], input_audio['a'], temp_mux_out, acodec='aac',
+                    **video_output_args(video_info))
             .overwrite_output()
             .run(quiet=True)
         )
@@ -329,7 +317,69 @@ def mux_original_audio(video_path, audio_source, output_path):
         if os.path.exists(temp_mux_out): os.remove(temp_mux_out)
     return False
 
-def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
+def finalize_video(temp_video_path, video_path, out_path, audio_path=None, prepared_audio=None):
+    """
+    Post-render step (runs on the encode queue): add the external audio, or the
+    original audio, or transcode to H.264 when there is none; then drop the temp video.
+
+    Args:
+        prepared_audio: Future of prepare_audio() started when the render began;
+            if it failed, the audio is fitted and muxed in one pass instead
+
+    Returns:
+        (out_path, audio error message or None)
+    """
+    audio_error = None
+    try:
+        # Probe the rendered video once for every step below
+        try:
+            video_info = probe_media(temp_video_path)
+        except Exception as e:
+            print(f"[WARNING] Probe failed ({e}); steps will probe again.")
+            video_info = None
+        if audio_path and os.path.exists(audio_path):
+            # User selected external audio
+            print(f"音声合成処理開始: audio={audio_path}, temp_video={temp_video_path}, output={out_path}")
+            prepared_path = None
+            if prepared_audio is not None:
+                try:
+                    prepared_path = prepared_audio.result()
+                except Exception as e:
+                    print(f"[WARNING] 音声の事前調整に失敗しました ({e})。一括処理で再試行します。")
+            try:
+                if prepared_path is not None:
+                    # The prepared track may be shared with other videos of the same length;
+                    # it lives in TEMP_DIR and is removed with it at the end of the session
+                    mux_prepared_audio(temp_video_path, prepared_path, out_path, video_info)
+                else:
+                    adjust_audio_to_video(audio_path, temp_video_path, out_path, video_info)
+                print(f"音声合成成功。最終出力: {out_path}")
+            except Exception as e:
+                print(f"音声合成に失敗しました: {e}")
+                audio_error = str(e)
+                if os.path.exists(temp_video_path):
+                    if os.path.exists(out_path): os.remove(out_path)
+                    shutil.move(temp_video_path, out_path)
+        else:
+            # Try muxing original audio
+            has_audio = mux_original_audio(temp_video_path, video_path, out_path, video_info)
+            if not has_audio:
+                # Just move/copy temp video -> Now transcode to H.264
+                print(f"音声が見つかりません。映像をH.264に変換して保存します: {out_path}")
+                transcode_to_h264(temp_video_path, out_path, video_info)
+                print(f"音声なし。モザイク処理済み動画を保存: {out_path}")
+            else:
+                print(f"元動画の音声を合成しました: {out_path}")
+    finally:
+        if os.path.exists(temp_video_path):
+            try:
+                os.remove(temp_video_path)
+                print(f"一時ビデオファイル {temp_video_path} を削除しました。")
+            except OSError as e:
+                print(f"[ERROR] 一時ビデオファイル {temp_video_path} の削除に失敗しました: {e}")
+    return out_path, audio_error
+
+def rescan_video(video_path, detector, pattern):
     """Post-scan verification: re-scan output video and fix any missed areas."""
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
@@ -396,47 +446,21 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
         
         # Detection with model_detect (isolated YOLO)
         try:
-            results = model_detect(frame_rgb, conf=0.10, iou=0.3, verbose=False)
-            if results and results[0].boxes is not None and len(results[0].boxes) > 0:
-                boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                clss = results[0].boxes.cls.cpu().numpy().astype(int)
-                for box, cls_idx in zip(boxes, clss):
-                    cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                    if cls_name in ["make_love", "nipple"]: continue
-                    x1, y1, x2, y2 = box
-                    sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                    if sbox:
-                        detected_boxes.append(sbox)
+            detected_boxes.extend(b for b, _ in detector.detect(frame_rgb))
         except Exception:
             pass
         
         # Detection with NudeNet
-        if model_nudenet is not None:
+        if detector.has_nudenet:
             try:
-                nn_tmp = os.path.join(TEMP_DIR, '_nn_rescan_tmp.jpg')
-                cv2.imwrite(nn_tmp, cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
-                nn_results = model_nudenet.detect(nn_tmp)
-                for det in nn_results:
-                    label = det.get('class', '')
-                    score = det.get('score', 0)
-                    if label not in NUDENET_NSFW_LABELS: continue
-                    if score < 0.3: continue
-                    nn_box = det.get('box', [])
-                    if len(nn_box) != 4: continue
-                    x1, y1, x2, y2 = int(nn_box[0]), int(nn_box[1]), int(nn_box[2]), int(nn_box[3])
-                    sbox = shrink_box(x1, y1, x2, y2)
-                    if sbox:
-                        detected_boxes.append(sbox)
+                detected_boxes.extend(b for b, _ in detector.nudenet(frame_rgb))
             except Exception:
                 pass
         
         detected_boxes = merge_boxes(detected_boxes)
         if detected_boxes:
             fixed_count += 1
-            for (sx1, sy1, sx2, sy2) in detected_boxes:
-                region = img.crop((sx1, sy1, sx2, sy2))
-                mosaic = apply_pattern(region, pattern)
-                img.paste(mosaic, (sx1, sy1, sx2, sy2))
+            paint_boxes(img, detected_boxes, pattern)
         
         out_frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
         out.write(out_frame)
@@ -462,8 +486,43 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
     return fixed_count
 
 
-def main():
-    
+def print_job_timings(timings, audio_durations, finalize_durations):
+    """Per-job timing table: render, audio fitting (or 'reused') and mux / transcode, in seconds."""
+    def fmt(value):
+        return f"{value:.2f}" if value is not None else '-'
+    print("[INFO] Job timings (s):")
+    print(f"  {'video':<40} {'render':>8} {'audio':>8} {'finalize':>9}")
+    for t in timings:
+        if t['audio_label'] is None:
+            audio = '-'
+        elif t['audio_reused']:
+            audio = 'reused'
+        else:
+            audio = fmt(audio_durations.get(t['audio_label']))
+        print(f"  {t['label']:<40} {t['render']:>8.2f} {audio:>8} {fmt(finalize_durations.get(t['label'])):>9}")
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="音声付き動画自動モザイク")
+    parser.add_argument('--manifest', metavar='PATH',
+                        help="動画と音声の対応表 (CSV/JSON: video, audio, pattern, output) でダイアログなしに一括処理する")
+    parser.add_argument('--pattern', choices=PATTERNS,
+                        help="既定のモザイクパターン (省略時はダイアログで選択)")
+    parser.add_argument('--jobs', type=int, default=ENCODE_WORKERS,
+                        help=f"音声調整・多重化/H.264変換を合わせて同時に行う ffmpeg ジョブ数 (0=逐次, default: {ENCODE_WORKERS})")
+    parser.add_argument('--force', action='store_true',
+                        help="フォルダ/マニフェスト処理で処理済み (入力・音声・モデル・設定が未変更) の動画も再処理する")
+    parser.add_argument('--use-triage', action='store_true',
+                        help="トリアージ結果があれば確認なしで使用する (マニフェスト処理では指定時のみ使用)")
+    parser.add_argument('--rescan', action='store_true',
+                        help="完了後に確認なしで再スキャン検証を行う (マニフェスト処理では指定時のみ実行)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Manifest runs are unattended: no modal dialogs, messages go to the log
+    unattended = bool(args.manifest)
+
     # Check if tmp and output dirs exist
     if not os.path.exists(TEMP_DIR):
         try: os.makedirs(TEMP_DIR)
@@ -473,77 +532,122 @@ def main():
         try: os.makedirs(OUTPUT_DIR)
         except OSError: pass
 
-    # モデル・クラス名
-    names = ['anus', 'make_love', 'nipple', 'penis', 'vagina']
+    # モデル (Layer 1: Tracking / Layer 2: Standalone detection / Layer 4: NudeNet)
     yolo_model_path = os.path.join(os.path.dirname(__file__), 'erax_nsfw_yolo11m.pt')
     if not os.path.exists(yolo_model_path):
-        tkMessageBox.showerror("エラー", f"YOLOモデルファイルが見つかりません: {yolo_model_path}")
+        show_message('error', "エラー", f"YOLOモデルファイルが見つかりません: {yolo_model_path}", unattended)
         return
+    configure_threads()
     try:
-        model = YOLO(yolo_model_path)          # For Layer 1: Tracking
-        model_detect = YOLO(yolo_model_path)   # For Layer 2: Standalone detection (isolated)
+        detector = load_detector(yolo_model_path, TEMP_DIR, nn_tmp_name='_nn_tmp_speek.jpg')
     except Exception as e:
-        tkMessageBox.showerror("エラー", f"YOLOモデルのロードに失敗しました: {e}")
+        show_message('error', "エラー", f"YOLOモデルのロードに失敗しました: {e}", unattended)
         return
-    
-    # Layer 4: NudeNet (optional, graceful skip if unavailable)
-    model_nudenet = None
-    if NudeDetector is not None:
+    # Detection cache key: YOLO weights + whether Layer 4 actually loaded
+    detection_hash = model_hash(yolo_model_path) + ('+nn' if detector.has_nudenet else '')
+    frame_cache = FrameFingerprintCache(FRAME_CACHE_PATH, detection_hash)
+
+    if args.manifest:
+        # Batch mode: videos, audio and options come from the manifest and the command line (no dialogs)
+        mode = 'manifest'
         try:
-            model_nudenet = NudeDetector()
-            print("[INFO] NudeNet Layer 4 loaded successfully.")
-        except Exception as e:
-            print(f"[WARNING] NudeNet initialization failed (Layer 4 disabled): {e}")
-
-    mode = ask_video_mode()
-    if mode == 'file':
-        root = tk.Tk(); root.withdraw()
-        video_path_tuple = tkFileDialog.askopenfilename(
-            title="動画ファイルを選択してください",
-            filetypes=[
-                ("動画ファイル", "*.mp4;*.avi;*.mov;*.mkv"), # .mkv追加
-                ("MP4 files", "*.mp4"),
-                ("AVI files", "*.avi"),
-                ("MOV files", "*.mov"),
-                ("MKV files", "*.mkv"),
-                ("All files", "*.*")
-            ]) # askopenfilenameは単一選択の場合文字列を返す
-        root.destroy()
-        if not video_path_tuple: # キャンセルされた場合
-             print("動画ファイルが選択されませんでした。処理を中止します。")
-             return
-        video_paths = [video_path_tuple]
-    elif mode == 'folder':
-        root = tk.Tk(); root.withdraw()
-        folder = tkFileDialog.askdirectory(title="動画フォルダを選択してください")
-        root.destroy()
-        if not folder:
-            print("フォルダが選択されませんでした。処理を中止します。")
+            jobs = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] マニフェストを読み込めませんでした: {e}")
             return
-        video_paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith((".mp4", ".avi", ".mov", ".mkv"))]
-        if not video_paths:
-            tkMessageBox.showinfo("動画なし", "選択フォルダに対応動画がありません。", parent=None)
+        if not jobs:
+            print("[ERROR] マニフェストに処理できる動画がありません。")
             return
-    else: # ask_video_modeがNoneを返した場合 (キャンセルなど)
-        print("処理モードが選択されませんでした。処理を中止します。")
-        return
-
-    pattern = ask_mosaic_pattern()
-    if pattern is None:
-        print("モザイクパターンが選択されませんでした。処理を中止します。")
-        return
+        print(f"[INFO] マニフェスト: {len(jobs)}本の動画, 音声 {len({j.audio for j in jobs if j.audio})}種類")
+        for job in jobs:
+            if job.pattern is not None and job.pattern not in PATTERNS:
+                print(f"[WARNING] 不明なパターン '{job.pattern}' ({os.path.basename(job.video)})。既定のパターンを使います。")
+                job.pattern = None
+    else:
+        mode = ask_video_mode()
+        if mode == 'file':
+            root = tk.Tk(); root.withdraw()
+            video_path_tuple = tkFileDialog.askopenfilename(
+                title="動画ファイルを選択してください",
+                filetypes=[
+                    ("動画ファイル", "*.mp4;*.avi;*.mov;*.mkv"), # .mkv追加
+                    ("MP4 files", "*.mp4"),
+                    ("AVI files", "*.avi"),
+                    ("MOV files", "*.mov"),
+                    ("MKV files", "*.mkv"),
+                    ("All files", "*.*")
+                ]) # askopenfilenameは単一選択の場合文字列を返す
+            root.destroy()
+            if not video_path_tuple: # キャンセルされた場合
+                 print("動画ファイルが選択されませんでした。処理を中止します。")
+                 return
+            video_paths = [video_path_tuple]
+        elif mode == 'folder':
+            root = tk.Tk(); root.withdraw()
+            folder = tkFileDialog.askdirectory(title="動画フォルダを選択してください")
+            root.destroy()
+            if not folder:
+                print("フォルダが選択されませんでした。処理を中止します。")
+                return
+            video_paths = [os.path.join(folder, f) for f in os.listdir(folder)
+                           if f.lower().endswith(VIDEO_EXTS) and not is_rendered_output(f)]
+            if not video_paths:
+                tkMessageBox.showinfo("動画なし", "選択フォルダに対応動画がありません。", parent=None)
+                return
+        else: # ask_video_modeがNoneを返した場合 (キャンセルなど)
+            print("処理モードが選択されませんでした。処理を中止します。")
+            return
+        jobs = [BatchJob(video_path) for video_path in video_paths]
 
-    add_audio = ask_audio_add()
-    audio_path = None
-    if add_audio:
-        audio_path = ask_audio_file()
-        if not audio_path:
-            tkMessageBox.showinfo("音声なし", "音声ファイルが選択されませんでした。音声なしで進めます。", parent=None)
-            add_audio = False # 音声ファイルが選択されなかったのでフラグをFalseに
+    # Default pattern: --pattern, else ask (unless every manifest row has its own; manifest runs never ask)
+    pattern = args.pattern
+    if pattern is None and any(job.pattern is None for job in jobs):
+        if unattended:
+            print("[ERROR] パターンが空欄の行があります。--pattern で既定のパターンを指定してください。")
+            return
+        pattern = ask_mosaic_pattern()
+        if pattern is None:
+            print("モザイクパターンが選択されませんでした。処理を中止します。")
+            return
+    timelines = ask_use_triage([job.video for job in jobs],
+                               answer=args.use_triage if unattended else (True if args.use_triage else None))
+    if timelines:
+        order = {path: i for i, path in enumerate(prioritize([job.video for job in jobs], timelines))}
+        jobs.sort(key=lambda job: order[job.video])
+
+    if mode != 'manifest':
+        add_audio = ask_audio_add()
+        audio_path = None
+        if add_audio:
+            audio_path = ask_audio_file()
+            if not audio_path:
+                tkMessageBox.showinfo("音声なし", "音声ファイルが選択されませんでした。音声なしで進めます。", parent=None)
+                add_audio = False # 音声ファイルが選択されなかったのでフラグをFalseに
+        if add_audio:
+            for job in jobs:
+                job.audio = audio_path
 
     processed_outputs = []  # 追加
+    output_patterns = {}  # Output path -> pattern (for the rescan)
+    job_patterns = {}  # Queue label -> pattern
+    timings = []
+    # Audio / mux / transcode of finished renders overlaps the next video's detection, and
+    # external audio is fitted to each video while that video renders. Both share one queue,
+    # so at most --jobs ffmpeg processes run at once. A video's audio job is always queued
+    # before its mux job (which waits for it), so first-in first-out cannot deadlock.
+    encode_queue = EncodeQueue(args.jobs)
+    audio_infos = {}  # Audio path -> probe_media() result (None: probe failed)
+    # (audio path, video duration) -> (Future of prepare_audio(), queue label):
+    # the same track fitted to the same length is prepared only once
+    prepared_audios = {}
+    # Folder / manifest mode: skip videos whose output is up to date
+    processed = ProcessedManifest(os.path.join(OUTPUT_DIR, PROCESSED_MANIFEST))
+    audio_hashes = {}  # Audio path -> file_quick_hash()
+    skipped = 0
     
-    for video_path in video_paths:
+    for n, job in enumerate(jobs, start=1):
+        video_path = job.video
+        job_pattern = job.pattern or pattern
         if not video_path or not os.path.exists(video_path): # パスが空かファイルが存在しない場合スキップ
             print(f"無効なビデオパス、またはファイルが存在しません: {video_path}")
             continue
@@ -551,29 +655,41 @@ def main():
         print(f"処理開始: {video_path}")
         base, ext = os.path.splitext(video_path)
         filename = os.path.basename(video_path)
+        label = filename if len(jobs) == 1 else f"{n}/{len(jobs)} {filename}"
         name_only = os.path.splitext(filename)[0]
         
-        # Output directory handling
+        # Output directory handling (video is rendered as H.264 and copied into the container)
         if ext.lower() == ".mp4" or ext.lower() == ".mov" or ext.lower() == ".mkv":
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v') # H.264エンコードなら 'X264' や 'H264' も検討
             out_filename = name_only + "_mc" + ext # Keep original extension if supported container
             if ext.lower() == ".mkv": # Optional: force mp4 for mkv if preferred, but existing logic kept
                 pass
         elif ext.lower() == ".avi":
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
             out_filename = name_only + "_mc.avi"
         else:
-            tkMessageBox.showwarning("未対応形式", f"動画ファイル形式 {ext} は部分的な対応となる可能性があります。MP4として処理を試みます。")
-            print(f"未対応の動画ファイル形式 {ext} です。MP4 (mp4v) として処理を試みます。")
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            show_message('warning', "未対応形式", f"動画ファイル形式 {ext} は部分的な対応となる可能性があります。MP4として処理を試みます。", unattended)
+            print(f"未対応の動画ファイル形式 {ext} です。MP4 として処理を試みます。")
             out_filename = name_only + "_mc.mp4" # 出力拡張子を .mp4 に固定
 
-        out_path = os.path.join(OUTPUT_DIR, out_filename)
+        out_path = job.output or os.path.join(job.output_dir or OUTPUT_DIR, out_filename)
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+
+        # Everything besides the models that changes the output (a replaced audio file too)
+        if job.audio and job.audio not in audio_hashes:
+            audio_hashes[job.audio] = file_quick_hash(job.audio)
+        settings = {'pattern': job_pattern, 'triage': video_path in timelines,
+                    'audio': [os.path.abspath(job.audio), audio_hashes[job.audio]] if job.audio else None}
+        if mode != 'file' and not args.force:
+            reason = processed.check(video_path, out_path, detection_hash, settings)
+            if reason is None:
+                print(f"[INFO] {label}: up to date, skipped ({out_path})")
+                skipped += 1
+                continue
+            print(f"[INFO] {label}: rendering ({reason})")
 
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             print(f"エラー: 動画ファイルを開けませんでした: {video_path}")
-            tkMessageBox.showerror("エラー", f"動画ファイルを開けませんでした: {video_path}")
+            show_message('error', "エラー", f"動画ファイルを開けませんでした: {video_path}", unattended)
             continue
             
         fps = cap.get(cv2.CAP_PROP_FPS)
@@ -585,26 +701,48 @@ def main():
             print(f"警告: 動画の総フレーム数を取得できませんでした: {video_path}")
             total_frames = 1 # ダミー値（プログレスバー表示のため）
 
-        # モザイク処理用の一時ビデオファイル (音声なし)
+        # The rendered video has the source's frames at `fps`, so its length is known now:
+        # fit the external audio in the background during detection / compositing
+        prepared_audio = audio_label = None
+        audio_reused = False
+        if job.audio:
+            if job.audio not in audio_infos:
+                try:
+                    audio_infos[job.audio] = probe_media(job.audio)
+                except Exception as e:
+                    print(f"[WARNING] 音声ファイルの解析に失敗しました: {e}")
+                    audio_infos[job.audio] = None
+            if audio_infos[job.audio] is not None:
+                info = probe_video(video_path)
+                v_duration = info['frame_count'] / info['fps'] if info['frame_count'] and info['fps'] else info['duration']
+                if v_duration > 0:
+                    key = (os.path.abspath(job.audio), round(v_duration, 3))
+                    if key in prepared_audios:
+                        prepared_audio, audio_label = prepared_audios[key]
+                        audio_reused = True
+                        print(f"[INFO] {label}: 調整済み音声を再利用します ({audio_label})")
+                    else:
+                        audio_label = f"audio:{label}"
+                        prepared_audio = encode_queue.submit(audio_label, prepare_audio,
+                                                            job.audio, v_duration, audio_infos[job.audio])
+                        prepared_audios[key] = (prepared_audio, audio_label)
+
+        # モザイク処理用の一時ビデオファイル (音声なし, H.264: 音声合成時は映像をコピーするだけ)
         temp_video_path = ""
+        queued = False
         try:
-            with tempfile.NamedTemporaryFile(suffix=ext, delete=False, dir=TEMP_DIR) as tmp_vid:
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=TEMP_DIR) as tmp_vid:
                 temp_video_path = tmp_vid.name
+            render_start = time.perf_counter()
             
-            out_video_writer = cv2.VideoWriter(temp_video_path, fourcc, fps, (width, height))
+            out_video_writer = FfmpegPipeWriter(temp_video_path, width, height, fps)
             if not out_video_writer.isOpened():
                 print(f"エラー: 一時ビデオファイルの作成に失敗しました: {temp_video_path}")
-                tkMessageBox.showerror("エラー", f"一時ビデオファイルの作成に失敗しました。")
+                show_message('error', "エラー", "一時ビデオファイルの作成に失敗しました。", unattended)
                 cap.release()
                 if os.path.exists(temp_video_path): os.remove(temp_video_path)
                 continue
             
-            # Tracking History
-            track_history = {}
-            MAX_LOST_FRAMES = 15
-            last_known_boxes = []
-            no_detection_count = 0
-
             # 進捗バーGUI
             progress_root = tk.Tk()
             progress_root.title(f"動画モザイク処理進捗: {os.path.basename(video_path)}")
@@ -627,187 +765,46 @@ def main():
             percent_label.pack(pady=2)
             progress_root.update()
 
-            for frame_idx in range(total_frames):
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # --- Performance Optimization: GUI Update every 10 frames ---
-                if (frame_idx + 1) % 10 == 0 or frame_idx == 0 or frame_idx == total_frames - 1:
-                    status_label.config(text=f"{frame_idx + 1}/{total_frames} フレーム")
-                    percent = int((frame_idx + 1) / total_frames * 100) if total_frames > 0 else 0
-                    percent_label.config(text=f"進捗: {percent}%")
-                    progress_var.set(frame_idx + 1)
-                    progress_root.update()
-
-                img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                
-                # --- Multi-Layer Detection Logic Start ---
-                frame_rgb = np.array(img)
-                layer1_boxes = []  # Boxes from tracking
-                layer2_boxes = []  # Boxes from standalone detection
-                current_ids = set()
-                
-                # ===== LAYER 1: Tracking Detection =====
-                try:
-                    results = model.track(frame_rgb, persist=True, conf=0.10, iou=0.3, tracker="bytetrack.yaml", verbose=False)
-                    
-                    if results and results[0].boxes is not None and len(results[0].boxes) > 0:
-                        boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                        ids = results[0].boxes.id.cpu().numpy().astype(int) if results[0].boxes.id is not None else [None] * len(boxes)
-                        clss = results[0].boxes.cls.cpu().numpy().astype(int)
-                        
-                        for box, track_id, cls_idx in zip(boxes, ids, clss):
-                            cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                            if cls_name in ["make_love", "nipple"]: continue
-                            
-                            x1, y1, x2, y2 = box
-                            sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                            if sbox:
-                                layer1_boxes.append(sbox)
-                                if track_id is not None:
-                                    track_history[track_id] = {'box': sbox, 'lost_count': 0}
-                                    current_ids.add(track_id)
-                except Exception as e:
-                    print(f"[WARNING] Layer 1 (tracking) failed on frame {frame_idx}: {e}")
-                
-                # ===== LAYER 2: Standalone Detection (ALWAYS runs as cross-check) =====
-                try:
-                    results2 = model_detect(frame_rgb, conf=0.10, iou=0.3, verbose=False)
-                    
-                    if results2 and results2[0].boxes is not None and len(results2[0].boxes) > 0:
-                        boxes2 = results2[0].boxes.xyxy.cpu().numpy().astype(int)
-                        clss2 = results2[0].boxes.cls.cpu().numpy().astype(int)
-                        
-                        for box, cls_idx in zip(boxes2, clss2):
-                            cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                            if cls_name in ["make_love", "nipple"]: continue
-                            
-                            x1, y1, x2, y2 = box
-                            sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                            if sbox:
-                                layer2_boxes.append(sbox)
-                except Exception as e:
-                    print(f"[WARNING] Layer 2 (detection) failed on frame {frame_idx}: {e}")
-                
-                # ===== LAYER 4: NudeNet Cross-Check =====
-                layer4_boxes = []
-                if model_nudenet is not None:
-                    try:
-                        # Save to temp for NudeNet (some versions/backends prefer file paths)
-                        nn_tmp = os.path.join(TEMP_DIR, '_nn_tmp_speek.jpg')
-                        cv2.imwrite(nn_tmp, cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
-                        nn_results = model_nudenet.detect(nn_tmp)
-                        
-                        for det in nn_results:
-                            label = det.get('class', '')
-                            score = det.get('score', 0)
-                            if label not in NUDENET_NSFW_LABELS: continue
-                            if score < 0.3: continue
-                            
-                            nn_box = det.get('box', [])
-                            if len(nn_box) != 4: continue
-                            x1, y1, x2, y2 = int(nn_box[0]), int(nn_box[1]), int(nn_box[2]), int(nn_box[3])
-                            
-                            sbox = shrink_box(x1, y1, x2, y2)
-                            if sbox:
-                                layer4_boxes.append(sbox)
-                    except Exception as e:
-                        print(f"[WARNING] Layer 4 (NudeNet) failed on frame {frame_idx}: {e}")
-                
-                # Merge results from all layers
-                all_boxes = layer1_boxes + layer2_boxes + layer4_boxes
-                merged_boxes = merge_boxes(all_boxes)
-                
-                # Apply mosaic to all merged boxes
-                for (sx1, sy1, sx2, sy2) in merged_boxes:
-                    region = img.crop((sx1, sy1, sx2, sy2))
-                    mosaic = apply_pattern(region, pattern)
-                    img.paste(mosaic, (sx1, sy1, sx2, sy2))
-                
-                # Update last_known_boxes if we found anything
-                if len(merged_boxes) > 0:
-                    last_known_boxes = merged_boxes
-                    no_detection_count = 0
-                else:
-                    no_detection_count += 1
-                
-                # ===== LAYER 3: History Fallback =====
-                if len(merged_boxes) == 0 and last_known_boxes and no_detection_count <= MAX_LOST_FRAMES:
-                    for (sx1, sy1, sx2, sy2) in last_known_boxes:
-                        img_w, img_h = img.size
-                        sx1 = max(0, sx1); sy1 = max(0, sy1)
-                        sx2 = min(img_w, sx2); sy2 = min(img_h, sy2)
-                        if sx2 > sx1 and sy2 > sy1:
-                            region = img.crop((sx1, sy1, sx2, sy2))
-                            mosaic = apply_pattern(region, pattern)
-                            img.paste(mosaic, (sx1, sy1, sx2, sy2))
-                
-                # Handle tracked-ID-based Lost Tracks
-                for track_id, data in track_history.items():
-                    if track_id not in current_ids:
-                        data['lost_count'] += 1
-                        if data['lost_count'] <= MAX_LOST_FRAMES:
-                            sx1, sy1, sx2, sy2 = data['box']
-                            img_w, img_h = img.size
-                            sx1 = max(0, sx1); sy1 = max(0, sy1)
-                            sx2 = min(img_w, sx2); sy2 = min(img_h, sy2)
-                            if sx2 > sx1 and sy2 > sy1:
-                                region = img.crop((sx1, sy1, sx2, sy2))
-                                mosaic = apply_pattern(region, pattern)
-                                img.paste(mosaic, (sx1, sy1, sx2, sy2))
-                
-                # Clean up old tracks
-                track_history = {k: v for k, v in track_history.items() if v['lost_count'] <= MAX_LOST_FRAMES}
-                
-                # Preventive periodic tracker reset every 100 frames
-                if (frame_idx + 1) % 100 == 0:
-                    try:
-                        model.predictor = None
-                        # Don't clear track_history — Layer 3 fallback will still work
-                    except:
-                        pass
-                # --- Multi-Layer Detection Logic End ---
-
-                out_frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                out_video_writer.write(out_frame)
-            
+            def on_progress(idx, total):
+                status_label.config(text=f"{idx}/{total} フレーム")
+                percent = int(idx / total * 100) if total > 0 else 0
+                percent_label.config(text=f"進捗: {percent}%")
+                progress_var.set(idx)
+                progress_root.update()
+
+            # Triage: restrict dense detection to flagged intervals (+ margins)
+            dense_ranges = None
+            if video_path in timelines:
+                dense_ranges = dense_frame_ranges(timelines[video_path], fps)
+
+            source, recorder = prepare_source(video_path, detector, CACHE_DIR, detection_hash, dense_ranges, frame_cache)
+            monitor = RssMonitor()
+            stats = render_video(cap, out_video_writer, source, job_pattern, total_frames, on_progress, recorder,
+                                 monitor=monitor)
+            if stats['dense_frames']:
+                print(f"[INFO] {filename}: frame cache hits {stats['cache_hits']}/{stats['dense_frames']}")
+            print(f"[INFO] {filename}: {monitor.report()}")
+            if recorder is not None:
+                recorder.save(cache_path(CACHE_DIR, video_path))
+
             cap.release()
             out_video_writer.release()
             progress_root.destroy()
             print(f"モザイク処理完了: {temp_video_path}")
 
-            # 音声追加処理
-            if add_audio and audio_path and os.path.exists(audio_path):
-                # User selected external audio
-                print(f"音声合成処理開始: audio={audio_path}, temp_video={temp_video_path}, output={out_path}")
-                try:
-                    adjust_audio_to_video(audio_path, temp_video_path, out_path)
-                    print(f"音声合成成功。最終出力: {out_path}")
-                    processed_outputs.append(out_path)
-                except Exception as e:
-                    print(f"音声合成に失敗しました: {e}")
-                    tkMessageBox.showerror("音声合成エラー", f"音声合成に失敗しました: {e}\nモザイク処理済みの動画（音声なし）を保存します。")
-                    if os.path.exists(temp_video_path):
-                         if os.path.exists(out_path): os.remove(out_path)
-                         shutil.move(temp_video_path, out_path)
-                         processed_outputs.append(out_path)
-            else:
-                # No external audio selected. Try to copy ORIGINAL audio.
-                if not add_audio:
-                     print("外部音声追加は選択されていません。元動画の音声を試みます。")
-                
-                # Try muxing original audio
-                has_audio = mux_original_audio(temp_video_path, video_path, out_path)
-                if not has_audio:
-                    # Just move/copy temp video -> Now transcode to H.264
-                    print(f"音声が見つかりません。映像をH.264に変換して保存します: {out_path}")
-                    transcode_to_h264(temp_video_path, out_path)
-                    print(f"音声なし。モザイク処理済み動画を保存: {out_path}")
-                else:
-                    print(f"元動画の音声を合成しました: {out_path}")
-                
-                processed_outputs.append(out_path)
+            timings.append({'label': label, 'render': time.perf_counter() - render_start,
+                            'audio_label': audio_label, 'audio_reused': audio_reused})
+
+            # 音声追加処理 (バックグラウンド。次の動画の検出をすぐに開始する)
+            if not job.audio:
+                 print("外部音声追加は選択されていません。元動画の音声を試みます。")
+            future = encode_queue.submit(label, finalize_video, temp_video_path, video_path, out_path,
+                                         job.audio, prepared_audio)
+            # An output saved without its external audio is not recorded, so the next run retries it
+            processed.record_when_done(future, video_path, out_path, detection_hash, settings,
+                                       accept=lambda result: result[1] is None)
+            job_patterns[label] = job_pattern
+            queued = True
             
             # tkMessageBox.showinfo("完了", ... ) -> Removed per request to do all at end, 
             # BUT original code had it per video. 
@@ -819,11 +816,11 @@ def main():
 
         except Exception as e:
             print(f"ビデオ {video_path} の処理中にエラーが発生しました: {e}")
-            tkMessageBox.showerror("処理エラー", f"ビデオ {os.path.basename(video_path)} の処理中にエラーが発生しました: {e}")
+            show_message('error', "処理エラー", f"ビデオ {os.path.basename(video_path)} の処理中にエラーが発生しました: {e}", unattended)
         finally:
             if cap.isOpened(): cap.release()
             if 'out_video_writer' in locals() and out_video_writer.isOpened(): out_video_writer.release() # locals()で存在確認
-            if os.path.exists(temp_video_path):
+            if not queued and os.path.exists(temp_video_path):
                 try:
                     # OUTPUTにmoveされた場合は元のtempは消えているはずだが、copyされた場合やエラー残存の場合に備え削除トライ
                     if os.path.exists(temp_video_path):
@@ -834,6 +831,27 @@ def main():
                 except OSError as e:
                     print(f"[ERROR] 一時ビデオファイル {temp_video_path} の削除に失敗しました: {e}")
     
+    audio_labels = {audio_label for _, audio_label in prepared_audios.values()}
+    for label, result, error in encode_queue.drain():
+        if label in audio_labels:
+            continue  # Audio preparation: its failure is reported by the video's mux job
+        if error is not None:
+            show_message('error', "処理エラー", f"ビデオ {label} の音声合成/変換中にエラーが発生しました: {error}", unattended)
+            continue
+        saved_path, audio_error = result
+        if audio_error is not None:
+            show_message('error', "音声合成エラー", f"{label}: 音声合成に失敗しました: {audio_error}\nモザイク処理済みの動画（音声なし）を保存しました。", unattended)
+        processed_outputs.append(saved_path)
+        output_patterns[saved_path] = job_patterns[label]
+    encode_queue.close()
+    if skipped:
+        print(f"[INFO] {skipped} up-to-date video(s) skipped (--force to re-render)")
+    if timings:
+        print_job_timings(timings, encode_queue.durations, encode_queue.durations)
+
+    print(f"[INFO] {frame_cache.report()}")
+    frame_cache.close()
+
     # Clean up all temp files at the end of session
     cleanup_tmp_dir()
 
@@ -845,8 +863,20 @@ def main():
         else:
             outlist = '\n'.join(processed_outputs)
             msg = f"全ての動画の処理が完了しました。\n出力数: {len(processed_outputs)}\n(詳細はコンソールを確認してください)"
+        if skipped:
+            msg += f"\n処理済みのためスキップ: {skipped}本"
+    elif skipped:
+        show_message('info', "処理済み", f"全ての動画 ({skipped}本) が処理済みです。\n再処理するには --force を指定してください。", unattended)
     
-    if msg:
+    if msg and unattended:
+        print(f"[INFO] {msg}")
+        if args.rescan:
+            rescan_total_fixed = 0
+            for out_path in processed_outputs:
+                if os.path.exists(out_path):
+                    rescan_total_fixed += rescan_video(out_path, detector, output_patterns[out_path]) or 0
+            print(f"[INFO] 再スキャン完了: {rescan_total_fixed}フレームを修正しました。")
+    elif msg:
         # Create a hidden root to ensuring the dialog appears
         final_root = tk.Tk()
         final_root.withdraw()
@@ -854,8 +884,8 @@ def main():
         final_root.lift()
         final_root.focus_force()
         
-        # Offer rescan option
-        do_rescan = tkMessageBox.askyesno(
+        # Offer rescan option (--rescan: no question)
+        do_rescan = args.rescan or tkMessageBox.askyesno(
             "完了",
             msg + "\n\n再スキャン検証を行いますか？\n（出力動画を再チェックしてモザイク漏れを修正します）",
             parent=final_root
@@ -865,7 +895,7 @@ def main():
             rescan_total_fixed = 0
             for out_path in processed_outputs:
                 if os.path.exists(out_path):
-                    fixed = rescan_video(out_path, model_detect, model_nudenet, pattern, names)
+                    fixed = rescan_video(out_path, detector, output_patterns[out_path])
                     if fixed:
                         rescan_total_fixed += fixed
             
@@ -881,7 +911,7 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        main(sys.argv[1:])
     except Exception as e:
         print(f"予期せぬエラーが発生しました: {e}")
         import traceback
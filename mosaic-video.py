@@ -1,30 +1,43 @@
 import os
 import sys
+import time
+from functools import partial
 import cv2
 import numpy as np
 from PIL import Image
-from ultralytics import YOLO
 import tkinter as tk
 import shutil
-from collections import deque
 
-# NudeNet (Layer 4) - optional
-try:
-    from nudenet import NudeDetector
-except ImportError:
-    NudeDetector = None
-
-# NudeNet NSFW labels that require mosaic
-NUDENET_NSFW_LABELS = {
-    'FEMALE_GENITALIA_EXPOSED',
-    'MALE_GENITALIA_EXPOSED', 
-    'ANUS_EXPOSED',
-}
+from mosaic_core.decode import BACKEND_OPENCV, DECODE_BACKENDS, open_video
+from mosaic_core.detection import load_detector, merge_boxes
+from mosaic_core.detection_cache import cache_path
+from mosaic_core.encode_queue import ENCODE_WORKERS, EncodeQueue
+from mosaic_core.ffmpeg_io import (
+    FRAGMENT_SECONDS, FfmpegPipeWriter, PROGRESSIVE_FMP4, PROGRESSIVE_FORMATS, PROGRESSIVE_HLS,
+    PROXY_AUDIO_BITRATE, PROXY_CRF, PROXY_HEIGHT, PROXY_PRESET, open_progressive_writer, progressive_output_path,
+)
+from mosaic_core.frame_cache import FrameFingerprintCache
+from mosaic_core.hashing import model_hash
+from mosaic_core.metrics import RssMonitor
+from mosaic_core.processed import PROCESSED_MANIFEST, ProcessedManifest, is_rendered_output
+from mosaic_core.profiler import profiler
+from mosaic_core.render import LiveDetection, PATTERNS, paint_boxes, prepare_source, proxy_size, render_video
+from mosaic_core.stream import (
+    STREAM_LATENCY_MS, STREAM_MAX_STRIDE, open_stream_source, open_stream_writer, run_stream,
+)
+from mosaic_core.thread_budget import MODE_PIPELINE, MODE_PROCESSES, configure_threads, plan_threads
+from mosaic_core.triage import dense_frame_ranges, load_timeline, prioritize
+from mosaic_core.worker_pool import DetectionWorkerPool, render_video_pooled
 
 # --- Constants for Directories ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMP_DIR = os.path.join(BASE_DIR, 'tmp')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+TRIAGE_DIR = os.path.join(OUTPUT_DIR, 'triage')
+PROXY_DIR = os.path.join(OUTPUT_DIR, 'proxy')
+STREAM_DIR = os.path.join(OUTPUT_DIR, 'stream')
+CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'detections')
+FRAME_CACHE_PATH = os.path.join(BASE_DIR, 'cache', 'frame_fingerprints.sqlite')
 
 # Ensure directories exist
 os.makedirs(TEMP_DIR, exist_ok=True)
@@ -46,7 +59,7 @@ def cleanup_tmp_dir():
 def ask_mosaic_pattern():
     import tkinter as tk
     from tkinter import ttk
-    patterns = ["モザイク小", "モザイク中", "モザイク大", "ぼかし", "黒塗り"]
+    patterns = PATTERNS
     selected = [patterns[0]]
     cancelled = [False]
     def on_select(event=None):
@@ -92,71 +105,6 @@ def ask_mosaic_pattern():
         return None
     return selected[0]
 
-def apply_pattern(region, pattern):
-    w, h = region.size
-    if pattern == "モザイク大":
-        small = region.resize((max(1, w // 32), max(1, h // 32)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "モザイク中":
-        small = region.resize((max(1, w // 16), max(1, h // 16)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "モザイク小":
-        small = region.resize((max(1, w // 8), max(1, h // 8)), Image.Resampling.BICUBIC)
-        return small.resize((w, h), Image.Resampling.NEAREST)
-    elif pattern == "ぼかし":
-        from PIL import ImageFilter
-        # Resolution-adaptive blur radius - Weaker based on user feedback
-        blur_radius = max(8, min(w, h) // 10)
-        return region.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    elif pattern == "黒塗り":
-        return Image.new("RGB", (w, h), (0, 0, 0))
-    else:
-        return region
-
-# --- Class-based shrink ratios for optimal mosaic coverage ---
-SHRINK_RATIOS = {
-    'penis':  (0.70, 0.55), # More aggressive shrink per user request
-    'vagina': (0.70, 0.55),
-    'anus':   (0.65, 0.65),
-}
-DEFAULT_SHRINK = (0.60, 0.50)
-
-def shrink_box(x1, y1, x2, y2, cls_name=''):
-    """Shrink detection box to mosaic area based on detected class."""
-    w, h = x2 - x1, y2 - y1
-    if w < 10 or h < 10:
-        return None
-    ratio_w, ratio_h = SHRINK_RATIOS.get(cls_name, DEFAULT_SHRINK)
-    dx = int(w * ratio_w / 2)
-    dy = int(h * ratio_h / 2)
-    sx1 = x1 + dx; sy1 = y1 + dy
-    sx2 = x2 - dx; sy2 = y2 - dy
-    if sx2 > sx1 and sy2 > sy1:
-        return (sx1, sy1, sx2, sy2)
-    return None
-
-def merge_boxes(all_boxes, iou_threshold=0.3):
-    """De-duplicate overlapping boxes using IoU. Keeps larger box on overlap."""
-    merged = []
-    for box in all_boxes:
-        is_duplicate = False
-        for i, existing in enumerate(merged):
-            ix1 = max(box[0], existing[0]); iy1 = max(box[1], existing[1])
-            ix2 = min(box[2], existing[2]); iy2 = min(box[3], existing[3])
-            if ix1 < ix2 and iy1 < iy2:
-                inter_area = (ix2 - ix1) * (iy2 - iy1)
-                box_area = (box[2] - box[0]) * (box[3] - box[1])
-                existing_area = (existing[2] - existing[0]) * (existing[3] - existing[1])
-                union_area = box_area + existing_area - inter_area
-                if union_area > 0 and inter_area / union_area > iou_threshold:
-                    is_duplicate = True
-                    if box_area > existing_area:
-                        merged[i] = box
-                    break
-        if not is_duplicate:
-            merged.append(box)
-    return merged
-
 
 def ask_video_mode():
     import tkinter as tk
@@ -180,6 +128,27 @@ def ask_video_mode():
     root.destroy()
     return mode['value']
 
+def ask_use_triage(video_paths):
+    """If triage timelines exist for the selected videos, ask whether to use them.
+    Returns {video_path: timeline} (empty when unused)."""
+    import tkinter.messagebox as tkMessageBox
+    timelines = {}
+    for path in video_paths:
+        if path:
+            tl = load_timeline(TRIAGE_DIR, path)
+            if tl is not None:
+                timelines[path] = tl
+    if not timelines:
+        return {}
+    root = tk.Tk(); root.withdraw()
+    use = tkMessageBox.askyesno(
+        "トリアージ結果",
+        f"{len(timelines)}本の動画にトリアージ結果があります。\n"
+        "検出区間の多い動画から処理し、検出区間(前後マージン付き)のみ精密検出しますか？",
+        parent=root)
+    root.destroy()
+    return timelines if use else {}
+
 def transcode_to_h264(input_path, output_path):
     import ffmpeg
     try:
@@ -197,6 +166,7 @@ def transcode_to_h264(input_path, output_path):
 
 def mux_audio(video_path, audio_source, output_path):
     import ffmpeg
+    temp_mux_out = output_path + ".temp_mux.mp4"
     try:
         # Check if audio source has audio stream
         probe = ffmpeg.probe(audio_source)
@@ -204,9 +174,6 @@ def mux_audio(video_path, audio_source, output_path):
         if not audio_streams:
             return False # No audio to mux
         
-        # Create temp output for muxing
-        temp_mux_out = output_path + ".temp_mux.mp4"
-        
         input_video = ffmpeg.input(video_path)
         input_audio = ffmpeg.input(audio_source)
         
@@ -229,9 +196,26 @@ def mux_audio(video_path, audio_source, output_path):
         if os.path.exists(temp_mux_out): os.remove(temp_mux_out)
     return False
 
-def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
-    """Post-scan verification: re-scan output video and fix any missed areas."""
-    import tempfile
+def finish_output(temp_video_out, video_path, out_path):
+    """Mux the original audio into the rendered video (or transcode it when there is none)."""
+    with profiler.span('mux (bg)'):
+        has_audio = mux_audio(temp_video_out, video_path, out_path)
+    if not has_audio:
+        # Just move the temp video to output if no audio muxed -> Now transcode to H.264
+        if os.path.exists(out_path): os.remove(out_path)
+        print(f"音声が見つかりません。映像をH.264に変換して保存します: {out_path}")
+        with profiler.span('transcode (bg)'):
+            transcode_to_h264(temp_video_out, out_path)
+    else:
+        # If muxing succeeded, temp_video_out is still there needed to be cleaned?
+        # mux_audio attempts to rename inside. If it fails, we handle it.
+        if os.path.exists(temp_video_out): os.remove(temp_video_out)
+    print(f"[INFO] Saved: {out_path}")
+    return out_path
+
+def rescan_video(video_path, detector, pattern, progressive=None, fragment_seconds=FRAGMENT_SECONDS):
+    """Post-scan verification: re-scan output video and fix any missed areas.
+    A fragmented MP4 (progressive='fmp4') is re-emitted as one, with its audio, in the same pass."""
     from tkinter import ttk
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
@@ -245,7 +229,11 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
     total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     
     temp_rescan = os.path.join(TEMP_DIR, f"rescan_{os.path.basename(video_path)}")
-    out = cv2.VideoWriter(temp_rescan, fourcc, fps, (width, height))
+    if progressive == PROGRESSIVE_FMP4:
+        out = open_progressive_writer(temp_rescan, progressive, width, height, fps,
+                                      audio_source=video_path, fragment_seconds=fragment_seconds)
+    else:
+        out = cv2.VideoWriter(temp_rescan, fourcc, fps, (width, height))
     
     # Progress bar
     if tk._default_root:
@@ -295,37 +283,14 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
         
         # Detection with model_detect (isolated YOLO)
         try:
-            results = model_detect(frame_rgb, conf=0.10, iou=0.3, verbose=False)
-            if results and results[0].boxes is not None and len(results[0].boxes) > 0:
-                boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                clss = results[0].boxes.cls.cpu().numpy().astype(int)
-                for box, cls_idx in zip(boxes, clss):
-                    cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                    if cls_name in ["make_love", "nipple"]: continue
-                    x1, y1, x2, y2 = box
-                    sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                    if sbox:
-                        detected_boxes.append(sbox)
+            detected_boxes.extend(b for b, _ in detector.detect(frame_rgb))
         except Exception as e:
             pass
         
         # Detection with NudeNet
-        if model_nudenet is not None:
+        if detector.has_nudenet:
             try:
-                nn_tmp = os.path.join(TEMP_DIR, '_nn_rescan_tmp.jpg')
-                cv2.imwrite(nn_tmp, cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
-                nn_results = model_nudenet.detect(nn_tmp)
-                for det in nn_results:
-                    label = det.get('class', '')
-                    score = det.get('score', 0)
-                    if label not in NUDENET_NSFW_LABELS: continue
-                    if score < 0.3: continue
-                    nn_box = det.get('box', [])
-                    if len(nn_box) != 4: continue
-                    x1, y1, x2, y2 = int(nn_box[0]), int(nn_box[1]), int(nn_box[2]), int(nn_box[3])
-                    sbox = shrink_box(x1, y1, x2, y2)
-                    if sbox:
-                        detected_boxes.append(sbox)
+                detected_boxes.extend(b for b, _ in detector.nudenet(frame_rgb))
             except Exception as e:
                 pass
         
@@ -333,10 +298,7 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
         detected_boxes = merge_boxes(detected_boxes)
         if detected_boxes:
             fixed_count += 1
-            for (sx1, sy1, sx2, sy2) in detected_boxes:
-                region = img.crop((sx1, sy1, sx2, sy2))
-                mosaic = apply_pattern(region, pattern)
-                img.paste(mosaic, (sx1, sy1, sx2, sy2))
+            paint_boxes(img, detected_boxes, pattern)
         
         out_frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
         out.write(out_frame)
@@ -346,7 +308,11 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
     progress_root.destroy()
     
     # Replace original with rescanned version (preserve audio)
-    if fixed_count > 0:
+    if fixed_count > 0 and progressive == PROGRESSIVE_FMP4:
+        # Already H.264 + audio, fragmented: mp4v + mux_audio would turn it into a regular MP4
+        os.replace(temp_rescan, video_path)
+        print(f"[INFO] Rescan complete: {fixed_count} frames fixed.")
+    elif fixed_count > 0:
         has_audio = mux_audio(temp_rescan, video_path, video_path + ".tmp")
         if has_audio:
             if os.path.exists(video_path): os.remove(video_path)
@@ -364,30 +330,122 @@ def rescan_video(video_path, model_detect, model_nudenet, pattern, names):
     return fixed_count
 
 
-def main():
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="動画自動モザイク")
+    parser.add_argument('--proxy', action='store_true',
+                        help="確認用の低解像度プレビュー(プロキシ)を出力する")
+    parser.add_argument('--proxy-height', type=int, default=PROXY_HEIGHT,
+                        help=f"プロキシの高さ (default: {PROXY_HEIGHT})")
+    parser.add_argument('--no-outlines', action='store_true',
+                        help="プロキシにレイヤー別の検出枠を描画しない")
+    parser.add_argument('--progressive', choices=PROGRESSIVE_FORMATS,
+                        help="処理中から再生できる形式で出力する (fmp4: 断片化MP4 / hls: HLSセグメント+プレイリスト)")
+    parser.add_argument('--fragment-seconds', type=float, default=FRAGMENT_SECONDS,
+                        help=f"--progressive の断片 (セグメント) の長さ 秒 (default: {FRAGMENT_SECONDS:g})")
+    parser.add_argument('--force', action='store_true',
+                        help="フォルダ処理で処理済み (入力・モデル・設定が未変更) の動画も再処理する")
+    parser.add_argument('--decoder', choices=DECODE_BACKENDS, default=BACKEND_OPENCV,
+                        help=f"デコードバックエンド (default: {BACKEND_OPENCV})")
+    parser.add_argument('--encode-workers', type=int, default=ENCODE_WORKERS,
+                        help=f"音声多重化/H.264変換を次の動画の検出と並行して行うスレッド数 (0=逐次, default: {ENCODE_WORKERS})")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="検出ワーカープロセス数 (共有メモリで並列検出, 0=無効)")
+    # Live / stream mode
+    parser.add_argument('--stream', metavar='SRC',
+                        help="ライブ入力 (RTSP/HTTP URL, デバイス番号, または '-' で標準入力の生BGR24フレーム)")
+    parser.add_argument('--stream-output', metavar='DST',
+                        help="ストリーム出力先 (ファイル, udp://..., rtsp://..., '-' で標準出力) "
+                             "(default: output/stream/stream_<日時>.ts)")
+    parser.add_argument('--stream-size', metavar='WxH',
+                        help="標準入力フレームのサイズ (例: 1280x720)")
+    parser.add_argument('--stream-fps', type=float, help="入力フレームレート (default: 入力から取得 / 30)")
+    parser.add_argument('--latency-ms', type=float, default=STREAM_LATENCY_MS,
+                        help=f"1フレームあたりの遅延上限 ms (default: {STREAM_LATENCY_MS})")
+    parser.add_argument('--max-stride', type=int, default=STREAM_MAX_STRIDE,
+                        help=f"検出が追いつかない時の最大検出間隔フレーム数 (default: {STREAM_MAX_STRIDE})")
+    parser.add_argument('--max-frames', type=int, help="指定フレーム数で終了 (検証用)")
+    parser.add_argument('--pattern', choices=PATTERNS, default="モザイク中",
+                        help="ストリームモードのモザイクパターン")
+    # Profiling
+    parser.add_argument('--profile', action='store_true',
+                        help="処理段階毎の時間 (mean/p50/p95/p99) を動画毎に表示する")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="Chrome trace / Perfetto 形式の JSON を出力する (--profile を含む)")
+    return parser.parse_args(argv)
+
+def stream_main(args, detector):
+    """Live mode: mosaic a stream with a latency budget (no dialogs)."""
+    size = None
+    if args.stream_size:
+        try:
+            w, h = args.stream_size.lower().split('x')
+            size = (int(w), int(h))
+        except ValueError:
+            print(f"[ERROR] Invalid --stream-size: {args.stream_size}")
+            return 1
+    try:
+        source = open_stream_source(args.stream, size, args.stream_fps)
+    except (IOError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 1
+
+    out_path = args.stream_output
+    if not out_path:
+        # MPEG-TS stays playable even if the stream is cut off
+        os.makedirs(STREAM_DIR, exist_ok=True)
+        out_path = os.path.join(STREAM_DIR, time.strftime("stream_%Y%m%d_%H%M%S.ts"))
+    writer = open_stream_writer(out_path, source.width, source.height, source.fps)
+    print(f"[INFO] Stream: {args.stream} ({source.width}x{source.height} @ {source.fps:.2f} fps) -> {out_path}")
+    print(f"[INFO] Latency budget {args.latency_ms:.0f}ms, max stride {args.max_stride}")
+
+    profiler.begin_video(str(args.stream))
+    stats = {'frames': 0}
+    try:
+        stats = run_stream(source, writer, LiveDetection(detector), args.pattern,
+                           budget_ms=args.latency_ms, max_stride=args.max_stride, max_frames=args.max_frames)
+    finally:
+        writer.release()
+        source.close()
+        profiler.end_video(stats['frames'])
+    return 0
+
+def main(argv=None):
     import tkinter.filedialog as tkFileDialog
     import tkinter.messagebox as tkMessageBox
     from tkinter import ttk
-    import tempfile 
 
-    # モデル・クラス名
-    names = ['anus', 'make_love', 'nipple', 'penis', 'vagina']
+    args = parse_args(argv)
+    if args.profile or args.trace:
+        profiler.enable(trace=bool(args.trace))
+    # Background mux / transcode (ffmpeg) runs beside the next video's detection:
+    # it gets a stage's share of the cores (proxy / progressive / stream never queue any)
+    encode_stages = 1 if args.encode_workers > 0 and not (args.stream or args.proxy or args.progressive) else 0
+    if args.workers > 0 and not args.stream:
+        configure_threads(MODE_PROCESSES, args.workers + encode_stages)
+    elif encode_stages:
+        configure_threads(MODE_PIPELINE, 1 + encode_stages)
+    else:
+        configure_threads()
+
+    # モデル (Layer 1: Tracking / Layer 2: Standalone detection / Layer 4: NudeNet)
     yolo_model_path = os.path.join(os.path.dirname(__file__), 'erax_nsfw_yolo11m.pt')
     try:
-        model = YOLO(yolo_model_path)          # For Layer 1: Tracking
-        model_detect = YOLO(yolo_model_path)   # For Layer 2: Standalone detection (isolated from tracker state)
+        detector = load_detector(yolo_model_path, TEMP_DIR)
     except Exception as e:
+        if args.stream:
+            print(f"[ERROR] YOLOモデルの読み込みに失敗しました: {e}")
+            sys.exit(1)
         tkMessageBox.showerror("エラー", f"YOLOモデルの読み込みに失敗しました。\n{e}")
         return
-    
-    # Layer 4: NudeNet (optional, graceful skip if unavailable)
-    model_nudenet = None
-    if NudeDetector is not None:
-        try:
-            model_nudenet = NudeDetector()
-            print("[INFO] NudeNet Layer 4 loaded successfully.")
-        except Exception as e:
-            print(f"[WARNING] NudeNet initialization failed (Layer 4 disabled): {e}")
+    if args.stream:
+        code = stream_main(args, detector)
+        if args.trace:
+            profiler.dump_trace(args.trace)
+        sys.exit(code)
+    # Detection cache key: YOLO weights + whether Layer 4 actually loaded
+    detection_hash = model_hash(yolo_model_path) + ('+nn' if detector.has_nudenet else '')
+    frame_cache = FrameFingerprintCache(FRAME_CACHE_PATH, detection_hash)
 
     # --- 新モード選択 ---
     mode = ask_video_mode()
@@ -413,8 +471,7 @@ def main():
             print("フォルダが選択されませんでした。処理を中止します。")
             return
         video_paths = [os.path.join(folder, f) for f in os.listdir(folder)
-                      if f.lower().endswith((".mp4", ".avi", ".mov"))
-                      and not (f.lower().endswith("_mc.mp4") or f.lower().endswith("_mc.avi") or f.lower().endswith("_mc.mov"))]
+                      if f.lower().endswith((".mp4", ".avi", ".mov")) and not is_rendered_output(f)]
         if not video_paths:
             tkMessageBox.showinfo("動画なし", "選択フォルダに対応動画がありません。", parent=None)
             return
@@ -425,7 +482,25 @@ def main():
     if pattern is None:
         print("キャンセルされました。処理を中止します。")
         return
+    timelines = ask_use_triage(video_paths)
+    if timelines:
+        video_paths = prioritize(video_paths, timelines)
+
+    # Detection worker processes (each loads its own YOLO / NudeNet)
+    pool = None
+    if args.workers > 0:
+        try:
+            pool = DetectionWorkerPool(partial(load_detector, yolo_model_path, TEMP_DIR, tracking=False),
+                                       args.workers, plan_threads(MODE_PROCESSES, args.workers + encode_stages))
+        except RuntimeError as e:
+            print(f"[WARNING] {e} - falling back to single-process detection.")
+
     processed_outputs = []  # 追加: 出力ファイルパスを格納
+    # Folder mode: skip videos whose output is up to date (same input, models and settings)
+    processed = ProcessedManifest(os.path.join(OUTPUT_DIR, PROCESSED_MANIFEST))
+    skipped = 0
+    # Mux / transcode of finished renders overlaps the next video's detection
+    encode_queue = EncodeQueue(args.encode_workers)
     
     # Check if tmp and output dirs exist
     if not os.path.exists(TEMP_DIR):
@@ -457,22 +532,57 @@ def main():
             out_filename = name_only + "_mc.mp4"
             
         out_path = os.path.join(OUTPUT_DIR, out_filename)
+        if args.progressive:
+            out_path = progressive_output_path(args.progressive, OUTPUT_DIR, name_only + "_mc")
+        # Everything besides the models that changes the rendered output
+        # (worker pool: IoU association instead of ByteTrack, which gives different boxes)
+        settings = {'pattern': pattern, 'triage': video_path in timelines, 'progressive': args.progressive,
+                    'fragment_seconds': args.fragment_seconds if args.progressive else None,
+                    'tracker': 'iou' if pool is not None else 'bytetrack'}
+        if mode == 'folder' and not args.proxy and not args.force:
+            reason = processed.check(video_path, out_path, detection_hash, settings)
+            if reason is None:
+                print(f"[INFO] {filename}: up to date, skipped ({out_path})")
+                skipped += 1
+                continue
+            print(f"[INFO] {filename}: rendering ({reason})")
 
-        cap = cv2.VideoCapture(video_path)
+        try:
+            cap = open_video(video_path, args.decoder)
+        except IOError as e:
+            print(f"[ERROR] {e}")
+            continue
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
-        # Temp video file for processing (before audio muxing)
-        temp_video_out = os.path.join(TEMP_DIR, f"temp_proc_{os.path.basename(out_filename)}")
-        out = cv2.VideoWriter(temp_video_out, fourcc, fps, (width, height))
-        
-        # Tracker History: {track_id: {'box': (x1, y1, x2, y2), 'lost_count': 0}}
-        track_history = {}
-        MAX_LOST_FRAMES = 15 # Hold position for up to 15 frames (increased from 8)
-        last_known_boxes = []  # Layer 3: last known detection positions
-        no_detection_count = 0  # Counter for consecutive frames with no detection
+        if args.proxy:
+            # Proxy preview: downscaled, fast preset, low bitrate, audio muxed in the same pass
+            os.makedirs(PROXY_DIR, exist_ok=True)
+            out_path = os.path.join(PROXY_DIR, name_only + "_proxy.mp4")
+            out_size = proxy_size(width, height, args.proxy_height)
+        elif args.progressive:
+            # Progressive output: H.264 + source audio written fragment by fragment,
+            # playable (and uploadable) while the rest is still rendering
+            out_size = None
+            print(f"[INFO] Progressive output (playable while rendering): {out_path}")
+        else:
+            # Temp video file for processing (before audio muxing)
+            out_size = None
+            temp_video_out = os.path.join(TEMP_DIR, f"temp_proc_{os.path.basename(out_filename)}")
+
+        def open_writer():
+            """This video's writer (opened from scratch again if the render restarts)."""
+            if args.proxy:
+                return FfmpegPipeWriter(out_path, out_size[0], out_size[1], fps, audio_source=video_path,
+                                        preset=PROXY_PRESET, crf=PROXY_CRF, audio_bitrate=PROXY_AUDIO_BITRATE)
+            if args.progressive:
+                return open_progressive_writer(out_path, args.progressive, width, height, fps,
+                                               audio_source=video_path, fragment_seconds=args.fragment_seconds)
+            return cv2.VideoWriter(temp_video_out, fourcc, fps, (width, height))
+
+        out = open_writer()
         
         # 進捗バー
         progress_root = tk.Tk()
@@ -495,171 +605,85 @@ def main():
         percent_label = tk.Label(progress_root, text="", font=("Segoe UI", 12), bg="#23272e", fg="#fff")
         percent_label.pack(pady=2)
         progress_root.update()
-        idx = 0
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            idx += 1
-            
-            # --- Performance Optimization: GUI Update every 10 frames ---
-            if idx % 10 == 0 or idx == 1 or idx == total:
-                status_label.config(text=f"{idx}/{total} フレーム")
-                percent = int(idx / total * 100)
-                percent_label.config(text=f"進捗: {percent}%")
-                progress_var.set(idx)
-                progress_root.update()
-            
-            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            
-            # --- Multi-Layer Detection Logic Start ---
-            frame_rgb = np.array(img)
-            layer1_boxes = []  # Boxes from tracking
-            layer2_boxes = []  # Boxes from standalone detection
-            current_ids = set()
-            
-            # ===== LAYER 1: Tracking Detection =====
-            try:
-                results = model.track(frame_rgb, persist=True, conf=0.10, iou=0.3, tracker="bytetrack.yaml", verbose=False)
-                
-                if results and results[0].boxes is not None and len(results[0].boxes) > 0:
-                    boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                    ids = results[0].boxes.id.cpu().numpy().astype(int) if results[0].boxes.id is not None else [None] * len(boxes)
-                    clss = results[0].boxes.cls.cpu().numpy().astype(int)
-                    
-                    for box, track_id, cls_idx in zip(boxes, ids, clss):
-                        cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                        if cls_name in ["make_love", "nipple"]: continue
-                        
-                        x1, y1, x2, y2 = box
-                        sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                        if sbox:
-                            layer1_boxes.append(sbox)
-                            if track_id is not None:
-                                track_history[track_id] = {'box': sbox, 'lost_count': 0}
-                                current_ids.add(track_id)
-            except Exception as e:
-                print(f"[WARNING] Layer 1 (tracking) failed on frame {idx}: {e}")
-            
-            # ===== LAYER 2: Standalone Detection (ALWAYS runs as cross-check) =====
-            try:
-                results2 = model_detect(frame_rgb, conf=0.10, iou=0.3, verbose=False)
-                
-                if results2 and results2[0].boxes is not None and len(results2[0].boxes) > 0:
-                    boxes2 = results2[0].boxes.xyxy.cpu().numpy().astype(int)
-                    clss2 = results2[0].boxes.cls.cpu().numpy().astype(int)
-                    
-                    for box, cls_idx in zip(boxes2, clss2):
-                        cls_name = names[cls_idx] if cls_idx < len(names) else ""
-                        if cls_name in ["make_love", "nipple"]: continue
-                        
-                        x1, y1, x2, y2 = box
-                        sbox = shrink_box(x1, y1, x2, y2, cls_name)
-                        if sbox:
-                            layer2_boxes.append(sbox)
-            except Exception as e:
-                print(f"[WARNING] Layer 2 (detection) failed on frame {idx}: {e}")
-            
-            # ===== LAYER 4: NudeNet Cross-Check =====
-            layer4_boxes = []
-            if model_nudenet is not None:
-                try:
-                    nn_tmp = os.path.join(TEMP_DIR, '_nn_tmp.jpg')
-                    cv2.imwrite(nn_tmp, cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
-                    nn_results = model_nudenet.detect(nn_tmp)
-                    
-                    for det in nn_results:
-                        label = det.get('class', '')
-                        score = det.get('score', 0)
-                        if label not in NUDENET_NSFW_LABELS: continue
-                        if score < 0.3: continue
-                        
-                        nn_box = det.get('box', [])
-                        if len(nn_box) != 4: continue
-                        x1, y1, x2, y2 = int(nn_box[0]), int(nn_box[1]), int(nn_box[2]), int(nn_box[3])
-                        sbox = shrink_box(x1, y1, x2, y2)
-                        if sbox:
-                            layer4_boxes.append(sbox)
-                except Exception as e:
-                    print(f"[WARNING] Layer 4 (NudeNet) failed on frame {idx}: {e}")
-            
-            # Merge results from all layers
-            all_boxes = layer1_boxes + layer2_boxes + layer4_boxes
-            merged_boxes = merge_boxes(all_boxes)
-            
-            # Apply mosaic to all merged boxes
-            for (sx1, sy1, sx2, sy2) in merged_boxes:
-                region = img.crop((sx1, sy1, sx2, sy2))
-                mosaic = apply_pattern(region, pattern)
-                img.paste(mosaic, (sx1, sy1, sx2, sy2))
-            
-            # Update last_known_boxes if we found anything
-            if len(merged_boxes) > 0:
-                last_known_boxes = merged_boxes
-                no_detection_count = 0
-            else:
-                no_detection_count += 1
-            
-            # ===== LAYER 3: History Fallback =====
-            if len(merged_boxes) == 0 and last_known_boxes and no_detection_count <= MAX_LOST_FRAMES:
-                for (sx1, sy1, sx2, sy2) in last_known_boxes:
-                    img_w, img_h = img.size
-                    sx1 = max(0, sx1); sy1 = max(0, sy1)
-                    sx2 = min(img_w, sx2); sy2 = min(img_h, sy2)
-                    if sx2 > sx1 and sy2 > sy1:
-                        region = img.crop((sx1, sy1, sx2, sy2))
-                        mosaic = apply_pattern(region, pattern)
-                        img.paste(mosaic, (sx1, sy1, sx2, sy2))
-            
-            # Handle tracked-ID-based Lost Tracks
-            for track_id, data in track_history.items():
-                if track_id not in current_ids:
-                    data['lost_count'] += 1
-                    if data['lost_count'] <= MAX_LOST_FRAMES:
-                        sx1, sy1, sx2, sy2 = data['box']
-                        img_w, img_h = img.size
-                        sx1 = max(0, sx1); sy1 = max(0, sy1)
-                        sx2 = min(img_w, sx2); sy2 = min(img_h, sy2)
-                        if sx2 > sx1 and sy2 > sy1:
-                            region = img.crop((sx1, sy1, sx2, sy2))
-                            mosaic = apply_pattern(region, pattern)
-                            img.paste(mosaic, (sx1, sy1, sx2, sy2))
-            
-            # Clean up old tracks
-            track_history = {k: v for k, v in track_history.items() if v['lost_count'] <= MAX_LOST_FRAMES}
-            
-            # Preventive periodic tracker reset every 100 frames
-            if idx % 100 == 0:
-                try:
-                    model.predictor = None
-                    # Don't clear track_history — Layer 3 fallback will still work
-                except:
-                    pass
-            
-            # --- Multi-Layer Detection Logic End ---
 
-            out_frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-            out.write(out_frame)
+        def on_progress(idx, total):
+            status_label.config(text=f"{idx}/{total} フレーム")
+            percent = int(idx / total * 100) if total > 0 else 0
+            percent_label.config(text=f"進捗: {percent}%")
+            progress_var.set(idx)
+            progress_root.update()
+
+        # Triage: restrict dense detection to flagged intervals (+ margins)
+        dense_ranges = None
+        if video_path in timelines:
+            dense_ranges = dense_frame_ranges(timelines[video_path], fps)
+
+        source, recorder = prepare_source(video_path, detector, CACHE_DIR, detection_hash, dense_ranges, frame_cache,
+                                          tracker=settings['tracker'])
+        monitor = RssMonitor()
+        profiler.begin_video(filename)
+        outlines = args.proxy and not args.no_outlines
+        stats = None
+        if pool is not None and isinstance(source, LiveDetection):
+            try:
+                stats = render_video_pooled(cap, out, pool, pattern, total, on_progress, recorder,
+                                            dense_ranges, frame_cache, out_size=out_size,
+                                            outlines=outlines, monitor=monitor)
+            except RuntimeError as e:
+                # A worker died: drop the pool and render this video again in-process
+                print(f"[WARNING] {e} - re-rendering {filename} with single-process detection.")
+                pool.close()
+                pool = None
+                settings['tracker'] = 'bytetrack'
+                cap.release()
+                out.release()
+                cap = open_video(video_path, args.decoder)
+                out = open_writer()
+                source, recorder = prepare_source(video_path, detector, CACHE_DIR, detection_hash, dense_ranges,
+                                                  frame_cache, tracker=settings['tracker'])
+        if stats is None:
+            stats = render_video(cap, out, source, pattern, total, on_progress, recorder,
+                                 out_size=out_size, outlines=outlines, monitor=monitor)
+        if stats['dense_frames']:
+            print(f"[INFO] {filename}: frame cache hits {stats['cache_hits']}/{stats['dense_frames']}")
+        print(f"[INFO] {filename}: {monitor.report()}")
             
         cap.release()
         out.release()
         progress_root.destroy()
+        if recorder is not None:
+            recorder.save(cache_path(CACHE_DIR, video_path))
+
+        profiler.end_video(stats['frames'], monitor.peak)
+        if args.proxy:
+            print(f"[INFO] Proxy preview saved: {out_path}")
+            processed_outputs.append(out_path)
+            continue
+        if args.progressive:
+            # Already H.264 with audio: nothing left to mux or transcode
+            print(f"[INFO] Saved: {out_path}")
+            processed_outputs.append(out_path)
+            processed.record(video_path, out_path, detection_hash, settings)
+            continue
         
-        # Audio Muxing
-        has_audio = mux_audio(temp_video_out, video_path, out_path)
-        if not has_audio:
-            # Just move the temp video to output if no audio muxed -> Now transcode to H.264
-            if os.path.exists(out_path): os.remove(out_path)
-            print(f"音声が見つかりません。映像をH.264に変換して保存します: {out_path}")
-            transcode_to_h264(temp_video_out, out_path)
-        else:
-            # If muxing succeeded, temp_video_out is still there needed to be cleaned?
-            # mux_audio attempts to rename inside. If it fails, we handle it.
-            if os.path.exists(temp_video_out): os.remove(temp_video_out)
-            
-        processed_outputs.append(out_path)
+        # Audio Muxing (background; the next video starts detecting right away)
+        future = encode_queue.submit(filename, profiler.bind(finish_output), temp_video_out, video_path, out_path)
+        processed.record_when_done(future, video_path, out_path, detection_hash, settings)
+
+    for _, saved_path, error in encode_queue.drain():
+        if error is None:
+            processed_outputs.append(saved_path)
+    encode_queue.close()
+    if skipped:
+        print(f"[INFO] {skipped} up-to-date video(s) skipped (--force to re-render)")
         
+    print(f"[INFO] {frame_cache.report()}")
+    frame_cache.close()
+    if pool is not None:
+        pool.close()
+    if args.trace:
+        profiler.dump_trace(args.trace)
+
     # Cleanup all temp files at the very end
     cleanup_tmp_dir()
     
@@ -671,8 +695,25 @@ def main():
         else:
             outlist = '\n'.join(processed_outputs)
             msg = f"全ての動画の処理が完了しました。\n出力数: {len(processed_outputs)}\n(詳細はコンソールを確認してください)"
+        if skipped:
+            msg += f"\n処理済みのためスキップ: {skipped}本"
+    elif skipped:
+        final_root = tk.Tk()
+        final_root.withdraw()
+        tkMessageBox.showinfo("処理済み", f"全ての動画 ({skipped}本) が処理済みです。\n再処理するには --force を指定してください。",
+                              parent=final_root)
+        final_root.destroy()
     
-    if msg:
+    if msg and args.proxy:
+        final_root = tk.Tk()
+        final_root.withdraw()
+        tkMessageBox.showinfo(
+            "プレビュー作成完了",
+            msg + "\n\n枠の色: 水色=追跡(L1) / 緑=検出(L2) / マゼンタ=NudeNet(L4) / オレンジ=履歴(L3)\n"
+            "検出結果はキャッシュされ、本番レンダリングで再利用されます。",
+            parent=final_root)
+        final_root.destroy()
+    elif msg:
         # Create a hidden root to ensuring the dialog appears
         final_root = tk.Tk()
         final_root.withdraw()
@@ -690,8 +731,11 @@ def main():
         if do_rescan:
             rescan_total_fixed = 0
             for out_path in processed_outputs:
+                if args.progressive == PROGRESSIVE_HLS:
+                    print(f"[INFO] Rescan skipped for HLS output: {out_path}")
+                    continue
                 if os.path.exists(out_path):
-                    fixed = rescan_video(out_path, model_detect, model_nudenet, pattern, names)
+                    fixed = rescan_video(out_path, detector, pattern, args.progressive, args.fragment_seconds)
                     if fixed:
                         rescan_total_fixed += fixed
             
@@ -704,7 +748,7 @@ def main():
     
     # FORCE EXIT APP
     sys.exit(0)
-        
-    # FORCE EXIT APP
-    sys.exit(0)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
 
@@ -0,0 +1 @@
+# mosaic_core package
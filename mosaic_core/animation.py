@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Animated GIF / WebP
+Multi-frame handling for mosaic-image.py. Each frame is compared with the
+previous one: unchanged frames reuse its detections, and frames where only
+part of the picture changed are detected on the changed area alone (GIFs
+usually update a small rectangle per frame). The crops of several frames go
+to the model in one call. Covered boxes then pass through the same IoU
+tracking + hold-over as the video scripts, so a region missed on a frame or
+two stays covered. Frames are re-assembled with their original durations.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence
+
+from PIL import Image, ImageChops, ImageSequence
+
+from mosaic_core.detection import NAMES, HoldOverState, IouTracker, clip_box
+from mosaic_core.images import IMAGE_BATCH_SIZE, Box, Detection, detect_images, mosaic_boxes, to_model_input
+
+ANIMATED_EXTS = (".gif", ".webp")
+ANIM_DELTA_THRESHOLD = 8      # Per-pixel grey difference treated as noise (dithering, lossy WebP)
+ANIM_DELTA_MARGIN = 32        # Context around the changed area given to the detector (px)
+ANIM_FULL_AREA = 0.6          # A change covering this much of the frame is detected on the full frame
+ANIM_KEYFRAME_INTERVAL = 30   # Full-frame detection at least this often (drops stale carried boxes)
+ANIM_MAX_LOST = 5             # Frames a lost region stays covered
+ANIM_DEFAULT_DURATION = 100   # ms, for frames without one
+ANIM_PALETTE_SAMPLES = 32     # Frames sampled to build a GIF's shared palette
+
+
+@dataclass
+class Animation:
+    """アニメーション画像のフレームと再生情報"""
+    frames: List[Image.Image]                  # RGB, or RGBA when the source has transparency
+    durations: List[int]                       # ms per frame
+    loop: int = 0
+    info: dict = field(default_factory=dict)   # Source stats filled by detect_animation()
+
+
+def is_animated(path: str) -> bool:
+    """True for a GIF / WebP with more than one frame."""
+    if not path.lower().endswith(ANIMATED_EXTS):
+        return False
+    try:
+        with Image.open(path) as img:
+            return bool(getattr(img, 'is_animated', False))
+    except Exception:
+        return False
+
+
+def shared_palette(frames: Sequence[Image.Image]) -> Optional[Image.Image]:
+    """
+    One palette for every frame of a GIF (None for transparent frames).
+
+    When all frames use at most 256 colours in total the palette holds exactly
+    those (lossless); otherwise it is built from a montage of reduced frames.
+    Unlike PIL's per-frame palettes, unchanged pixels keep their index from frame
+    to frame, so the GIF's frame deltas stay small and colours don't flicker.
+    """
+    if any(f.mode != "RGB" for f in frames):
+        return None
+    colors = set()
+    for frame in frames:
+        used = frame.getcolors(256)
+        colors.update(c for _, c in used or ())
+        if used is None or len(colors) > 256:
+            break
+    else:
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([v for c in sorted(colors) for v in c])
+        return palette
+    step = max(1, len(frames) // ANIM_PALETTE_SAMPLES)
+    thumbs = [f.reduce(max(1, max(f.size) // 128)) for f in frames[::step]]
+    montage = Image.new("RGB", (thumbs[0].width, sum(t.height for t in thumbs)))
+    y = 0
+    for thumb in thumbs:
+        montage.paste(thumb, (0, y))
+        y += thumb.height
+    return montage.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+
+def animation_bytes(path: str) -> int:
+    """Memory read_animation() holds for `path`: every frame decoded, 4 bytes per pixel."""
+    with Image.open(path) as img:
+        return getattr(img, 'n_frames', 1) * img.width * img.height * 4
+
+
+def read_animation(path: str) -> Animation:
+    """Decode every frame (composited, as displayed) with its duration."""
+    with Image.open(path) as img:
+        transparent = img.mode in ("RGBA", "LA") or 'transparency' in img.info
+        mode = "RGBA" if transparent else "RGB"
+        frames, durations = [], []
+        for frame in ImageSequence.Iterator(img):
+            frames.append(frame.convert(mode))
+            durations.append(frame.info.get('duration') or ANIM_DEFAULT_DURATION)
+        loop = img.info.get('loop', 0)
+    return Animation(frames, durations, loop)
+
+
+def changed_region(prev: Image.Image, cur: Image.Image) -> Optional[Box]:
+    """Bounding box of the pixels that changed beyond noise; None if the frame is unchanged."""
+    diff = ImageChops.difference(prev, cur).convert("L")
+    return diff.point(lambda v: 255 if v > ANIM_DELTA_THRESHOLD else 0).getbbox()
+
+
+def _inside(box: Box, region: Box) -> bool:
+    return box[0] >= region[0] and box[1] >= region[1] and box[2] <= region[2] and box[3] <= region[3]
+
+
+def _plan_region(prev: Image.Image, cur: Image.Image, known: List[Detection]) -> Optional[Box]:
+    """Area of `cur` to detect on: None (unchanged), a crop, or the full frame."""
+    width, height = cur.size
+    region = changed_region(prev, cur)
+    if region is None:
+        return None
+    x1, y1, x2, y2 = region
+    region = (max(0, x1 - ANIM_DELTA_MARGIN), max(0, y1 - ANIM_DELTA_MARGIN),
+              min(width, x2 + ANIM_DELTA_MARGIN), min(height, y2 + ANIM_DELTA_MARGIN))
+    # Regions known to reach into the change are detected whole, not cut by the crop
+    for (bx1, by1, bx2, by2), _, _ in known:
+        if bx1 < region[2] and bx2 > region[0] and by1 < region[3] and by2 > region[1]:
+            region = (min(region[0], bx1), min(region[1], by1), max(region[2], bx2), max(region[3], by2))
+    region = clip_box(region, width, height)
+    if (region[2] - region[0]) * (region[3] - region[1]) >= ANIM_FULL_AREA * width * height:
+        return (0, 0, width, height)
+    return region
+
+
+def detect_animation(model, anim: Animation, names: Sequence[str] = NAMES, batch_size: int = IMAGE_BATCH_SIZE,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> List[List[Detection]]:
+    """
+    Per-frame detections, running the model only on what changed between frames.
+
+    Frames are planned batch_size at a time against the detections known when the
+    batch starts, then resolved in order: an unchanged frame copies the previous
+    frame's detections, a partial frame keeps the previous detections that lie
+    outside its crop and adds the crop's.
+
+    Args:
+        on_progress: Called as (frames done, frames total) after each batch
+    """
+    frames = anim.frames
+    width, height = frames[0].size
+    full = (0, 0, width, height)
+    out: List[List[Detection]] = []
+    inferred = partial = 0
+    since_full = 0
+    for k in range(0, len(frames), max(1, batch_size)):
+        known = out[-1] if out else []
+        plan: List[Optional[Box]] = []
+        for i in range(k, min(len(frames), k + batch_size)):
+            region = full if i == 0 else _plan_region(frames[i - 1], frames[i], known)
+            if region is not None and region != full:
+                # Carried boxes can go stale over many partial frames; unchanged frames can't
+                since_full += 1
+                if since_full >= ANIM_KEYFRAME_INTERVAL:
+                    region = full
+            if region == full:
+                since_full = 0
+            plan.append(region)
+        todo = [(j, region) for j, region in enumerate(plan) if region is not None]
+        crops = [to_model_input(frames[k + j].crop(region).convert("RGB")) for j, region in todo]
+        found = dict(zip((j for j, _ in todo), detect_images(model, crops, names)))
+        inferred += len(todo)
+        for j, region in enumerate(plan):
+            prev = out[-1] if out else []
+            if region is None:
+                out.append(list(prev))
+                continue
+            rx, ry = region[0], region[1]
+            dets = [((x1 + rx, y1 + ry, x2 + rx, y2 + ry), cls_name, conf)
+                    for (x1, y1, x2, y2), cls_name, conf in found[j]]
+            if region != full:
+                partial += 1
+                dets.extend(d for d in prev if not _inside(d[0], region))
+            out.append(dets)
+        if on_progress is not None:
+            on_progress(len(out), len(frames))
+    anim.info.update(frames=len(frames), inferred=inferred, partial=partial, unchanged=len(frames) - inferred)
+    return out
+
+
+def cover_boxes(detections: Sequence[List[Detection]], max_lost: int = ANIM_MAX_LOST) -> List[List[Box]]:
+    """Boxes to cover per frame: this frame's mosaic boxes plus the tracked / held-over ones."""
+    tracker = IouTracker()
+    hold = HoldOverState(max_lost)
+    out = []
+    for dets in detections:
+        boxes = mosaic_boxes(dets)
+        current_ids = hold.observe_tracks(tracker.update(boxes))
+        out.append(boxes + hold.update(boxes, current_ids))
+    return out
+
+
+def save_animation(anim: Animation, path: str):
+    """Write the frames as an animation in the format of the extension, with the original timing."""
+    frames = anim.frames
+    params = dict(save_all=True, append_images=frames[1:], duration=anim.durations, loop=anim.loop)
+    if frames[0].mode == "RGBA":
+        # Frames are already composited: each one replaces the last. With the default
+        # disposal a transparent pixel would show the previous frame through it.
+        params['disposal'] = 2
+    if path.lower().endswith(".gif"):
+        palette = shared_palette(frames)
+        if palette is not None:
+            # No dithering: an unchanged area must map to the same indices on every frame
+            frames = [f.quantize(palette=palette, dither=Image.Dither.NONE) for f in frames]
+            params['append_images'] = frames[1:]
+        params['optimize'] = True  # Trim the palette to the colours used
+    frames[0].save(path, **params)
+
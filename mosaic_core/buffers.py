@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Frame Buffer Pool
+Fixed set of preallocated frame buffers recycled through the video loop so
+decode, colour conversion and compositing don't allocate per frame.
+"""
+
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+FRAME_POOL_SIZE = 2
+
+
+class FramePool:
+    """事前確保フレームバッファのプール"""
+
+    def __init__(self, shape: Tuple[int, ...], count: int = FRAME_POOL_SIZE, dtype=np.uint8):
+        """
+        Args:
+            shape: Frame shape, e.g. (height, width, 3)
+            count: Number of buffers; acquire() blocks while all are in use
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.count = count
+        self._free: List[np.ndarray] = [np.empty(self.shape, self.dtype) for _ in range(count)]
+        self._cond = threading.Condition()
+
+    @property
+    def nbytes(self) -> int:
+        return self.count * int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def acquire(self, timeout: Optional[float] = None) -> np.ndarray:
+        """Take a free buffer, waiting until one is released."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                raise TimeoutError("No free frame buffer")
+            return self._free.pop()
+
+    def release(self, buf: np.ndarray):
+        """Return a buffer once its frame has been written/encoded."""
+        if buf.shape != self.shape or buf.dtype != self.dtype:
+            return  # Not one of ours (e.g. a decoder that ignored the target buffer)
+        with self._cond:
+            self._free.append(buf)
+            self._cond.notify()
+
+
+class ByteBudget:
+    """バイト数で上限を設けたメモリ予算 (先読み・書き出し待ちの画像の総量を制限)"""
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit: Bytes that may be held at once. An item larger than the whole
+                budget is still admitted, but only when nothing else is held.
+        """
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None):
+        """Reserve nbytes, waiting until enough has been released."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.used == 0 or self.used + nbytes <= self.limit, timeout):
+                raise TimeoutError("Memory budget exhausted")
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.used = max(0, self.used - nbytes)
+            self._cond.notify_all()
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Video Decode Backends
+cv2.VideoCapture-compatible readers over OpenCV, PyAV (frame-threaded
+decoding) and a raw ffmpeg pipe, with per-frame timestamps, keyframe-based
+accurate seeking and optional decode-time downscaling.
+"""
+
+import queue
+import re
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# PyAV - optional
+try:
+    import av
+except ImportError:
+    av = None
+
+BACKEND_OPENCV = 'opencv'
+BACKEND_PYAV = 'pyav'
+BACKEND_FFMPEG = 'ffmpeg'
+DECODE_BACKENDS = (BACKEND_OPENCV, BACKEND_PYAV, BACKEND_FFMPEG)
+
+_PTS_TIME = re.compile(r'pts_time:\s*(-?[\d.]+)')
+
+
+def available_backends():
+    """Backends usable in this environment."""
+    backends = [BACKEND_OPENCV]
+    if av is not None:
+        backends.append(BACKEND_PYAV)
+    if shutil.which('ffmpeg'):
+        backends.append(BACKEND_FFMPEG)
+    return backends
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """
+    Stream metadata: width, height, fps, frame_count, duration.
+
+    The frame count comes from the container (PyAV, then ffprobe) when possible;
+    OpenCV's CAP_PROP_FRAME_COUNT is duration * fps and is off for VFR files.
+    """
+    if av is not None:
+        try:
+            with av.open(path) as container:
+                stream = container.streams.video[0]
+                fps = float(stream.average_rate or stream.guessed_rate or 0) or 30.0
+                duration = float(stream.duration * stream.time_base) if stream.duration else \
+                    (container.duration / 1e6 if container.duration else 0.0)
+                return {
+                    'width': stream.codec_context.width,
+                    'height': stream.codec_context.height,
+                    'fps': fps,
+                    'frame_count': stream.frames or int(round(duration * fps)),
+                    'duration': duration,
+                    'codec': stream.codec_context.name,
+                }
+        except Exception:
+            pass
+    if shutil.which('ffprobe'):
+        try:
+            import ffmpeg
+            info = next(s for s in ffmpeg.probe(path)['streams'] if s.get('codec_type') == 'video')
+            num, den = (info.get('avg_frame_rate') or '0/1').split('/')
+            fps = float(num) / float(den) if float(den) else 30.0
+            duration = float(info.get('duration') or 0.0)
+            return {
+                'width': int(info['width']),
+                'height': int(info['height']),
+                'fps': fps or 30.0,
+                'frame_count': int(info.get('nb_frames') or round(duration * fps)),
+                'duration': duration,
+                'codec': info.get('codec_name', ''),
+            }
+        except Exception:
+            pass
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps,
+            'frame_count': count,
+            'duration': count / fps,
+            'codec': '',
+        }
+    finally:
+        cap.release()
+
+
+def scaled_size(width: int, height: int, max_side: Optional[int]) -> Tuple[int, int]:
+    """Even-sized (width, height) fitting in max_side (unchanged if already smaller)."""
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    w = max(2, int(round(width * scale)))
+    h = max(2, int(round(height * scale)))
+    return w - w % 2, h - h % 2
+
+
+class VideoReader(ABC):
+    """デコーダー共通インターフェース (cv2.VideoCapture 互換)"""
+
+    backend = ''
+
+    def __init__(self, path: str, max_side: Optional[int] = None):
+        self.path = path
+        self.info = probe_video(path)
+        self.src_size = (self.info['width'], self.info['height'])
+        self.width, self.height = scaled_size(self.info['width'], self.info['height'], max_side)
+        self.scaled = (self.width, self.height) != self.src_size
+        self.fps = self.info['fps']
+        self.frame_count = self.info['frame_count']
+        self.timestamp: Optional[float] = None  # Seconds, of the last frame returned
+        self.position = 0                       # Index of the next frame (after a seek: estimated)
+
+    # --- cv2.VideoCapture compatibility ---
+    def isOpened(self) -> bool:
+        return True
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return (self.timestamp or 0.0) * 1000.0
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def _out(self, arr: np.ndarray, image: Optional[np.ndarray]) -> np.ndarray:
+        if image is not None and image.shape == arr.shape and image.dtype == arr.dtype:
+            np.copyto(image, arr)
+            return image
+        return arr
+
+    @abstractmethod
+    def read(self, image: Optional[np.ndarray] = None):
+        """Decode the next frame (into `image` when given). Returns (ret, frame) like cv2."""
+
+    def grab(self) -> bool:
+        return self.read()[0]
+
+    @abstractmethod
+    def seek(self, seconds: float):
+        """Position so the next read() returns the first frame at or after `seconds`."""
+
+    def release(self):
+        pass
+
+
+class OpenCVReader(VideoReader):
+    """OpenCV (FFMPEG バックエンド) デコーダー"""
+
+    backend = BACKEND_OPENCV
+
+    def __init__(self, path: str, max_side: Optional[int] = None, threads: int = 0):
+        super().__init__(path, max_side)
+        params = [cv2.CAP_PROP_N_THREADS, threads] if threads and hasattr(cv2, 'CAP_PROP_N_THREADS') else []
+        self.cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, params) if params else cv2.VideoCapture(path)
+        self._full = np.empty((self.src_size[1], self.src_size[0], 3), np.uint8) if self.scaled else None
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def read(self, image: Optional[np.ndarray] = None):
+        if self.scaled:
+            ret, frame = self.cap.read(self._full)
+            if ret:
+                dst = image if image is not None and image.shape == (self.height, self.width, 3) else None
+                frame = cv2.resize(frame, (self.width, self.height), dst=dst, interpolation=cv2.INTER_AREA)
+        else:
+            ret, frame = self.cap.read(image) if image is not None else self.cap.read()
+        if ret:
+            self.timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            self.position += 1
+        return ret, frame
+
+    def grab(self) -> bool:
+        ok = self.cap.grab()
+        if ok:
+            self.timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            self.position += 1
+        return ok
+
+    def seek(self, seconds: float):
+        # The FFMPEG backend seeks to the preceding keyframe and decodes forward
+        self.cap.set(cv2.CAP_PROP_POS_MSEC, max(0.0, seconds) * 1000.0)
+        self.position = int(round(seconds * self.fps))
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVReader(VideoReader):
+    """PyAV デコーダー (フレーム/スライス並列デコード)"""
+
+    backend = BACKEND_PYAV
+
+    def __init__(self, path: str, max_side: Optional[int] = None, threads: int = 0):
+        if av is None:
+            raise ImportError("PyAV (av) is not installed")
+        super().__init__(path, max_side)
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'      # Frame + slice threading
+        self.stream.thread_count = threads     # 0 = one per core
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+
+    def _next(self):
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            return frame
+        try:
+            return next(self._frames)
+        except (StopIteration, av.error.EOFError):
+            return None
+
+    def read(self, image: Optional[np.ndarray] = None):
+        frame = self._next()
+        if frame is None:
+            return False, None
+        self.timestamp = frame.time
+        self.position += 1
+        if self.scaled:
+            arr = frame.to_ndarray(width=self.width, height=self.height, format='bgr24', interpolation='AREA')
+        else:
+            arr = frame.to_ndarray(format='bgr24')
+        return True, self._out(arr, image)
+
+    def grab(self) -> bool:
+        frame = self._next()
+        if frame is None:
+            return False
+        self.timestamp = frame.time
+        self.position += 1
+        return True
+
+    def seek(self, seconds: float):
+        tb = self.stream.time_base
+        target = int(max(0.0, seconds) / tb) + (self.stream.start_time or 0)
+        self.container.seek(target, stream=self.stream, backward=True, any_frame=False)
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+        # Decode forward from the keyframe to the first frame at/after the target
+        half = 0.5 / self.fps
+        while True:
+            frame = self._next()
+            if frame is None:
+                break
+            if frame.time is None or frame.time >= seconds - half:
+                self._pending = frame
+                break
+        self.position = int(round(seconds * self.fps))
+
+    def release(self):
+        self.container.close()
+
+
+class FfmpegPipeReader(VideoReader):
+    """ffmpeg 生フレームパイプ デコーダー (showinfo でタイムスタンプ取得)"""
+
+    backend = BACKEND_FFMPEG
+
+    def __init__(self, path: str, max_side: Optional[int] = None, threads: int = 0):
+        super().__init__(path, max_side)
+        self.threads = threads
+        self.frame_bytes = self.width * self.height * 3
+        self._proc = None
+        self._start(0.0)
+
+    def _start(self, start: float):
+        import ffmpeg
+        self.release()
+        in_kwargs = {'threads': self.threads} if self.threads else {}
+        if start > 0:
+            in_kwargs['ss'] = start  # Input seeking: keyframe seek + exact decode to `start`
+        stream = ffmpeg.input(self.path, **in_kwargs).video
+        if self.scaled:
+            stream = stream.filter('scale', self.width, self.height, flags='area')
+        stream = stream.filter('showinfo')
+        self._start_offset = start
+        self._pts: 'queue.Queue' = queue.Queue()
+        self._proc = (
+            ffmpeg
+            .output(stream, 'pipe:', format='rawvideo', pix_fmt='bgr24', fps_mode='passthrough')
+            .global_args('-hide_banner', '-nostats', '-loglevel', 'info')
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+        threading.Thread(target=self._read_stderr, args=(self._proc, self._pts), daemon=True).start()
+
+    @staticmethod
+    def _read_stderr(proc, pts_queue):
+        for line in iter(proc.stderr.readline, b''):
+            if b'pts_time' in line:
+                m = _PTS_TIME.search(line.decode('utf-8', 'replace'))
+                if m:
+                    pts_queue.put(float(m.group(1)))
+
+    def read(self, image: Optional[np.ndarray] = None):
+        if self._proc is None:
+            return False, None
+        shape = (self.height, self.width, 3)
+        buf = image if image is not None and image.shape == shape and image.flags['C_CONTIGUOUS'] \
+            else np.empty(shape, np.uint8)
+        view = memoryview(buf).cast('B')
+        got = 0
+        while got < self.frame_bytes:
+            n = self._proc.stdout.readinto(view[got:])
+            if not n:
+                return False, None
+            got += n
+        try:
+            pts = self._pts.get(timeout=1.0)
+            self.timestamp = self._start_offset + pts
+        except queue.Empty:
+            self.timestamp = self.position / self.fps  # showinfo line not seen; estimate
+        self.position += 1
+        return True, buf
+
+    def seek(self, seconds: float):
+        self._start(max(0.0, seconds))
+        self.position = int(round(seconds * self.fps))
+
+    def release(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdout.close()
+            except OSError:
+                pass
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+
+_READERS = {
+    BACKEND_OPENCV: OpenCVReader,
+    BACKEND_PYAV: PyAVReader,
+    BACKEND_FFMPEG: FfmpegPipeReader,
+}
+
+
+def open_video(path: str, backend: str = BACKEND_OPENCV, max_side: Optional[int] = None,
+               threads: int = 0) -> VideoReader:
+    """
+    Open a video with the given decode backend.
+
+    Args:
+        path: Video file
+        backend: 'opencv', 'pyav' or 'ffmpeg' (falls back to OpenCV if unavailable)
+        max_side: Downscale frames at decode time to fit this size (detection streams)
+        threads: Decoder threads (0 = backend default / auto)
+
+    Raises:
+        IOError: if the video cannot be opened
+    """
+    if backend not in available_backends():
+        if backend not in _READERS:
+            raise ValueError(f"Unknown decode backend: {backend}")
+        print(f"[WARNING] Decode backend '{backend}' is not available, using OpenCV.")
+        backend = BACKEND_OPENCV
+    try:
+        reader = _READERS[backend](path, max_side=max_side, threads=threads)
+    except Exception as e:
+        raise IOError(f"Cannot open video ({backend}): {path}: {e}")
+    if not reader.isOpened():
+        raise IOError(f"Cannot open video ({backend}): {path}")
+    return reader
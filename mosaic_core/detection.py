@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Multi-Layer Detection
+Shared Layer 1 (tracking) / Layer 2 (detection) / Layer 3 (history) / Layer 4 (NudeNet)
+logic used by the video mosaic scripts.
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from mosaic_core.profiler import profiler
+from mosaic_core.thread_budget import apply_ort_options
+
+# NudeNet (Layer 4) - optional
+try:
+    from nudenet import NudeDetector
+except ImportError:
+    NudeDetector = None
+
+# EraX-NSFW-V1.0のクラス名（https://huggingface.co/erax-ai/EraX-NSFW-V1.0?not-for-all-audiences=true）
+NAMES = ['anus', 'make_love', 'nipple', 'penis', 'vagina']
+# Classes that are detected but never mosaicked
+SKIP_CLASSES = {'make_love', 'nipple'}
+
+# NudeNet NSFW labels that require mosaic
+NUDENET_NSFW_LABELS = {
+    'FEMALE_GENITALIA_EXPOSED',
+    'MALE_GENITALIA_EXPOSED',
+    'ANUS_EXPOSED',
+}
+NUDENET_MIN_SCORE = 0.3
+
+# YOLO thresholds shared by Layer 1 / Layer 2
+YOLO_CONF = 0.10
+YOLO_IOU = 0.3
+
+MAX_LOST_FRAMES = 15         # Hold position for up to 15 frames
+TRACKER_RESET_INTERVAL = 100  # Preventive periodic tracker reset
+
+# Layer identifiers (statistics, colour-coded previews)
+LAYER_TRACK = 'track'
+LAYER_DETECT = 'detect'
+LAYER_NUDENET = 'nudenet'
+LAYER_HISTORY = 'history'
+LAYER_NAMES = [LAYER_TRACK, LAYER_DETECT, LAYER_NUDENET, LAYER_HISTORY]
+LAYER_CODES = {name: code for code, name in enumerate(LAYER_NAMES)}
+
+# --- Class-based shrink ratios for optimal mosaic coverage ---
+SHRINK_RATIOS = {
+    'penis':  (0.70, 0.55), # More aggressive shrink per user request
+    'vagina': (0.70, 0.55),
+    'anus':   (0.65, 0.65),
+}
+DEFAULT_SHRINK = (0.60, 0.50)
+
+Box = Tuple[int, int, int, int]
+
+
+def shrink_box(x1, y1, x2, y2, cls_name=''):
+    """Shrink detection box to mosaic area based on detected class."""
+    w, h = x2 - x1, y2 - y1
+    if w < 10 or h < 10:
+        return None
+    ratio_w, ratio_h = SHRINK_RATIOS.get(cls_name, DEFAULT_SHRINK)
+    dx = int(w * ratio_w / 2)
+    dy = int(h * ratio_h / 2)
+    sx1 = x1 + dx; sy1 = y1 + dy
+    sx2 = x2 - dx; sy2 = y2 - dy
+    if sx2 > sx1 and sy2 > sy1:
+        return (int(sx1), int(sy1), int(sx2), int(sy2))
+    return None
+
+
+def merge_boxes(all_boxes, iou_threshold=0.3):
+    """De-duplicate overlapping boxes using IoU. Keeps larger box on overlap."""
+    merged = []
+    for box in all_boxes:
+        is_duplicate = False
+        for i, existing in enumerate(merged):
+            ix1 = max(box[0], existing[0]); iy1 = max(box[1], existing[1])
+            ix2 = min(box[2], existing[2]); iy2 = min(box[3], existing[3])
+            if ix1 < ix2 and iy1 < iy2:
+                inter_area = (ix2 - ix1) * (iy2 - iy1)
+                box_area = (box[2] - box[0]) * (box[3] - box[1])
+                existing_area = (existing[2] - existing[0]) * (existing[3] - existing[1])
+                union_area = box_area + existing_area - inter_area
+                if union_area > 0 and inter_area / union_area > iou_threshold:
+                    is_duplicate = True
+                    if box_area > existing_area:
+                        merged[i] = box
+                    break
+        if not is_duplicate:
+            merged.append(box)
+    return merged
+
+
+def box_iou(a, b) -> float:
+    """IoU of two (x1, y1, x2, y2, ...) boxes."""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def clip_box(box, width, height) -> Optional[Box]:
+    """Clip a box to the frame. Returns None if nothing is left."""
+    x1, y1, x2, y2 = box[:4]
+    x1 = max(0, x1); y1 = max(0, y1)
+    x2 = min(width, x2); y2 = min(height, y2)
+    if x2 > x1 and y2 > y1:
+        return (x1, y1, x2, y2)
+    return None
+
+
+def _parse_yolo(results):
+    """Extract (xyxy, cls, conf, ids) numpy arrays from an ultralytics result list."""
+    if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+        return None
+    b = results[0].boxes
+    boxes = b.xyxy.cpu().numpy().astype(int)
+    clss = b.cls.cpu().numpy().astype(int)
+    confs = b.conf.cpu().numpy()
+    ids = b.id.cpu().numpy().astype(int) if b.id is not None else [None] * len(boxes)
+    return boxes, clss, confs, ids
+
+
+class MultiLayerDetector:
+    """マルチレイヤー検出器 (Layer 1 / Layer 2 / Layer 4)"""
+
+    def __init__(self, model=None, model_detect=None, model_nudenet=None,
+                 names=None, nn_tmp_path: Optional[str] = None):
+        """
+        Args:
+            model: YOLO instance used for Layer 1 tracking (None disables Layer 1)
+            model_detect: YOLO instance for Layer 2 detection (isolated from tracker state)
+            model_nudenet: NudeDetector instance for Layer 4 (optional)
+            names: YOLO class names
+            nn_tmp_path: Temp JPEG path handed to NudeNet
+        """
+        self.model = model
+        self.model_detect = model_detect
+        self.model_nudenet = model_nudenet
+        self.names = names or NAMES
+        self.nn_tmp_path = nn_tmp_path
+
+    @property
+    def has_tracking(self) -> bool:
+        return self.model is not None
+
+    @property
+    def has_nudenet(self) -> bool:
+        return self.model_nudenet is not None
+
+    def _class_name(self, cls_idx) -> str:
+        return self.names[cls_idx] if cls_idx < len(self.names) else ""
+
+    def track(self, frame_rgb, conf=YOLO_CONF) -> List[Tuple[Box, float, Optional[int]]]:
+        """Layer 1: ByteTrack tracking. Returns [(shrunk_box, score, track_id)]."""
+        if self.model is None:
+            return []
+        results = self.model.track(frame_rgb, persist=True, conf=conf, iou=YOLO_IOU,
+                                   tracker="bytetrack.yaml", verbose=False)
+        parsed = _parse_yolo(results)
+        out = []
+        if parsed is None:
+            return out
+        for box, cls_idx, score, track_id in zip(*parsed):
+            cls_name = self._class_name(cls_idx)
+            if cls_name in SKIP_CLASSES: continue
+            sbox = shrink_box(*box, cls_name)
+            if sbox:
+                out.append((sbox, float(score), None if track_id is None else int(track_id)))
+        return out
+
+    def detect(self, frame_rgb, conf=YOLO_CONF, imgsz=None) -> List[Tuple[Box, float]]:
+        """Layer 2: standalone detection. Returns [(shrunk_box, score)]."""
+        if self.model_detect is None:
+            return []
+        kwargs = {'imgsz': imgsz} if imgsz else {}
+        results = self.model_detect(frame_rgb, conf=conf, iou=YOLO_IOU, verbose=False, **kwargs)
+        parsed = _parse_yolo(results)
+        out = []
+        if parsed is None:
+            return out
+        for box, cls_idx, score, _ in zip(*parsed):
+            cls_name = self._class_name(cls_idx)
+            if cls_name in SKIP_CLASSES: continue
+            sbox = shrink_box(*box, cls_name)
+            if sbox:
+                out.append((sbox, float(score)))
+        return out
+
+    def nudenet(self, frame_rgb) -> List[Tuple[Box, float]]:
+        """Layer 4: NudeNet cross-check. Returns [(shrunk_box, score)]."""
+        if self.model_nudenet is None:
+            return []
+        # Save to temp for NudeNet (some versions/backends prefer file paths)
+        with profiler.span('nudenet_io'):
+            cv2.imwrite(self.nn_tmp_path, cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
+        with profiler.span('nudenet_infer'):
+            nn_results = self.model_nudenet.detect(self.nn_tmp_path)
+        out = []
+        for det in nn_results:
+            label = det.get('class', '')
+            score = det.get('score', 0)
+            if label not in NUDENET_NSFW_LABELS: continue
+            if score < NUDENET_MIN_SCORE: continue
+            nn_box = det.get('box', [])
+            if len(nn_box) != 4: continue
+            x1, y1, x2, y2 = int(nn_box[0]), int(nn_box[1]), int(nn_box[2]), int(nn_box[3])
+            sbox = shrink_box(x1, y1, x2, y2)
+            if sbox:
+                out.append((sbox, float(score)))
+        return out
+
+    def reset_tracker(self):
+        """Drop ByteTrack state (Layer 3 history keeps covering lost boxes)."""
+        if self.model is not None:
+            try:
+                self.model.predictor = None
+            except Exception:
+                pass
+
+
+class HoldOverState:
+    """Layer 3 ヒストリーフォールバック + 追跡ロスト保持"""
+
+    def __init__(self, max_lost: int = MAX_LOST_FRAMES):
+        self.max_lost = max_lost
+        # {track_id: {'box': (x1, y1, x2, y2), 'lost_count': 0}}
+        self.track_history: Dict[int, Dict] = {}
+        self.last_known_boxes: List[Box] = []
+        self.no_detection_count = 0
+
+    def observe_tracks(self, tracks):
+        """Register Layer 1 results [(box, score, track_id)]. Returns current track ids."""
+        current_ids = set()
+        for sbox, _, track_id in tracks:
+            if track_id is not None:
+                self.track_history[track_id] = {'box': sbox, 'lost_count': 0}
+                current_ids.add(track_id)
+        return current_ids
+
+    def update(self, merged_boxes, current_ids) -> List[Box]:
+        """
+        Advance one frame and return the extra boxes that must be covered.
+
+        Args:
+            merged_boxes: Boxes detected on this frame (all layers merged)
+            current_ids: Track ids seen on this frame
+        """
+        extra = []
+        if len(merged_boxes) > 0:
+            self.last_known_boxes = merged_boxes
+            self.no_detection_count = 0
+        else:
+            self.no_detection_count += 1
+
+        # Layer 3: last known positions while nothing is detected
+        if len(merged_boxes) == 0 and self.last_known_boxes and self.no_detection_count <= self.max_lost:
+            extra.extend(self.last_known_boxes)
+
+        # Tracked-ID-based lost tracks
+        for track_id, data in self.track_history.items():
+            if track_id not in current_ids:
+                data['lost_count'] += 1
+                if data['lost_count'] <= self.max_lost:
+                    extra.append(data['box'])
+
+        # Clean up old tracks
+        self.track_history = {k: v for k, v in self.track_history.items() if v['lost_count'] <= self.max_lost}
+        return extra
+
+
+class IouTracker:
+    """IoU 対応付けによる簡易トラッキング (ByteTrack を使えない並列モード用)"""
+
+    def __init__(self, iou_threshold: float = 0.3):
+        self.iou_threshold = iou_threshold
+        self.tracks: Dict[int, Box] = {}
+        self._next_id = 1
+
+    def update(self, boxes) -> List[Tuple[Box, float, Optional[int]]]:
+        """Assign ids to this frame's boxes. Returns [(box, score, track_id)] like Layer 1."""
+        out = []
+        unmatched = dict(self.tracks)
+        for b in boxes:
+            box = tuple(b[:4])
+            best_id, best_iou = None, self.iou_threshold
+            for track_id, prev in unmatched.items():
+                iou = box_iou(box, prev)
+                if iou >= best_iou:
+                    best_id, best_iou = track_id, iou
+            if best_id is None:
+                best_id = self._next_id
+                self._next_id += 1
+            else:
+                del unmatched[best_id]
+            out.append((box, 1.0, best_id))
+        self.tracks = {track_id: box for box, _, track_id in out}
+        return out
+
+
+def load_detector(yolo_model_path: str, temp_dir: str, tracking: bool = True,
+                  nudenet: bool = True, nn_tmp_name: str = '_nn_tmp.jpg') -> MultiLayerDetector:
+    """
+    Load YOLO (Layer 1/2) and NudeNet (Layer 4) models.
+
+    Raises whatever ultralytics raises when the YOLO weights cannot be loaded;
+    NudeNet failures only disable Layer 4.
+    """
+    from ultralytics import YOLO
+    model = YOLO(yolo_model_path) if tracking else None   # For Layer 1: Tracking
+    model_detect = YOLO(yolo_model_path)                   # For Layer 2: Standalone detection (isolated)
+
+    # Layer 4: NudeNet (optional, graceful skip if unavailable)
+    model_nudenet = None
+    if nudenet and NudeDetector is not None:
+        try:
+            model_nudenet = NudeDetector()
+            apply_ort_options(model_nudenet)
+            print("[INFO] NudeNet Layer 4 loaded successfully.")
+        except Exception as e:
+            print(f"[WARNING] NudeNet initialization failed (Layer 4 disabled): {e}")
+
+    return MultiLayerDetector(model, model_detect, model_nudenet, NAMES,
+                              nn_tmp_path=os.path.join(temp_dir, nn_tmp_name))
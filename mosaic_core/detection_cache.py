@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Per-Video Detection Cache
+Stores the boxes covered on every frame (with the layer that produced them)
+so proxy previews and pattern-only re-renders can skip detection.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mosaic_core.detection import LAYER_CODES, LAYER_NAMES
+from mosaic_core.hashing import path_key
+
+CACHE_VERSION = 1
+
+
+class VideoDetectionCache:
+    """動画フレーム単位の検出結果キャッシュ"""
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.meta = dict(meta)
+        self._offsets = [0]
+        self._boxes: List[Tuple[int, int, int, int]] = []
+        self._layers: List[int] = []
+        self._loaded: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    # --- Recording ---
+    def add_frame(self, boxes):
+        """Append one frame worth of (x1, y1, x2, y2, layer) boxes."""
+        for b in boxes:
+            self._boxes.append((int(b[0]), int(b[1]), int(b[2]), int(b[3])))
+            self._layers.append(LAYER_CODES[b[4]])
+        self._offsets.append(len(self._boxes))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = dict(self.meta, version=CACHE_VERSION, frames=len(self._offsets) - 1)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            offsets=np.asarray(self._offsets, dtype=np.int64),
+            boxes=np.asarray(self._boxes, dtype=np.int32).reshape(-1, 4),
+            layers=np.asarray(self._layers, dtype=np.uint8),
+            meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+
+    # --- Replay ---
+    @classmethod
+    def load(cls, path: str) -> 'VideoDetectionCache':
+        with np.load(path) as data:
+            meta = json.loads(bytes(data['meta']).decode('utf-8'))
+            cache = cls(meta)
+            cache._loaded = (data['offsets'], data['boxes'], data['layers'])
+        return cache
+
+    @property
+    def frame_count(self) -> int:
+        if self._loaded is not None:
+            return len(self._loaded[0]) - 1
+        return len(self._offsets) - 1
+
+    def frame_boxes(self, frame_idx: int) -> List[Tuple[int, int, int, int, str]]:
+        """Boxes of a frame as (x1, y1, x2, y2, layer). Frames past the end have none."""
+        offsets, boxes, layers = self._loaded
+        if frame_idx + 1 >= len(offsets):
+            return []
+        s, e = offsets[frame_idx], offsets[frame_idx + 1]
+        return [(int(b[0]), int(b[1]), int(b[2]), int(b[3]), LAYER_NAMES[int(l)])
+                for b, l in zip(boxes[s:e], layers[s:e])]
+
+
+def cache_path(cache_dir: str, video_path: str) -> str:
+    return os.path.join(cache_dir, f"{path_key(video_path)}_{os.path.basename(video_path)}.npz")
+
+
+def cache_meta(video_path: str, model_hash: str, detect_mode: str = 'full') -> Dict[str, Any]:
+    """Metadata that must match for a cache to be reused."""
+    st = os.stat(video_path)
+    return {
+        'source': os.path.abspath(video_path),
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'model_hash': model_hash,
+        'detect_mode': detect_mode,
+    }
+
+
+def load_cache(cache_dir: str, video_path: str, model_hash: str,
+               detect_mode: Optional[str] = None) -> Optional[VideoDetectionCache]:
+    """
+    Load the detection cache of a video if it is still valid
+    (same file size/mtime, same model, and same detect_mode when given).
+    """
+    path = cache_path(cache_dir, video_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        cache = VideoDetectionCache.load(path)
+    except Exception as e:
+        print(f"[WARNING] Failed to read detection cache {path}: {e}")
+        return None
+    expected = cache_meta(video_path, model_hash, detect_mode or cache.meta.get('detect_mode'))
+    for k, v in expected.items():
+        if k == 'mtime':
+            if abs(cache.meta.get(k, 0) - v) > 1e-3:
+                return None
+        elif cache.meta.get(k) != v:
+            return None
+    if cache.meta.get('version') != CACHE_VERSION:
+        return None
+    return cache
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Background Encode Queue
+Runs the post-render ffmpeg steps (audio mux, H.264 transcode) of finished
+videos in background threads, so in folder mode the next video's detection
+starts while the previous one is still being encoded. ffmpeg runs as a
+subprocess, so threads are enough to overlap the two.
+"""
+
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+ENCODE_WORKERS = 1  # One background encode at a time; x264 is already multi-threaded
+
+
+class EncodeQueue:
+    """レンダリング済み動画のエンコード待ち行列 (バックグラウンド実行)"""
+
+    def __init__(self, workers: int = ENCODE_WORKERS):
+        """
+        Args:
+            workers: Background encode threads (0 = run every job inline in submit())
+        """
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encode') if workers > 0 else None
+        self._jobs: List[Tuple[str, Future]] = []
+        self.durations: Dict[str, float] = {}  # label -> run time of the job (s), excluding the wait
+
+    def _timed(self, label: str, fn: Callable[..., Any], args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.durations[label] = time.perf_counter() - start
+
+    def submit(self, label: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs). Exceptions are kept on the future and reported by drain()."""
+        if self._executor is not None:
+            future = self._executor.submit(self._timed, label, fn, args, kwargs)
+        else:
+            future = Future()
+            try:
+                future.set_result(self._timed(label, fn, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self._jobs.append((label, future))
+        if self._executor is not None:
+            print(f"[INFO] Encode queued: {label} ({self.pending} pending)")
+        return future
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for _, f in self._jobs if not f.done())
+
+    def drain(self) -> List[Tuple[str, Any, Any]]:
+        """
+        Wait for every queued job.
+
+        Returns:
+            [(label, result, exception)] in submission order (one of the two is None)
+        """
+        if self.pending:
+            print(f"[INFO] Waiting for {self.pending} background encode(s)...")
+        results = []
+        for label, future in self._jobs:
+            error = future.exception()
+            if error is not None:
+                print(f"[ERROR] Encode failed: {label}: {error}")
+            results.append((label, None if error is not None else future.result(), error))
+        self._jobs = []
+        return results
+
+    def close(self):
+        self.drain()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - ffmpeg Pipe Writer
+cv2.VideoWriter-compatible writer that pipes raw BGR frames into an ffmpeg
+process, so frames are encoded (and audio muxed) in a single pass.
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import ffmpeg
+
+# Proxy preview defaults: small, fast, low bitrate
+PROXY_HEIGHT = 360
+PROXY_PRESET = 'ultrafast'
+PROXY_CRF = 32
+PROXY_AUDIO_BITRATE = '96k'
+
+# Codecs that can be stream-copied into the final output as is
+COPYABLE_VIDEO_CODECS = ('h264',)
+
+# Progressive output: playable while it is still being written
+PROGRESSIVE_FMP4 = 'fmp4'
+PROGRESSIVE_HLS = 'hls'
+PROGRESSIVE_FORMATS = (PROGRESSIVE_FMP4, PROGRESSIVE_HLS)
+FRAGMENT_SECONDS = 2.0
+HLS_PLAYLIST = 'index.m3u8'
+
+
+def probe_media(path: str) -> Dict[str, Any]:
+    """
+    One ffprobe call: duration (seconds), first video codec and whether there is audio.
+
+    Raises:
+        ffmpeg.Error: if ffprobe fails
+    """
+    probe = ffmpeg.probe(path)
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    duration = probe.get('format', {}).get('duration') or (video or {}).get('duration') or 0.0
+    return {
+        'duration': float(duration),
+        'video_codec': video.get('codec_name') if video else None,
+        'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+    }
+
+
+def video_output_args(info: Dict[str, Any], crf: int = 23) -> Dict[str, Any]:
+    """Stream-copy an already H.264 video; re-encode anything else with libx264."""
+    if info.get('video_codec') in COPYABLE_VIDEO_CODECS:
+        return {'vcodec': 'copy'}
+    return {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', 'crf': crf}
+
+
+class FfmpegPipeWriter:
+    """ffmpeg パイプ書き込み (cv2.VideoWriter 互換)"""
+
+    def __init__(self, output_path: str, width: int, height: int, fps: float,
+                 audio_source: Optional[str] = None, vcodec: str = 'libx264',
+                 preset: str = 'veryfast', crf: int = 23, audio_bitrate: str = '192k',
+                 extra_output_args: Optional[Dict[str, Any]] = None,
+                 extra_input_args: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            output_path: Destination file (container picked from the extension)
+            width, height: Size of the frames passed to write()
+            fps: Output frame rate
+            audio_source: Optional file whose audio stream (if any) is muxed in
+            extra_output_args: Additional ffmpeg output options (e.g. movflags)
+            extra_input_args: Additional options for the raw frame input
+        """
+        self.output_path = output_path
+        self.frame_bytes = width * height * 3
+        video_in = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24',
+                                s=f'{width}x{height}', framerate=fps, **(extra_input_args or {}))
+        streams = [video_in]
+        kwargs = dict(vcodec=vcodec, preset=preset, crf=crf, pix_fmt='yuv420p')
+        if audio_source:
+            streams.append(ffmpeg.input(audio_source)['a?'])
+            kwargs.update(acodec='aac', audio_bitrate=audio_bitrate, shortest=None)
+        kwargs.update(extra_output_args or {})
+        self._proc = (
+            ffmpeg
+            .output(*streams, output_path, **kwargs)
+            .global_args('-loglevel', 'error', '-nostats')
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+        )
+
+    def isOpened(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def write(self, frame):
+        if frame.nbytes != self.frame_bytes:
+            raise ValueError(f"Frame size mismatch: {frame.nbytes} != {self.frame_bytes} bytes")
+        self._proc.stdin.write(memoryview(frame).cast('B') if frame.flags['C_CONTIGUOUS'] else frame.tobytes())
+
+    def release(self) -> bool:
+        """Close the pipe and wait for ffmpeg. Returns True on success."""
+        if self._proc is None:
+            return False
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        code = self._proc.wait()
+        self._proc = None
+        if code != 0:
+            print(f"[WARNING] ffmpeg exited with code {code}: {self.output_path}")
+        return code == 0
+
+
+def progressive_output_path(kind: str, output_dir: str, name: str) -> str:
+    """Output of open_progressive_writer: <name>.mp4, or <name>/index.m3u8 for HLS."""
+    if kind == PROGRESSIVE_HLS:
+        return os.path.join(output_dir, name, HLS_PLAYLIST)
+    return os.path.join(output_dir, name + ".mp4")
+
+
+def open_progressive_writer(output_path: str, kind: str, width: int, height: int, fps: float,
+                            audio_source: Optional[str] = None,
+                            fragment_seconds: float = FRAGMENT_SECONDS) -> FfmpegPipeWriter:
+    """
+    H.264 writer whose output can be played (and uploaded) while frames are still coming.
+
+    Keyframes are forced every fragment_seconds and each fragment is closed on
+    its keyframe: 'fmp4' writes a fragmented MP4 (empty moov + moof/mdat per
+    fragment), 'hls' writes MPEG-TS segments next to an event playlist that grows
+    as segments complete. The source audio (if any) is muxed into every fragment.
+    """
+    # flush_packets: write each fragment out at once instead of when the I/O buffer fills
+    extra = {'force_key_frames': f'expr:gte(t,n_forced*{fragment_seconds:g})', 'flush_packets': 1}
+    if kind == PROGRESSIVE_HLS:
+        segment_dir = os.path.dirname(output_path)
+        os.makedirs(segment_dir, exist_ok=True)
+        extra.update({'format': 'hls', 'hls_time': f'{fragment_seconds:g}', 'hls_list_size': 0,
+                      'hls_playlist_type': 'event',
+                      'hls_segment_filename': os.path.join(segment_dir, 'segment_%05d.ts')})
+    elif kind == PROGRESSIVE_FMP4:
+        extra.update({'movflags': 'frag_keyframe+empty_moov+default_base_moof',
+                      'frag_duration': int(fragment_seconds * 1_000_000)})
+    else:
+        raise ValueError(f"Unknown progressive format: {kind}")
+    return FfmpegPipeWriter(output_path, width, height, fps, audio_source=audio_source,
+                            extra_output_args=extra)
+
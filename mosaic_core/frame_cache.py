@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Cross-Video Frame Fingerprint Cache
+Persistent content-addressed cache of merged detection boxes, keyed by a
+perceptual hash of the downscaled frame. Shared intros/outros and clips
+rendered from the same seed/template skip Layer 1/2/4 on repeated frames.
+"""
+
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from mosaic_core.detection import LAYER_CODES, LAYER_NAMES
+
+FRAME_CACHE_MAX_ENTRIES = 200_000
+HASH_GRID = 16           # Gradient hash grid (HASH_GRID x HASH_GRID bits)
+THUMB_SIZE = 32          # Grey thumbnail stored to verify hash hits (1 KB per entry)
+THUMB_MAX_DIFF = 8       # Max per-pixel difference (0-255) accepted on a hit
+_FLUSH_INTERVAL = 500    # Pending writes before a commit
+
+
+def frame_fingerprint(frame, bgr: bool = False) -> Tuple[str, np.ndarray]:
+    """
+    Perceptual fingerprint of an RGB (or BGR with bgr=True) frame.
+
+    Returns:
+        (key, thumb) — key is 64-bit DCT pHash + 256-bit gradient hash as hex,
+        thumb is the 32x32 grey thumbnail used to verify hits. The hash alone
+        tolerates small motion, so hits are only accepted when every thumbnail
+        pixel matches within THUMB_MAX_DIFF (re-encoding noise, not movement).
+    """
+    if frame.ndim == 3:
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+    else:
+        grey = frame
+    thumb = cv2.resize(grey, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(thumb.astype(np.float32))[:8, :8].flatten()
+    phash = dct[1:] > np.median(dct[1:])
+    grad = cv2.resize(thumb, (HASH_GRID + 1, HASH_GRID), interpolation=cv2.INTER_AREA)
+    dhash = (grad[:, 1:] > grad[:, :-1]).flatten()
+    bits = np.concatenate([[False], phash, dhash])
+    return np.packbits(bits).tobytes().hex(), thumb
+
+
+class FrameFingerprintCache:
+    """フレーム指紋キャッシュ (SQLite, LRU)"""
+
+    def __init__(self, db_path: str, model_hash: str, max_entries: int = FRAME_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            db_path: SQLite file (created if missing)
+            model_hash: Current detection model fingerprint; a mismatch clears the cache
+            max_entries: LRU bound on the number of stored frames
+        """
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self._pending = 0
+        self._touched = {}
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "fp TEXT PRIMARY KEY, thumb BLOB NOT NULL, boxes BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS frames_last_used ON frames (last_used)")
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key='model_hash'").fetchone()
+        if row is None or row[0] != model_hash:
+            if row is not None:
+                print("[INFO] Frame cache: model changed, clearing cached detections.")
+            self._conn.execute("DELETE FROM frames")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model_hash', ?)", (model_hash,))
+        self._conn.commit()
+
+    def get(self, key: str, thumb: np.ndarray, width: int, height: int) -> Optional[List[Tuple[int, int, int, int, str]]]:
+        """Return the cached boxes (pixel coords) for a fingerprint, or None on a miss."""
+        self.lookups += 1
+        row = self._conn.execute("SELECT thumb, boxes FROM frames WHERE fp=?", (key,)).fetchone()
+        if row is None:
+            return None
+        cached_thumb = np.frombuffer(row[0], dtype=np.uint8).reshape(thumb.shape)
+        if cv2.absdiff(cached_thumb, thumb).max() > THUMB_MAX_DIFF:
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        self._bump()
+        arr = np.frombuffer(row[1], dtype=np.float32).reshape(-1, 5)
+        return [(int(round(b[0] * width)), int(round(b[1] * height)),
+                 int(round(b[2] * width)), int(round(b[3] * height)), LAYER_NAMES[int(b[4])])
+                for b in arr]
+
+    def put(self, key: str, thumb: np.ndarray, boxes, width: int, height: int):
+        """Store merged (x1, y1, x2, y2, layer) boxes in normalised coordinates."""
+        arr = np.asarray([(b[0] / width, b[1] / height, b[2] / width, b[3] / height, LAYER_CODES[b[4]])
+                          for b in boxes], dtype=np.float32).reshape(-1, 5)
+        self._conn.execute("INSERT OR REPLACE INTO frames (fp, thumb, boxes, last_used) VALUES (?, ?, ?, ?)",
+                           (key, thumb.tobytes(), arr.tobytes(), time.time()))
+        self.stores += 1
+        self._bump()
+
+    def _bump(self):
+        self._pending += 1
+        if self._pending >= _FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write LRU timestamps, evict beyond max_entries and commit."""
+        if self._touched:
+            self._conn.executemany("UPDATE frames SET last_used=? WHERE fp=?",
+                                   [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        count = self._conn.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM frames WHERE fp IN (SELECT fp FROM frames ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+        self._conn.commit()
+        self._pending = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def report(self) -> str:
+        return (f"Frame cache: {self.hits}/{self.lookups} hits ({self.hit_rate * 100:.1f}%), "
+                f"{self.stores} stored")
+
+    def close(self):
+        self.flush()
+        self._conn.close()
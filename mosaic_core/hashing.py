@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Hashing Helpers
+File / model fingerprints used to key caches and invalidate them on change.
+"""
+
+import hashlib
+import os
+from typing import Dict, Tuple
+
+_CHUNK = 1 << 20
+_model_hash_memo: Dict[Tuple[str, int, float], str] = {}
+
+
+def file_sha1(path: str) -> str:
+    """SHA-1 of the whole file."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_hash(*paths: str) -> str:
+    """
+    Combined fingerprint of one or more model files (missing files hash as their name).
+    Results are memoized per (path, size, mtime) so repeated calls are O(stat).
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            key = (os.path.abspath(path), st.st_size, st.st_mtime)
+            digest = _model_hash_memo.get(key)
+            if digest is None:
+                digest = file_sha1(path)
+                _model_hash_memo[key] = digest
+            h.update(digest.encode('ascii'))
+        else:
+            h.update(f"missing:{os.path.basename(str(path))}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def path_key(path: str) -> str:
+    """Short stable key for a file path (cache file names)."""
+    return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+
+
+def file_quick_hash(path: str, chunk: int = _CHUNK) -> str:
+    """
+    Content fingerprint of a (large) file from its size and three sampled chunks
+    (start / middle / end). Small files are hashed whole.
+    """
+    size = os.path.getsize(path)
+    if size <= 3 * chunk:
+        return file_sha1(path)
+    h = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        for offset in (0, (size - chunk) // 2, size - chunk):
+            f.seek(offset)
+            h.update(f.read(chunk))
+    return h.hexdigest()
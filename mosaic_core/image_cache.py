@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Image Detection Cache
+Persistent per-image detections for mosaic-image.py (SQLite), keyed by the
+file's content hash and the detection model. The raw detections are stored
+(before the class filter and shrink), so a later run with another pattern,
+shrink ratio or class filter only decodes and composites. A path index
+(size / mtime -> content hash) keeps lookups of unchanged files O(stat).
+"""
+
+import os
+import sqlite3
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from mosaic_core.hashing import file_sha1
+from mosaic_core.images import Detection
+
+_FLUSH_INTERVAL = 500    # Pending writes before a commit
+_CONTENT_HASH = 'sha1'   # How `content` keys are computed; a change drops the path index
+
+
+class ImageDetectionCache:
+    """画像毎の検出結果キャッシュ (SQLite)"""
+
+    def __init__(self, db_path: str, detect_hash: str, names: Sequence[str]):
+        """
+        Args:
+            db_path: SQLite file (created if missing)
+            detect_hash: Fingerprint of the model and detection settings; a mismatch clears the cache
+            names: Class names (stored as indices)
+        """
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.names = list(names)
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self._pending = 0
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "content TEXT NOT NULL, variant TEXT NOT NULL, frames INTEGER NOT NULL, boxes BLOB NOT NULL, "
+            "PRIMARY KEY (content, variant))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS paths ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, content TEXT NOT NULL)")
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key='detect_hash'").fetchone()
+        if row is None or row[0] != detect_hash:
+            if row is not None:
+                print("[INFO] Image detection cache: model changed, clearing cached detections.")
+            self._conn.execute("DELETE FROM detections")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('detect_hash', ?)", (detect_hash,))
+        row = self._conn.execute("SELECT value FROM meta WHERE key='content_hash'").fetchone()
+        if row is None or row[0] != _CONTENT_HASH:
+            # Keys of older sampled hashes could collide: hash every file again
+            self._conn.execute("DELETE FROM paths")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('content_hash', ?)",
+                               (_CONTENT_HASH,))
+        self._conn.commit()
+
+    def content_key(self, path: str) -> str:
+        """SHA-1 of the whole file, re-read only when its size / mtime changed."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._conn.execute("SELECT size, mtime, content FROM paths WHERE path=?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and abs(row[1] - st.st_mtime) <= 1e-3:
+            return row[2]
+        content = file_sha1(path)
+        self._conn.execute("INSERT OR REPLACE INTO paths (path, size, mtime, content) VALUES (?, ?, ?, ?)",
+                           (path, st.st_size, st.st_mtime, content))
+        self._bump()
+        return content
+
+    def get(self, content: str, variant: str = 'image') -> Optional[List[List[Detection]]]:
+        """
+        Cached detections per frame (a single image has one frame), or None on a miss.
+
+        Args:
+            variant: How the image was detected ('image', 'tiled:<size>', 'animation')
+        """
+        self.lookups += 1
+        row = self._conn.execute("SELECT frames, boxes FROM detections WHERE content=? AND variant=?",
+                                 (content, variant)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        out: List[List[Detection]] = [[] for _ in range(row[0])]
+        for frame, x1, y1, x2, y2, cls_idx, conf in np.frombuffer(row[1], dtype=np.float32).reshape(-1, 7):
+            cls_name = self.names[int(cls_idx)] if 0 <= cls_idx < len(self.names) else ""
+            out[int(frame)].append(((int(x1), int(y1), int(x2), int(y2)), cls_name, float(conf)))
+        return out
+
+    def put(self, content: str, detections: Sequence[List[Detection]], variant: str = 'image'):
+        """Store the raw detections of every frame (float32 rows: frame, box, class index, confidence)."""
+        index = {name: i for i, name in enumerate(self.names)}
+        arr = np.asarray([(frame, *box, index.get(cls_name, -1), conf)
+                          for frame, dets in enumerate(detections) for box, cls_name, conf in dets],
+                         dtype=np.float32).reshape(-1, 7)
+        self._conn.execute("INSERT OR REPLACE INTO detections (content, variant, frames, boxes) VALUES (?, ?, ?, ?)",
+                           (content, variant, len(detections), arr.tobytes()))
+        self.stores += 1
+        self._bump()
+
+    def _bump(self):
+        self._pending += 1
+        if self._pending >= _FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def report(self) -> str:
+        return f"Image detection cache: {self.hits}/{self.lookups} hits, {self.stores} stored"
+
+    def close(self):
+        self.flush()
+        self._conn.close()
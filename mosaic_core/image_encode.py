@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Image Output Encoding
+Format-aware writers for mosaic-image.py outputs. EXIF and ICC profiles of
+the source are carried over (so orientation and colour stay as in the
+original). JPEG sources are re-encoded with their own quantisation tables
+and chroma subsampling by default: the untouched blocks come back almost
+bit-exact instead of losing another generation at a fixed quality. PNG goes
+through OpenCV's encoder at a fast zlib level, with the metadata chunks
+spliced in; lossless WebP is optional.
+"""
+
+import os
+import struct
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Union
+
+import cv2
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+JPEG_KEEP = 'keep'               # Reuse the source's quantisation tables
+IMAGE_JPEG_QUALITY = JPEG_KEEP
+IMAGE_FALLBACK_QUALITY = 90      # JPEG / lossy WebP quality when the source has no tables
+IMAGE_PNG_LEVEL = 1              # zlib level 0-9 (PIL saves at 6: ~2x slower, a few % smaller)
+_MAX_SEGMENT = 65533             # JPEG marker segment payload limit
+
+
+@dataclass
+class EncodeOptions:
+    """出力画像のエンコード設定"""
+    jpeg_quality: Union[int, str] = IMAGE_JPEG_QUALITY  # 1-100 or 'keep'
+    png_level: int = IMAGE_PNG_LEVEL
+    webp_lossless: bool = False   # Save still images as lossless WebP (.webp)
+
+    def settings(self) -> Dict[str, Any]:
+        """As recorded in the processed manifest (a change re-renders)."""
+        return asdict(self)
+
+
+def parse_jpeg_quality(value: str) -> Union[int, str]:
+    """argparse type for --jpeg-quality: 'keep' or 1-100."""
+    if value == JPEG_KEEP:
+        return value
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise ValueError(f"JPEG quality must be 1-100 or '{JPEG_KEEP}'")
+    return quality
+
+
+def output_name(fname: str, options: EncodeOptions) -> str:
+    """
+    Output file name for an input. Only --webp-lossless changes it: a.jpg -> a.jpg.webp
+    (the source extension stays, so a.jpg and a.png don't collide). GIFs stay GIFs.
+    """
+    ext = os.path.splitext(fname)[1].lower()
+    if options.webp_lossless and ext not in (".gif", ".webp"):
+        return fname + ".webp"
+    return fname
+
+
+def load_image(path: str) -> Image.Image:
+    """Decode an image as RGB, keeping the JPEG tables and metadata needed by encode_image()."""
+    src = Image.open(path)
+    tables = None
+    if src.format == "JPEG" and src.mode == "RGB":
+        tables = (src.quantization, JpegImagePlugin.get_sampling(src))
+    img = src.convert("RGB")  # convert() keeps .info (exif, icc_profile)
+    if tables is not None:
+        img.info['jpeg_tables'] = tables
+    return img
+
+
+def _jpeg_tables(img: Image.Image):
+    # Only colour (YCbCr) JPEG tables fit an RGB encode; greyscale / CMYK sources fall back to a quality
+    if getattr(img, 'format', None) == "JPEG" and img.mode == "RGB":
+        return img.quantization, JpegImagePlugin.get_sampling(img)
+    return img.info.get('jpeg_tables')
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def _png_with_metadata(data: bytes, exif: bytes, icc: bytes) -> bytes:
+    # Ancillary chunks go right after IHDR (8-byte signature + 25-byte IHDR chunk)
+    chunks = b""
+    if icc:
+        chunks += _png_chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc))
+    if exif:
+        chunks += _png_chunk(b"eXIf", exif[6:] if exif.startswith(b"Exif\0\0") else exif)
+    return data[:33] + chunks + data[33:]
+
+
+def encode_image(img: Image.Image, path: str, options: EncodeOptions):
+    """Write an RGB image to `path` in the format of its extension, with the source's EXIF / ICC."""
+    ext = os.path.splitext(path)[1].lower()
+    exif = img.info.get('exif') or b""
+    icc = img.info.get('icc_profile') or b""
+    if ext in (".jpg", ".jpeg"):
+        # PIL's libjpeg-turbo encoder reads the image in place (no BGR copy as for cv2.imencode)
+        params: Dict[str, Any] = {}
+        tables = _jpeg_tables(img)
+        if options.jpeg_quality == JPEG_KEEP and tables is not None:
+            params.update(qtables=tables[0], subsampling=tables[1])
+        else:
+            quality = options.jpeg_quality
+            params['quality'] = quality if quality != JPEG_KEEP else IMAGE_FALLBACK_QUALITY
+        if exif and len(exif) <= _MAX_SEGMENT:
+            params['exif'] = exif
+        if icc:
+            params['icc_profile'] = icc
+        img.save(path, "JPEG", **params)
+    elif ext == ".png":
+        bgr = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+        ok, data = cv2.imencode(".png", bgr, [cv2.IMWRITE_PNG_COMPRESSION, options.png_level])
+        if not ok:
+            raise ValueError(f"Failed to encode {path}")
+        with open(path, 'wb') as f:
+            f.write(_png_with_metadata(data.tobytes(), exif, icc))
+    elif ext == ".webp":
+        params = {'lossless': True} if options.webp_lossless else {
+            'quality': options.jpeg_quality if options.jpeg_quality != JPEG_KEEP else IMAGE_FALLBACK_QUALITY}
+        if exif:
+            params['exif'] = exif
+        if icc:
+            params['icc_profile'] = icc
+        img.save(path, "WEBP", **params)
+    else:
+        img.save(path)
+
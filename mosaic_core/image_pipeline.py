@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Image Decode / Encode Pipeline
+Producer/consumer pipeline around the still-image loop: decoder threads read
+images ahead of the detector and encoder threads save the results, while the
+caller (the Tk thread) only detects and composites. Everything in flight is
+bounded by a memory budget in bytes rather than an item count, so a folder of
+huge PNGs can't fill RAM. PIL releases the GIL while decoding / encoding, so
+threads are enough to overlap the I/O with inference.
+"""
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from mosaic_core.buffers import ByteBudget
+
+IMAGE_DECODE_WORKERS = 2
+IMAGE_ENCODE_WORKERS = 2
+IMAGE_MEMORY_BUDGET = 512 * 1024 * 1024  # Decoded images held at once (read ahead + waiting to be saved)
+_POLL = 0.05  # Seconds between on_idle() calls while waiting
+
+
+class ImagePipeline:
+    """画像の先読みデコード / 書き出しワーカー (メモリ予算付き)"""
+
+    def __init__(self, decode: Callable[[Any], Any], encode: Callable[[Any, Any], Any],
+                 cost: Callable[[Any], int], decode_workers: int = IMAGE_DECODE_WORKERS,
+                 encode_workers: int = IMAGE_ENCODE_WORKERS, budget_bytes: int = IMAGE_MEMORY_BUDGET):
+        """
+        Args:
+            decode: item -> decoded image (runs on a decoder thread)
+            encode: (item, image) -> None, saves the result (runs on an encoder thread)
+            cost: item -> bytes its decoded image holds (e.g. from the file header)
+            budget_bytes: Bytes of decoded images allowed in flight
+        """
+        self.decode = decode
+        self.encode = encode
+        self.cost = cost
+        self.budget = ByteBudget(budget_bytes)
+        self._decoders = ThreadPoolExecutor(max(1, decode_workers), thread_name_prefix='img-decode')
+        self._encoders = ThreadPoolExecutor(max(1, encode_workers), thread_name_prefix='img-encode')
+        self._writes: List[Future] = []
+        self._stop = threading.Event()
+        self._feeder: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.errors: List[Tuple[Any, BaseException]] = []  # Failed saves
+
+    def split_batches(self, batches: Sequence[Sequence[Any]]) -> List[List[Any]]:
+        """Split batches holding more than half the budget, so one batch never waits on its own memory."""
+        out = []
+        for batch in batches:
+            current, held = [], 0
+            for item in batch:
+                n = self.cost(item)
+                if current and held + n > self.budget.limit // 2:
+                    out.append(current)
+                    current, held = [], 0
+                current.append(item)
+                held += n
+            if current:
+                out.append(current)
+        return out
+
+    def _feed(self, batches: List[List[Any]], ready: 'queue.Queue'):
+        for batch in batches:
+            for item in batch:
+                n = self.cost(item)
+                while True:
+                    if self._stop.is_set():
+                        return
+                    try:
+                        self.budget.acquire(n, timeout=_POLL)
+                        break
+                    except TimeoutError:
+                        continue
+                ready.put((item, n, self._decoders.submit(self.decode, item)))
+
+    def _wait(self, fn, on_idle):
+        while True:
+            try:
+                return fn(_POLL)
+            except (queue.Empty, TimeoutError):
+                if on_idle is not None:
+                    on_idle()
+
+    def decoded(self, batches: Sequence[Sequence[Any]],
+                on_idle: Optional[Callable[[], None]] = None) -> Iterator[List[Tuple[Any, Any, Optional[BaseException]]]]:
+        """
+        Decode ahead and yield each batch as [(item, image, error)] (image is None on error).
+
+        Decoding runs ahead of the consumer as far as the budget allows; each image's
+        bytes stay reserved until write() has saved it (or it failed to decode).
+        on_idle() is called every few ms while waiting (e.g. to keep a Tk window responsive).
+        """
+        batches = self.split_batches(batches)
+        ready: 'queue.Queue' = queue.Queue()
+        self._feeder = threading.Thread(target=self._feed, args=(batches, ready), daemon=True)
+        self._feeder.start()
+        for batch in batches:
+            out = []
+            for _ in batch:
+                item, n, future = self._wait(lambda t: ready.get(timeout=t), on_idle)
+                error = self._wait(lambda t: future.exception(timeout=t), on_idle)
+                if error is not None:
+                    self.budget.release(n)
+                    out.append((item, None, error))
+                else:
+                    out.append((item, future.result(), None))
+            yield out
+
+    def write(self, item, image):
+        """Save a processed image in the background; its budget is released once saved."""
+        n = self.cost(item)
+
+        def done(f: Future):
+            self.budget.release(n)
+            with self._lock:
+                if f.exception() is not None:
+                    self.errors.append((item, f.exception()))
+                else:
+                    self.written += 1
+
+        future = self._encoders.submit(self.encode, item, image)
+        future.add_done_callback(done)
+        self._writes.append(future)
+
+    def discard(self, item):
+        """Release the budget of a decoded image that will not be written."""
+        self.budget.release(self.cost(item))
+
+    def close(self, on_idle: Optional[Callable[[], None]] = None):
+        """Wait for the pending saves, then stop the workers."""
+        for future in self._writes:
+            self._wait(lambda t: future.exception(timeout=t), on_idle)
+        self._writes = []
+        self._stop.set()
+        if self._feeder is not None:
+            self._feeder.join()
+        self._decoders.shutdown(wait=True)
+        self._encoders.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
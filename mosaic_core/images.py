@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Still Image Detection
+Batched, in-memory YOLO detection for mosaic-image.py. Decoded arrays are
+handed to the model directly (no temp JPEG round trip, no lossy re-encode of
+the detection input), several images per call. Ultralytics only letterboxes a batch to a compact
+shape when every array in it has the same shape (mixed batches are padded to
+the full square imgsz), so batches are filled with same-size images first.
+Folder helpers walk a tree of images and find byte-identical duplicates so
+each distinct image is rendered once.
+"""
+
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from mosaic_core.detection import NAMES
+from mosaic_core.hashing import file_sha1
+from mosaic_core.processed import PROCESSED_MANIFEST
+
+Box = Tuple[int, int, int, int]
+Detection = Tuple[Box, str, float]  # (box, class name, confidence)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+IMAGE_CONF = 0.15
+IMAGE_IOU = 0.3
+IMAGE_BATCH_SIZE = 8
+IMAGE_SKIP_CLASSES = {"make_love", "nipple"}
+IMAGE_SHRINK = (0.75, 0.45)  # Mosaic area shrunk by 75% of the width / 45% of the height
+IMAGE_MIN_BOX = 10
+
+
+def list_images(folder: str) -> List[str]:
+    """
+    Image files under `folder`, recursively, as sorted paths relative to it.
+    Folders holding a processed manifest are rendered outputs and are not entered.
+    """
+    out = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not os.path.exists(os.path.join(root, d, PROCESSED_MANIFEST)))
+        rel_root = os.path.relpath(root, folder)
+        for f in sorted(files):
+            if f.lower().endswith(IMAGE_EXTS):
+                out.append(os.path.normpath(os.path.join(rel_root, f)))
+    return out
+
+
+def group_duplicates(folder: str, files: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    Group byte-identical files. Only files sharing their size with another are hashed.
+
+    Returns:
+        {first file: [its duplicates]} for every file that has duplicates (in `files` order)
+    """
+    by_size: Dict[int, List[str]] = {}
+    for f in files:
+        try:
+            by_size.setdefault(os.path.getsize(os.path.join(folder, f)), []).append(f)
+        except OSError:
+            continue
+    groups: Dict[str, List[str]] = {}
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        first_by_hash: Dict[str, str] = {}
+        for f in same_size:
+            try:
+                digest = file_sha1(os.path.join(folder, f))
+            except OSError:
+                continue
+            first = first_by_hash.setdefault(digest, f)
+            if first != f:
+                groups.setdefault(first, []).append(f)
+    return groups
+
+
+def link_or_copy(src: str, dst: str):
+    """Hard-link src to dst (replacing dst), copying when the file system can't link."""
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    """(width, height) from the file header without decoding; None if unreadable."""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def plan_batches(sizes: Sequence[Optional[Tuple[int, int]]], batch_size: int = IMAGE_BATCH_SIZE) -> List[List[int]]:
+    """
+    Split image indices into batches of up to batch_size. Images of exactly
+    the same (width, height) fill batches first, since only a uniform batch
+    keeps the compact letterbox; the remainders are mixed by aspect ratio
+    (then area) and letterbox to the square imgsz. Unreadable images (size None)
+    get a batch of their own so their error is reported per file.
+    """
+    batch_size = max(1, batch_size)
+    by_shape: Dict[Tuple[int, int], List[int]] = {}
+    for i, s in enumerate(sizes):
+        if s is not None:
+            by_shape.setdefault(tuple(s), []).append(i)
+    batches = []
+    leftovers = []
+    for same_shape in by_shape.values():
+        full = len(same_shape) - len(same_shape) % batch_size
+        batches.extend(same_shape[k:k + batch_size] for k in range(0, full, batch_size))
+        leftovers.extend(same_shape[full:])
+    leftovers.sort(key=lambda i: (round(sizes[i][0] / max(1, sizes[i][1]), 2), sizes[i][0] * sizes[i][1]))
+    batches.extend(leftovers[k:k + batch_size] for k in range(0, len(leftovers), batch_size))
+    batches.extend([i] for i, s in enumerate(sizes) if s is None)
+    return batches
+
+
+def to_model_input(image: Image.Image) -> np.ndarray:
+    """PIL RGB image -> contiguous BGR array, the channel order YOLO expects from a file."""
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+
+def detect_images(model, images_bgr: List[np.ndarray], names: Sequence[str] = NAMES,
+                  conf: float = IMAGE_CONF, iou: float = IMAGE_IOU) -> List[List[Detection]]:
+    """
+    Run YOLO on a batch of BGR arrays in one call.
+
+    Returns:
+        Per image (same order), [(box, class name, confidence)] for every raw detection
+    """
+    if not images_bgr:
+        return []
+    results = model(images_bgr, conf=conf, iou=iou, verbose=False)
+    out = []
+    for result in results:
+        dets = []
+        if result.boxes is not None and len(result.boxes):
+            boxes = result.boxes.xyxy.cpu().numpy().astype(int)
+            clss = result.boxes.cls.cpu().numpy().astype(int)
+            confs = result.boxes.conf.cpu().numpy()
+            for (x1, y1, x2, y2), cls_idx, score in zip(boxes, clss, confs):
+                cls_name = names[cls_idx] if cls_idx < len(names) else ""
+                dets.append(((int(x1), int(y1), int(x2), int(y2)), cls_name, float(score)))
+        out.append(dets)
+    return out
+
+
+def mosaic_boxes(detections: List[Detection], shrink: Tuple[float, float] = IMAGE_SHRINK,
+                 skip_classes=IMAGE_SKIP_CLASSES, min_box: int = IMAGE_MIN_BOX) -> List[Box]:
+    """Areas to cover: detections of the covered classes, shrunk towards their centre."""
+    out = []
+    for (x1, y1, x2, y2), cls_name, _ in detections:
+        if cls_name in skip_classes:
+            continue
+        w, h = x2 - x1, y2 - y1
+        if w < min_box or h < min_box:
+            continue
+        dx = int(w * shrink[0] / 2)
+        dy = int(h * shrink[1] / 2)
+        box = (x1 + dx, y1 + dy, x2 - dx, y2 - dy)
+        if box[2] > box[0] and box[3] > box[1]:
+            out.append(box)
+    return out
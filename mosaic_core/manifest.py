@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Batch Manifest
+Reads CSV / JSON manifests mapping videos to audio tracks and per-job
+options for the batch modes. A row whose video is a folder expands to every
+video in it (e.g. one background track for a folder of clips).
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from mosaic_core.processed import is_rendered_output
+
+VIDEO_EXTS = (".mp4", ".avi", ".mov", ".mkv")
+MANIFEST_FIELDS = ('video', 'audio', 'pattern', 'output')
+
+
+@dataclass
+class BatchJob:
+    """マニフェストの1ジョブ (動画1本)"""
+    video: str
+    audio: Optional[str] = None        # None: keep the video's own audio
+    pattern: Optional[str] = None      # None: batch default
+    output: Optional[str] = None       # Output file (file rows)
+    output_dir: Optional[str] = None   # Output folder (folder rows)
+
+
+def _rows(path: str) -> List[dict]:
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        rows = data.get('jobs', []) if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError("JSON manifest must be a list of objects (or {\"jobs\": [...]})")
+        return rows
+    # utf-8-sig: CSV saved from Excel starts with a BOM
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return [{(k or '').strip().lower(): v for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+    """
+    Parse a manifest. Relative paths are resolved against the manifest's folder.
+
+    CSV columns / JSON keys: video (required), audio, pattern, output.
+    Empty values mean "not set". Rows whose video or audio is missing are
+    skipped with a warning.
+
+    Raises:
+        ValueError: if a row has no video
+    """
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value) -> Optional[str]:
+        value = (str(value).strip() if value is not None else '')
+        return os.path.normpath(os.path.join(base, os.path.expanduser(value))) if value else None
+
+    jobs: List[BatchJob] = []
+    for line, row in enumerate(_rows(path), start=1):
+        video = resolve(row.get('video'))
+        if video is None:
+            raise ValueError(f"{path}: row {line} has no video")
+        audio = resolve(row.get('audio'))
+        pattern = (row.get('pattern') or '').strip() or None
+        output = resolve(row.get('output'))
+        if audio is not None and not os.path.isfile(audio):
+            print(f"[WARNING] Manifest row {line}: audio not found, skipped: {audio}")
+            continue
+        if os.path.isdir(video):
+            videos = sorted(os.path.join(video, f) for f in os.listdir(video)
+                            if f.lower().endswith(VIDEO_EXTS) and not is_rendered_output(f))
+            if not videos:
+                print(f"[WARNING] Manifest row {line}: no videos in folder: {video}")
+            jobs.extend(BatchJob(v, audio, pattern, output_dir=output) for v in videos)
+        elif os.path.isfile(video):
+            jobs.append(BatchJob(video, audio, pattern, output=output))
+        else:
+            print(f"[WARNING] Manifest row {line}: video not found, skipped: {video}")
+    return jobs
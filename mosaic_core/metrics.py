@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Process Metrics
+Resident memory (RSS) sampling for the render loops. Uses psutil when it is
+installed and falls back to /proc or the resource module.
+"""
+
+import os
+import sys
+from typing import List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None if unavailable."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process so far, or None if unavailable."""
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        peak = getattr(info, 'peak_wset', None)  # Windows
+        if peak is not None:
+            return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssMonitor:
+    """レンダリング中の RSS 計測 (定常値とピーク)"""
+
+    def __init__(self, interval: int = 30):
+        """
+        Args:
+            interval: Sample every N calls to tick()
+        """
+        self.interval = interval
+        self.samples: List[int] = []
+        self.start = rss_bytes()
+        self._process_peak = peak_rss_bytes()
+        self._calls = 0
+
+    def tick(self):
+        self._calls += 1
+        if (self._calls - 1) % self.interval == 0:
+            value = rss_bytes()
+            if value is not None:
+                self.samples.append(value)
+
+    @property
+    def steady(self) -> Optional[int]:
+        """Median RSS over the second half of the samples (after warm-up)."""
+        tail = sorted(self.samples[len(self.samples) // 2:])
+        return tail[len(tail) // 2] if tail else None
+
+    @property
+    def peak(self) -> Optional[int]:
+        """
+        Peak RSS while this monitor ran: the largest sample, or the process peak
+        when that rose after the monitor started (a new high between samples).
+        The process peak alone would report an earlier video's maximum.
+        """
+        values = [v for v in self.samples + [self.start] if v is not None]
+        process = peak_rss_bytes()
+        if process is not None and self._process_peak is not None and process > self._process_peak:
+            values.append(process)
+        return max(values) if values else None
+
+    def report(self) -> str:
+        def mb(v):
+            return f"{v / _MB:.1f} MB" if v is not None else "n/a"
+        return f"RSS: start {mb(self.start)}, steady {mb(self.steady)}, peak {mb(self.peak)}"
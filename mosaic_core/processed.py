@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Processed-Output Manifest
+Persistent record (JSON in the output folder) of every completed output:
+source path, size, mtime, content hash, model hash and render settings.
+Batch runs skip inputs whose output is up to date and re-render only when
+the source, the models or the settings changed. Unchanged sources are
+recognised by stat() alone; the content hash is only read when size/mtime
+moved (e.g. a copy or touch that left the content as is).
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from mosaic_core.hashing import file_quick_hash
+
+PROCESSED_MANIFEST = 'processed_manifest.json'
+MANIFEST_VERSION = 1
+OUTPUT_SUFFIX = '_mc'  # Rendered outputs are named <name>_mc.<ext>
+
+
+def is_rendered_output(path: str) -> bool:
+    """True for files named like a rendered output (<name>_mc.<ext>), which are never inputs."""
+    return os.path.splitext(os.path.basename(path))[0].endswith(OUTPUT_SUFFIX)
+
+
+def _normalized(settings: Dict[str, Any]) -> Dict[str, Any]:
+    # Compare settings as they read back from JSON (tuples -> lists etc.)
+    return json.loads(json.dumps(settings, ensure_ascii=False, sort_keys=True))
+
+
+class ProcessedManifest:
+    """処理済み出力の記録 (出力フォルダに保存し、未変更の入力をスキップする)"""
+
+    def __init__(self, path: str, save_interval: float = 0.0):
+        """
+        Args:
+            path: Manifest file (created on the first record)
+            save_interval: Seconds between saves from record(); 0 saves every record.
+                With a large manifest and many small outputs (images) set this and call flush().
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.entries = data.get('outputs', {})
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Failed to read processed manifest {path}: {e}")
+
+    @staticmethod
+    def _key(output: str) -> str:
+        return os.path.abspath(output)
+
+    def check(self, source: str, output: str, model_hash: str, settings: Dict[str, Any]) -> Optional[str]:
+        """
+        Whether `source` has to be rendered to `output`.
+
+        Returns:
+            None if the recorded output is up to date, else the reason to render
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(output))
+        if entry is None or entry.get('source') != os.path.abspath(source):
+            return "new"
+        if not os.path.exists(output):
+            return "output missing"
+        if entry.get('model_hash') != model_hash:
+            return "model changed"
+        if entry.get('settings') != _normalized(settings):
+            return "settings changed"
+        st = os.stat(source)
+        if st.st_size == entry.get('size') and abs(st.st_mtime - entry.get('mtime', 0)) <= 1e-3:
+            return None
+        if st.st_size != entry.get('size') or file_quick_hash(source) != entry.get('content_hash'):
+            return "source changed"
+        # Same content under a new mtime: refresh the stat so the next run is O(stat) again
+        with self._lock:
+            entry['mtime'] = st.st_mtime
+            self._mark_dirty()
+        return None
+
+    def record(self, source: str, output: str, model_hash: str, settings: Dict[str, Any]):
+        """Record a completed output (thread-safe; saved per save_interval)."""
+        st = os.stat(source)
+        entry = {
+            'source': os.path.abspath(source),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'content_hash': file_quick_hash(source),
+            'model_hash': model_hash,
+            'settings': _normalized(settings),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with self._lock:
+            self.entries[self._key(output)] = entry
+            self._mark_dirty()
+
+    def flush(self):
+        """Save records not yet written (when save_interval > 0)."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def record_when_done(self, future: Future, source: str, output: str, model_hash: str,
+                         settings: Dict[str, Any], accept: Optional[Callable[[Any], bool]] = None):
+        """Record the output once the encode-queue job `future` succeeds (and accept(result) holds)."""
+        def on_done(f: Future):
+            if f.exception() is not None or (accept is not None and not accept(f.result())):
+                return
+            try:
+                self.record(source, output, model_hash, settings)
+            except OSError as e:
+                print(f"[WARNING] Failed to record {output} as processed: {e}")
+        future.add_done_callback(on_done)
+
+    def _mark_dirty(self):
+        # Caller holds the lock; saves now unless the last save is within save_interval
+        self._dirty = True
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'outputs': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_save = time.monotonic()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Stage Profiler
+Span timing for the video pipeline (decode, convert, Layer 1/2/4, merge,
+composite, write, mux, ...). Per-video summaries give mean/p50/p95/p99 ms per
+stage; an optional Chrome trace-event JSON (chrome://tracing, Perfetto) shows
+the spans on a timeline. Disabled by default, where span() returns a shared
+no-op context manager.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+_MB = 1024 * 1024
+_UNBOUND = object()  # Thread not bound to a video: spans go to the current one
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """ステージ毎の処理時間計測 (無効時はほぼゼロコスト)"""
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        # ns per stage, per video id (None: spans outside any video). Background
+        # threads append concurrently, so every access goes through _lock.
+        self._durations: Dict[Optional[int], Dict[str, List[int]]] = {}
+        self._events: List[tuple] = []  # (name, start_ns, end_ns, tid) for the trace
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._video: Optional[str] = None
+        self._video_id: Optional[int] = None
+        self._video_start = 0
+        self._next_id = 0
+        self._last_id: Optional[int] = None
+        self._closed: Dict[int, Dict[str, Any]] = {}  # video id -> its end_video() summary
+        self.summaries: List[Dict[str, Any]] = []
+
+    def enable(self, trace: bool = False):
+        """Start collecting spans (and trace events if `trace`)."""
+        self.enabled = True
+        self.tracing = trace
+
+    def span(self, name: str):
+        """Context manager timing one stage: `with profiler.span('decode'): ...`"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def add(self, name: str, start_ns: int, end_ns: int):
+        """
+        Record a stage that was timed by the caller (perf_counter_ns values).
+
+        The span counts toward the video the calling thread is bound to (see
+        bind()), else the current one. A span arriving after its video's
+        end_video() is merged into that video's summary and printed on its own.
+        """
+        video_id = getattr(self._local, 'video_id', _UNBOUND)
+        with self._lock:
+            if video_id is _UNBOUND:
+                video_id = self._video_id
+            values = self._durations.setdefault(video_id, defaultdict(list))[name]
+            values.append(end_ns - start_ns)
+            if self.tracing:
+                self._events.append((name, start_ns, end_ns, threading.get_ident()))
+            summary = self._closed.get(video_id)
+            if summary is not None:
+                summary['stages'][name] = _stage_stats(values)
+        if summary is not None:
+            print(f"[INFO] Profile: {summary['video']}: {name} {(end_ns - start_ns) / 1e9:.2f}s")
+
+    def bind(self, fn: Callable) -> Callable:
+        """
+        Wrap `fn` (run later, e.g. on an encode thread) so its spans count toward
+        the current video, or the one just ended when called between videos.
+        """
+        video_id = self._video_id if self._video_id is not None else self._last_id
+
+        def run(*args, **kwargs):
+            self._local.video_id = video_id
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                del self._local.video_id
+        return run
+
+    def begin_video(self, name: str):
+        """Start a new per-video section; spans recorded outside any video so far are discarded."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._durations.pop(None, None)
+            self._next_id += 1
+            self._video_id = self._next_id
+            self._durations[self._video_id] = defaultdict(list)
+            self._video = name
+            self._video_start = time.perf_counter_ns()
+            if self.tracing:
+                self._events.append(('video: ' + name, self._video_start, None, threading.get_ident()))
+
+    def end_video(self, frames: int, peak_rss: Optional[int] = None,
+                  report: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Close the current video section and (optionally) print its summary.
+
+        Args:
+            frames: Frames processed in this video
+            peak_rss: Peak resident memory in bytes (e.g. RssMonitor.peak)
+            report: Print the per-stage table
+
+        Returns:
+            {'video', 'frames', 'seconds', 'fps', 'peak_rss_mb', 'stages': {name: {...}}}
+        """
+        if not self.enabled or self._video is None:
+            return None
+        end = time.perf_counter_ns()
+        seconds = (end - self._video_start) / 1e9
+        with self._lock:
+            if self.tracing:
+                # Fill in the end of the open video event
+                for i in range(len(self._events) - 1, -1, -1):
+                    ev = self._events[i]
+                    if ev[2] is None and ev[0] == 'video: ' + self._video:
+                        self._events[i] = (ev[0], ev[1], end, ev[3])
+                        break
+            durations = self._durations.pop(self._video_id, {})
+            summary = {
+                'video': self._video,
+                'frames': frames,
+                'seconds': round(seconds, 3),
+                'fps': round(frames / seconds, 2) if seconds > 0 else 0.0,
+                'peak_rss_mb': round(peak_rss / _MB, 1) if peak_rss is not None else None,
+                'stages': {name: _stage_stats(values) for name, values in durations.items()},
+            }
+            # Per-frame spans are dropped; background spans still to come start a fresh list
+            self._durations[self._video_id] = defaultdict(list)
+            self._closed[self._video_id] = summary
+            self.summaries.append(summary)
+            self._video = None
+            self._last_id = self._video_id
+            self._video_id = None
+        if report:
+            print(format_summary(summary))
+        return summary
+
+    def dump_trace(self, path: str) -> bool:
+        """Write the recorded spans as Chrome trace-event JSON. Returns True if written."""
+        if not self.tracing:
+            return False
+        pid = os.getpid()
+        now = time.perf_counter_ns()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                   'args': {'name': 'nsfw-mosaic-auto'}}]
+        with self._lock:
+            recorded = list(self._events)
+        for name, start, end, tid in recorded:
+            events.append({
+                'name': name,
+                'cat': 'video' if name.startswith('video: ') else 'stage',
+                'ph': 'X',
+                'ts': (start - self._origin) / 1000.0,  # microseconds
+                'dur': ((end if end is not None else now) - start) / 1000.0,
+                'pid': pid,
+                'tid': tid,
+            })
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"[INFO] Trace written: {path} ({len(events) - 1} events)")
+        return True
+
+
+def _stage_stats(values: List[int]) -> Dict[str, Any]:
+    ms = np.asarray(values, dtype=np.float64) / 1e6
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': int(ms.size),
+        'total_ms': round(float(ms.sum()), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+    }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """Per-stage table for one end_video() summary."""
+    rss = f"{summary['peak_rss_mb']:.1f} MB" if summary.get('peak_rss_mb') is not None else "n/a"
+    lines = [f"[INFO] Profile: {summary['video']}: {summary['frames']} frames in "
+             f"{summary['seconds']:.2f}s ({summary['fps']:.1f} fps), peak RSS {rss}",
+             f"       {'stage':<16}{'count':>8}{'total s':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)"]
+    stages = sorted(summary['stages'].items(), key=lambda kv: -kv[1]['total_ms'])
+    for name, s in stages:
+        lines.append(f"       {name:<16}{s['count']:>8}{s['total_ms'] / 1000:>10.2f}"
+                     f"{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['p99_ms']:>9.2f}")
+    return '\n'.join(lines)
+
+
+# Process-wide profiler used by the pipeline modules
+profiler = Profiler()
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Video Render Loop
+Per-frame multi-layer detection and mosaic compositing shared by the video scripts.
+"""
+
+import hashlib
+import json
+import os
+from bisect import bisect_right
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+
+from mosaic_core.buffers import FramePool
+from mosaic_core.detection import (
+    HoldOverState, LAYER_DETECT, LAYER_HISTORY, LAYER_NUDENET, LAYER_TRACK,
+    MultiLayerDetector, TRACKER_RESET_INTERVAL, clip_box, merge_boxes,
+)
+from mosaic_core.detection_cache import VideoDetectionCache, cache_meta, load_cache
+from mosaic_core.frame_cache import FrameFingerprintCache, frame_fingerprint
+from mosaic_core.metrics import RssMonitor
+from mosaic_core.profiler import profiler
+from mosaic_core.triage import TRIAGE_SPARSE_INTERVAL
+
+PATTERNS = ["モザイク小", "モザイク中", "モザイク大", "ぼかし", "黒塗り"]
+
+
+def apply_pattern(region, pattern):
+    w, h = region.size
+    if pattern == "モザイク大":
+        small = region.resize((max(1, w // 32), max(1, h // 32)), Image.Resampling.BICUBIC)
+        return small.resize((w, h), Image.Resampling.NEAREST)
+    elif pattern == "モザイク中":
+        small = region.resize((max(1, w // 16), max(1, h // 16)), Image.Resampling.BICUBIC)
+        return small.resize((w, h), Image.Resampling.NEAREST)
+    elif pattern == "モザイク小":
+        small = region.resize((max(1, w // 8), max(1, h // 8)), Image.Resampling.BICUBIC)
+        return small.resize((w, h), Image.Resampling.NEAREST)
+    elif pattern == "ぼかし":
+        # Resolution-adaptive blur radius - Weaker based on user feedback
+        arr = np.array(region)
+        fast_blur(arr, blur_sigma(w, h))
+        return Image.fromarray(arr)
+    elif pattern == "黒塗り":
+        return Image.new("RGB", (w, h), (0, 0, 0))
+    else:
+        return region
+
+
+def paint_boxes(img, boxes, pattern):
+    """Apply the pattern to every box (clipped to the image) in place."""
+    img_w, img_h = img.size
+    for box in boxes:
+        clipped = clip_box(box, img_w, img_h)
+        if clipped is None:
+            continue
+        region = img.crop(clipped)
+        img.paste(apply_pattern(region, pattern), clipped)
+
+
+# Mosaic block divisor per pattern (matches apply_pattern)
+MOSAIC_DIVISORS = {"モザイク大": 32, "モザイク中": 16, "モザイク小": 8}
+_BOX_PASSES = 3  # Box blur passes approximating a Gaussian (like PIL's GaussianBlur)
+BLUR_WORK_KERNEL = 11  # Box width at the working scale of fast_blur
+_BLUR_BORDER = cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED
+
+
+def blur_sigma(w: int, h: int) -> int:
+    """Gaussian sigma of the ぼかし pattern for a w x h box."""
+    return max(8, min(w, h) // 10)
+
+
+def fast_blur(region, sigma: float):
+    """
+    In-place Gaussian-like blur whose cost does not grow with sigma.
+
+    A wide blur keeps no detail finer than ~sigma, so the region is area-downscaled
+    until _BOX_PASSES box passes of BLUR_WORK_KERNEL px have exactly that sigma,
+    blurred there and bilinearly upscaled back into the view. Small sigmas are
+    blurred at full resolution.
+    """
+    h, w = region.shape[:2]
+    work_sigma = ((BLUR_WORK_KERNEL ** 2 - 1) * _BOX_PASSES / 12) ** 0.5
+    scale = sigma / work_sigma
+    if scale >= 1.5:
+        work = cv2.resize(region, (max(1, round(w / scale)), max(1, round(h / scale))),
+                          interpolation=cv2.INTER_AREA)
+        k = BLUR_WORK_KERNEL
+    else:
+        work = region
+        k = int((12 * sigma * sigma / _BOX_PASSES + 1) ** 0.5) | 1
+    for _ in range(_BOX_PASSES):
+        cv2.blur(work, (k, k), dst=work, borderType=_BLUR_BORDER)
+    if work is not region:
+        cv2.resize(work, (w, h), dst=region, interpolation=cv2.INTER_LINEAR)
+
+
+def apply_pattern_array(region, pattern):
+    """In-place numpy version of apply_pattern for a frame view (any channel order)."""
+    h, w = region.shape[:2]
+    if pattern in MOSAIC_DIVISORS:
+        d = MOSAIC_DIVISORS[pattern]
+        small = cv2.resize(region, (max(1, w // d), max(1, h // d)), interpolation=cv2.INTER_AREA)
+        cv2.resize(small, (w, h), dst=region, interpolation=cv2.INTER_NEAREST)
+    elif pattern == "ぼかし":
+        fast_blur(region, blur_sigma(w, h))
+    elif pattern == "黒塗り":
+        region[:] = 0
+
+
+def paint_boxes_array(frame, boxes, pattern):
+    """Apply the pattern to every box (clipped to the frame) directly in the frame buffer."""
+    img_h, img_w = frame.shape[:2]
+    for box in boxes:
+        clipped = clip_box(box, img_w, img_h)
+        if clipped is None:
+            continue
+        x1, y1, x2, y2 = clipped
+        apply_pattern_array(frame[y1:y2, x1:x2], pattern)
+
+
+def in_frame_ranges(frame_idx: int, starts: List[int], ranges: List[Tuple[int, int]]) -> bool:
+    """True if frame_idx falls in one of the sorted, inclusive (start, end) ranges."""
+    i = bisect_right(starts, frame_idx) - 1
+    return i >= 0 and frame_idx <= ranges[i][1]
+
+
+# Outline colours (RGB) per layer for proxy previews
+LAYER_COLORS = {
+    LAYER_TRACK: (0, 191, 255),    # Layer 1: tracking
+    LAYER_DETECT: (46, 204, 113),  # Layer 2: detection
+    LAYER_NUDENET: (255, 0, 255),  # Layer 4: NudeNet
+    LAYER_HISTORY: (255, 149, 0),  # Layer 3: history fallback
+}
+
+
+def draw_outlines(img, boxes, width: int = 2):
+    """Draw layer colour-coded outlines for (x1, y1, x2, y2, layer) boxes."""
+    draw = ImageDraw.Draw(img)
+    for b in boxes:
+        draw.rectangle((b[0], b[1], b[2] - 1, b[3] - 1), outline=LAYER_COLORS.get(b[4], (255, 255, 255)), width=width)
+
+
+def draw_outlines_bgr(frame, boxes, width: int = 2):
+    """draw_outlines for a BGR frame buffer (in place)."""
+    for b in boxes:
+        color = LAYER_COLORS.get(b[4], (255, 255, 255))[::-1]
+        # Inset like PIL so the outline stays inside the box
+        cv2.rectangle(frame, (b[0] + width // 2, b[1] + width // 2),
+                      (b[2] - 1 - (width - 1) // 2, b[3] - 1 - (width - 1) // 2), color, width)
+
+
+class LiveDetection:
+    """フレーム毎のマルチレイヤー検出 (Layer 1-4)"""
+
+    def __init__(self, detector: MultiLayerDetector,
+                 dense_ranges: Optional[List[Tuple[int, int]]] = None,
+                 frame_cache: Optional[FrameFingerprintCache] = None):
+        """
+        Args:
+            detector: Layer 1/2/4 detector
+            dense_ranges: Sorted inclusive (start, end) frame ranges (0-based) where
+                detection runs on every frame. Outside them detection runs every
+                TRIAGE_SPARSE_INTERVAL frames and the Layer 3 hold-over covers the
+                rest, so a region triage missed is still covered. None runs
+                detection on every frame.
+            frame_cache: Cross-video fingerprint cache consulted before any layer
+        """
+        self.detector = detector
+        self.dense_ranges = dense_ranges
+        self.frame_cache = frame_cache
+        self._starts = [r[0] for r in dense_ranges] if dense_ranges is not None else None
+        self.hold = HoldOverState()
+        self.was_dense = True
+        self.dense_frames = 0
+        self.cache_hits = 0
+
+    def _detect_layers(self, idx: int, frame_rgb):
+        """Run Layer 1/2/4. Returns (tracks, merged boxes)."""
+        detector = self.detector
+        tracks = []        # Layer 1: tracking
+        layer2_boxes = []  # Layer 2: standalone detection
+        layer4_boxes = []  # Layer 4: NudeNet
+
+        # ===== LAYER 1: Tracking Detection =====
+        try:
+            with profiler.span('track'):
+                tracks = detector.track(frame_rgb)
+        except Exception as e:
+            print(f"[WARNING] Layer 1 (tracking) failed on frame {idx}: {e}")
+
+        # ===== LAYER 2: Standalone Detection (ALWAYS runs as cross-check) =====
+        try:
+            with profiler.span('detect'):
+                layer2_boxes = [b + (LAYER_DETECT,) for b, _ in detector.detect(frame_rgb)]
+        except Exception as e:
+            print(f"[WARNING] Layer 2 (detection) failed on frame {idx}: {e}")
+
+        # ===== LAYER 4: NudeNet Cross-Check =====
+        if detector.has_nudenet:
+            try:
+                layer4_boxes = [b + (LAYER_NUDENET,) for b, _ in detector.nudenet(frame_rgb)]
+            except Exception as e:
+                print(f"[WARNING] Layer 4 (NudeNet) failed on frame {idx}: {e}")
+
+        # Merge results from all layers
+        with profiler.span('merge'):
+            merged = merge_boxes([t[0] + (LAYER_TRACK,) for t in tracks] + layer2_boxes + layer4_boxes)
+        return tracks, merged
+
+    def frame_boxes(self, frame_idx: int, frame_rgb) -> List[Tuple[int, int, int, int, str]]:
+        """Return every box to cover on this frame as (x1, y1, x2, y2, layer)."""
+        idx = frame_idx + 1
+        tracks = []
+        merged_boxes = []
+        dense = self._starts is None or in_frame_ranges(frame_idx, self._starts, self.dense_ranges)
+        sparse = not dense and frame_idx % TRIAGE_SPARSE_INTERVAL == 0
+
+        if dense or sparse:
+            if not self.was_dense:
+                # Tracker state is stale after skipped frames
+                self.detector.reset_tracker()
+            if dense:
+                self.dense_frames += 1
+
+            cached = None
+            if self.frame_cache is not None:
+                h, w = frame_rgb.shape[:2]
+                with profiler.span('frame_cache'):
+                    fp_key, thumb = frame_fingerprint(frame_rgb)
+                    cached = self.frame_cache.get(fp_key, thumb, w, h)
+            if cached is not None:
+                # Identical frame seen before (this or another video): skip all layers
+                merged_boxes = cached
+                self.cache_hits += 1
+            else:
+                tracks, merged_boxes = self._detect_layers(idx, frame_rgb)
+                if self.frame_cache is not None:
+                    self.frame_cache.put(fp_key, thumb, merged_boxes, w, h)
+        self.was_dense = dense
+
+        current_ids = self.hold.observe_tracks(tracks)
+
+        # ===== LAYER 3: History Fallback + lost tracks =====
+        history = [b[:4] + (LAYER_HISTORY,) for b in self.hold.update(merged_boxes, current_ids)]
+
+        # Preventive periodic tracker reset every 100 frames
+        # (track history is kept — Layer 3 fallback will still work)
+        if idx % TRACKER_RESET_INTERVAL == 0:
+            self.detector.reset_tracker()
+        return merged_boxes + history
+
+
+class CachedDetection:
+    """検出キャッシュからの再生 (検出をスキップ)"""
+
+    def __init__(self, cache: VideoDetectionCache):
+        self.cache = cache
+        self.dense_frames = 0
+
+    def frame_boxes(self, frame_idx: int, frame_rgb) -> List[Tuple[int, int, int, int, str]]:
+        return self.cache.frame_boxes(frame_idx)
+
+
+def composite_frame(frame, boxes, pattern: str, out_size: Optional[Tuple[int, int]] = None,
+                    out_buf=None, outlines: bool = False):
+    """
+    Paint the boxes onto a BGR frame buffer and return the frame to write:
+    the buffer itself, or `out_buf` holding the downscaled frame when out_size is set.
+    """
+    target = frame
+    if out_size is not None:
+        sx = out_size[0] / frame.shape[1]
+        sy = out_size[1] / frame.shape[0]
+        target = cv2.resize(frame, out_size, dst=out_buf, interpolation=cv2.INTER_AREA)
+        boxes = [(int(b[0] * sx), int(b[1] * sy), int(b[2] * sx), int(b[3] * sy), b[4]) for b in boxes]
+
+    paint_boxes_array(target, boxes, pattern)
+    if outlines:
+        draw_outlines_bgr(target, boxes)
+    return target
+
+
+def render_video(cap, writer, source, pattern: str, total: int = 0,
+                 progress_cb: Optional[Callable[[int, int], Any]] = None,
+                 recorder: Optional[VideoDetectionCache] = None,
+                 out_size: Optional[Tuple[int, int]] = None,
+                 outlines: bool = False,
+                 monitor: Optional[RssMonitor] = None) -> Dict[str, int]:
+    """
+    Run detection (or cache replay) + mosaic compositing over every frame of `cap`.
+
+    Frames are decoded into a small pool of preallocated buffers, composited
+    in place and written straight from the buffer; the RGB copy used for
+    detection and the proxy downscale target are also reused across frames.
+
+    Args:
+        cap: Opened cv2.VideoCapture
+        writer: cv2.VideoWriter (or FfmpegPipeWriter) receiving BGR frames
+        source: LiveDetection or CachedDetection
+        pattern: Mosaic pattern name
+        total: Frame count used for progress display
+        progress_cb: Called as progress_cb(idx, total) every 10 frames
+        recorder: Cache that receives the covered boxes of every frame
+        out_size: (width, height) to downscale the output to (proxy preview)
+        outlines: Draw layer colour-coded box outlines (proxy preview)
+        monitor: RSS monitor sampled during the loop
+
+    Returns:
+        {'frames', 'detected_frames', 'dense_frames', 'cache_hits'}
+    """
+    stats = {'frames': 0, 'detected_frames': 0, 'dense_frames': 0, 'cache_hits': 0}
+    live = isinstance(source, LiveDetection)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    pool = FramePool((height, width, 3)) if width > 0 and height > 0 else None
+    frame_rgb = np.empty((height, width, 3), np.uint8) if live and pool is not None else None
+    out_buf = np.empty((out_size[1], out_size[0], 3), np.uint8) if out_size is not None else None
+    idx = 0
+
+    while True:
+        buf = pool.acquire() if pool is not None else None
+        with profiler.span('decode'):
+            ret, frame = cap.read(buf)
+        if not ret:
+            if buf is not None:
+                pool.release(buf)
+            break
+        idx += 1
+
+        # --- Performance Optimization: GUI Update every 10 frames ---
+        if progress_cb is not None and (idx % 10 == 0 or idx == 1 or idx == total):
+            progress_cb(idx, total)
+
+        if live:
+            # Layer 1/2/4 models take RGB; reuse one conversion target
+            if frame_rgb is None or frame_rgb.shape != frame.shape:
+                frame_rgb = np.empty_like(frame)
+            with profiler.span('convert'):
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+        boxes = source.frame_boxes(idx - 1, frame_rgb if live else None)
+        if recorder is not None:
+            recorder.add_frame(boxes)
+        if boxes:
+            stats['detected_frames'] += 1
+
+        with profiler.span('composite'):
+            composited = composite_frame(frame, boxes, pattern, out_size, out_buf, outlines)
+        with profiler.span('write'):
+            writer.write(composited)
+        if buf is not None:
+            pool.release(buf)
+        if monitor is not None:
+            monitor.tick()
+        stats['frames'] += 1
+
+    stats['dense_frames'] = source.dense_frames
+    stats['cache_hits'] = getattr(source, 'cache_hits', 0)
+    return stats
+
+
+def proxy_size(width: int, height: int, target_height: int) -> Tuple[int, int]:
+    """Downscaled (even) output size keeping the aspect ratio."""
+    if height <= target_height:
+        return (width - width % 2, height - height % 2)
+    w = int(round(width * target_height / height))
+    return (w - w % 2, target_height - target_height % 2)
+
+
+def prepare_source(video_path: str, detector: MultiLayerDetector, cache_dir: str, model_hash: str,
+                   dense_ranges: Optional[List[Tuple[int, int]]] = None,
+                   frame_cache: Optional[FrameFingerprintCache] = None, tracker: str = 'bytetrack'):
+    """
+    Pick the box source for a video: replay a valid detection cache when one
+    exists, otherwise run live detection and record a new cache.
+
+    Args:
+        tracker: 'bytetrack' (render_video) or 'iou' (render_video_pooled: no Layer 1,
+                 different boxes), so one render never replays the other's cache
+
+    Returns:
+        (source, recorder) — recorder is None when replaying
+    """
+    detect_mode = 'full'
+    if dense_ranges is not None:
+        # The ranges decide which frames were detected: a new timeline needs a new cache
+        ranges_key = hashlib.sha1(json.dumps([TRIAGE_SPARSE_INTERVAL] + dense_ranges).encode()).hexdigest()[:12]
+        detect_mode = f'triage:{ranges_key}'
+    if tracker != 'bytetrack':
+        detect_mode += f'+{tracker}'
+    cache = load_cache(cache_dir, video_path, model_hash, detect_mode)
+    if cache is not None:
+        print(f"[INFO] Reusing detection cache: {os.path.basename(video_path)} ({cache.frame_count} frames)")
+        return CachedDetection(cache), None
+    recorder = VideoDetectionCache(cache_meta(video_path, model_hash, detect_mode))
+    return LiveDetection(detector, dense_ranges, frame_cache), recorder
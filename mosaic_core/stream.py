@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Live Stream Mode
+Mosaics a live feed (RTSP/HTTP/device via OpenCV, or raw BGR frames on stdin)
+under an end-to-end latency budget. When detection can't keep up the
+scheduler switches to stride detection and propagates boxes in between.
+"""
+
+import math
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from mosaic_core.detection import box_iou
+from mosaic_core.ffmpeg_io import FfmpegPipeWriter
+from mosaic_core.profiler import profiler
+from mosaic_core.render import LiveDetection, paint_boxes_array
+
+STREAM_LATENCY_MS = 250      # Default end-to-end budget (capture -> written)
+STREAM_MAX_STRIDE = 8        # Upper bound on frames per detection
+STREAM_QUEUE_SIZE = 2        # Minimum capture queue depth; the oldest frame is dropped when full
+STREAM_REPORT_INTERVAL = 5.0  # Seconds between console latency reports
+STREAM_PRESET = 'ultrafast'
+PROPAGATE_PAD = 0.03         # Box growth per propagated frame (fraction of the box size)
+PROPAGATE_MAX_PAD = 0.25
+_EMA_ALPHA = 0.2
+_HEADROOM = 0.8              # Fraction of the frame interval the scheduler plans to use
+
+
+class CaptureSource:
+    """OpenCV で開けるライブ入力 (RTSP/HTTP/デバイス番号/ファイル)"""
+
+    def __init__(self, url: str, fps: Optional[float] = None):
+        self.cap = cv2.VideoCapture(int(url) if url.isdigit() else url)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open stream: {url}")
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Keep the backend from queueing stale frames
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def read(self) -> Optional[np.ndarray]:
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def close(self):
+        self.cap.release()
+
+
+class RawPipeSource:
+    """標準入力からの生 BGR24 フレーム (例: ffmpeg ... -f rawvideo -pix_fmt bgr24 -)"""
+
+    def __init__(self, width: int, height: int, fps: float = 30.0, stream=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_bytes = width * height * 3
+        self.stream = stream if stream is not None else sys.stdin.buffer
+
+    def read(self) -> Optional[np.ndarray]:
+        buf = bytearray(self.frame_bytes)
+        view = memoryview(buf)
+        got = 0
+        while got < self.frame_bytes:
+            n = self.stream.readinto(view[got:])
+            if not n:
+                return None  # End of stream (a partial trailing frame is discarded)
+            got += n
+        return np.frombuffer(buf, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def close(self):
+        pass
+
+
+def open_stream_source(spec: str, size: Optional[Tuple[int, int]] = None, fps: Optional[float] = None):
+    """
+    Open a live input.
+
+    Args:
+        spec: '-' for raw BGR24 frames on stdin, otherwise a URL / device index / path for OpenCV
+        size: (width, height) of the raw frames (required for '-')
+        fps: Nominal frame rate (raw input default: 30)
+    """
+    if spec == '-':
+        if size is None:
+            raise ValueError("Raw stdin input needs the frame size (--stream-size WxH)")
+        return RawPipeSource(size[0], size[1], fps or 30.0)
+    return CaptureSource(spec, fps)
+
+
+def open_stream_writer(output: str, width: int, height: int, fps: float) -> FfmpegPipeWriter:
+    """
+    Low-latency H.264 writer. Frames are timestamped with the wall clock so
+    dropped input frames don't shift the timeline. Network URLs are sent as
+    MPEG-TS (RTSP as RTSP), and '-' writes MPEG-TS to stdout.
+    """
+    extra = {'tune': 'zerolatency', 'g': max(1, int(round(fps * 2))), 'fps_mode': 'passthrough'}
+    if output == '-':
+        output = 'pipe:'
+        extra['format'] = 'mpegts'
+    elif output.startswith('rtsp://'):
+        extra['format'] = 'rtsp'
+    elif output.startswith(('udp://', 'rtp://', 'srt://', 'tcp://')):
+        extra['format'] = 'mpegts'
+    return FfmpegPipeWriter(output, width, height, fps, preset=STREAM_PRESET,
+                            extra_input_args={'use_wallclock_as_timestamps': 1},
+                            extra_output_args=extra)
+
+
+class FrameReader(threading.Thread):
+    """入力スレッド: 最新フレームのみ保持し、処理が遅れた分は古い順に破棄"""
+
+    def __init__(self, source, maxsize: int = STREAM_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.source = source
+        self.queue: 'queue.Queue' = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        idx = 0
+        while not self._stop_event.is_set():
+            frame = self.source.read()
+            if frame is None:
+                break
+            item = (idx, time.monotonic(), frame)
+            idx += 1
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.queue.put(None)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class BoxPropagator:
+    """検出間フレームのボックス外挿 (等速移動 + 経過フレームに応じた拡張)"""
+
+    def __init__(self):
+        self._prev: Optional[Tuple[int, list]] = None
+        self._last: Optional[Tuple[int, list]] = None
+        self._velocity: List[Tuple[float, float]] = []
+
+    def observe(self, frame_idx: int, boxes):
+        """Record the boxes of a detected frame and re-estimate per-box velocity."""
+        self._prev, self._last = self._last, (frame_idx, list(boxes))
+        self._velocity = []
+        for b in self._last[1]:
+            v = (0.0, 0.0)
+            if self._prev is not None and self._prev[1]:
+                gap = frame_idx - self._prev[0]
+                best = max(self._prev[1], key=lambda p: box_iou(b, p))
+                if gap > 0 and box_iou(b, best) > 0:
+                    v = (((b[0] + b[2]) - (best[0] + best[2])) / (2 * gap),
+                         ((b[1] + b[3]) - (best[1] + best[3])) / (2 * gap))
+            self._velocity.append(v)
+
+    def propagate(self, frame_idx: int) -> List[Tuple[int, int, int, int, str]]:
+        """Boxes for a skipped frame: last detection moved by its velocity and padded."""
+        if self._last is None:
+            return []
+        last_idx, boxes = self._last
+        gap = max(0, frame_idx - last_idx)
+        pad = min(PROPAGATE_MAX_PAD, PROPAGATE_PAD * gap)
+        out = []
+        for b, (vx, vy) in zip(boxes, self._velocity):
+            dx, dy = vx * gap, vy * gap
+            px, py = (b[2] - b[0]) * pad, (b[3] - b[1]) * pad
+            out.append((int(b[0] + dx - px), int(b[1] + dy - py),
+                        int(math.ceil(b[2] + dx + px)), int(math.ceil(b[3] + dy + py)), b[4]))
+        return out
+
+
+class LatencyScheduler:
+    """レイテンシ予算に基づく検出間隔 (stride) の制御"""
+
+    def __init__(self, fps: float, budget_ms: float = STREAM_LATENCY_MS, max_stride: int = STREAM_MAX_STRIDE):
+        self.frame_interval = 1.0 / fps if fps > 0 else 1.0 / 30
+        self.budget = budget_ms / 1000.0
+        self.max_stride = max(1, max_stride)
+        self.stride = 1
+        self.detect_cost: Optional[float] = None  # EMA of detection time (s)
+        self.base_cost = 0.0                      # EMA of per-frame time without detection (s)
+        self._last_detect = -1
+        self._floor = 1   # Stride floor raised by over-budget frames, decays when calm
+        self._calm = 0
+        self.latencies: List[float] = []
+
+    def should_detect(self, frame_idx: int, age: float) -> bool:
+        """
+        Detect on this frame if the stride is due and the frame would still
+        meet the latency budget; otherwise the caller propagates boxes.
+        """
+        if self._last_detect < 0:
+            return True
+        if frame_idx - self._last_detect < self.stride:
+            return False
+        if self.detect_cost is not None and age + self.detect_cost + self.base_cost > self.budget:
+            # Would blow the budget: propagate now, retry on the next frame
+            return frame_idx - self._last_detect >= self.max_stride
+        return True
+
+    def record(self, frame_idx: int, detected: bool, cost: float, latency: float):
+        """Update cost estimates and re-derive the stride after a frame is written."""
+        self.latencies.append(latency)
+        if detected:
+            self._last_detect = frame_idx
+            self.detect_cost = cost if self.detect_cost is None else \
+                (1 - _EMA_ALPHA) * self.detect_cost + _EMA_ALPHA * cost
+        else:
+            self.base_cost = (1 - _EMA_ALPHA) * self.base_cost + _EMA_ALPHA * cost
+        if latency > self.budget:
+            self._floor = min(self.max_stride, self.stride + 1)
+            self._calm = 0
+        elif latency < self.budget / 2:
+            self._calm += 1
+            if self._calm >= 30 and self._floor > 1:
+                self._floor -= 1
+                self._calm = 0
+        if self.detect_cost is None:
+            return
+        # Throughput: one detection per stride frames must fit into stride frame intervals
+        spare = max(1e-3, self.frame_interval * _HEADROOM - self.base_cost)
+        needed = int(math.ceil(max(0.0, self.detect_cost - self.base_cost) / spare))
+        self.stride = min(self.max_stride, max(1, needed, self._floor))
+
+    def percentiles(self) -> Dict[str, float]:
+        """Latency percentiles in milliseconds."""
+        if not self.latencies:
+            return {}
+        arr = np.asarray(self.latencies) * 1000.0
+        p50, p90, p95, p99 = np.percentile(arr, [50, 90, 95, 99])
+        return {'p50': float(p50), 'p90': float(p90), 'p95': float(p95), 'p99': float(p99),
+                'max': float(arr.max())}
+
+
+def _format_latency(p: Dict[str, float]) -> str:
+    if not p:
+        return "no frames"
+    return " ".join(f"{k}={v:.0f}ms" for k, v in p.items())
+
+
+def run_stream(source, writer, live: LiveDetection, pattern: str,
+               budget_ms: float = STREAM_LATENCY_MS, max_stride: int = STREAM_MAX_STRIDE,
+               max_frames: Optional[int] = None,
+               report_interval: float = STREAM_REPORT_INTERVAL) -> Dict[str, Any]:
+    """
+    Mosaic a live source until it ends (or max_frames / Ctrl+C).
+
+    Args:
+        source: CaptureSource or RawPipeSource
+        writer: Receives BGR frames (FfmpegPipeWriter from open_stream_writer)
+        live: Layer 1-4 detection state used on detection frames
+        budget_ms: End-to-end latency budget per frame (capture -> written)
+        max_stride: Maximum frames per detection when falling behind
+
+    Returns:
+        Stats with frame counts and latency percentiles (ms)
+    """
+    scheduler = LatencyScheduler(source.fps, budget_ms, max_stride)
+    propagator = BoxPropagator()
+    # Queue only as many frames as can still be written within the budget
+    reader = FrameReader(source, max(STREAM_QUEUE_SIZE, int(scheduler.budget * source.fps)))
+    stats = {'frames': 0, 'detected': 0, 'propagated': 0, 'late': 0, 'over_budget': 0}
+    reader.start()
+    started = last_report = time.monotonic()
+    reported_frames = 0
+    frame_rgb = None
+
+    try:
+        while True:
+            item = reader.queue.get()
+            if item is None:
+                break
+            frame_idx, captured, frame = item
+            t0 = time.monotonic()
+            if t0 - captured > scheduler.budget:
+                # Already too old to meet the budget: skip rather than fall further behind
+                stats['late'] += 1
+                continue
+
+            if frame_rgb is None or frame_rgb.shape != frame.shape:
+                frame_rgb = np.empty_like(frame)
+            with profiler.span('convert'):
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+            detected = scheduler.should_detect(frame_idx, t0 - captured)
+            if detected:
+                boxes = live.frame_boxes(frame_idx, frame_rgb)
+                propagator.observe(frame_idx, boxes)
+                stats['detected'] += 1
+            else:
+                with profiler.span('propagate'):
+                    boxes = propagator.propagate(frame_idx)
+                stats['propagated'] += 1
+            t_boxes = time.monotonic()
+
+            with profiler.span('composite'):
+                paint_boxes_array(frame, boxes, pattern)
+            with profiler.span('write'):
+                writer.write(frame)
+
+            done = time.monotonic()
+            latency = done - captured
+            if latency > scheduler.budget:
+                stats['over_budget'] += 1
+            scheduler.record(frame_idx, detected, (t_boxes - t0) if detected else (done - t0), latency)
+            stats['frames'] += 1
+
+            if done - last_report >= report_interval:
+                fps = (stats['frames'] - reported_frames) / (done - last_report)
+                recent = scheduler.latencies[-max(1, stats['frames'] - reported_frames):]
+                p = np.percentile(np.asarray(recent) * 1000.0, [50, 99])
+                print(f"[INFO] Stream: {fps:.1f} fps, latency p50={p[0]:.0f}ms p99={p[1]:.0f}ms, "
+                      f"stride {scheduler.stride}, dropped {reader.dropped}")
+                last_report, reported_frames = done, stats['frames']
+
+            if max_frames is not None and stats['frames'] >= max_frames:
+                break
+    except KeyboardInterrupt:
+        print("[INFO] Stream interrupted.")
+    finally:
+        reader.stop()
+
+    elapsed = time.monotonic() - started
+    stats['dropped'] = reader.dropped
+    stats['fps'] = stats['frames'] / elapsed if elapsed > 0 else 0.0
+    stats['final_stride'] = scheduler.stride
+    stats['latency_ms'] = scheduler.percentiles()
+    print(f"[INFO] Stream finished: {stats['frames']} frames ({stats['fps']:.1f} fps), "
+          f"detected {stats['detected']}, propagated {stats['propagated']}, "
+          f"dropped {stats['dropped']} (+{stats['late']} late), over budget {stats['over_budget']}")
+    print(f"[INFO] Latency: {_format_latency(stats['latency_ms'])}")
+    return stats
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Thread Budget
+Splits the CPU cores between torch (ultralytics / transformers), ONNX Runtime
+(NudeNet, WD14, ...) and OpenCV according to how work runs in parallel, so
+the runtimes' own pools don't each assume they own the whole machine.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+
+MODE_SINGLE = 'single'        # One job; runtimes run back to back
+MODE_PIPELINE = 'pipeline'    # N stages (threads) of one process running concurrently
+MODE_PROCESSES = 'processes'  # N worker processes, each running the full model stack
+MODES = (MODE_SINGLE, MODE_PIPELINE, MODE_PROCESSES)
+
+# OpenMP / BLAS pools read these when the libraries are first loaded
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+NUDENET_DEFAULT_MODEL = '320n.onnx'  # What NudeDetector() loads without a model_path
+
+
+@dataclass
+class ThreadLayout:
+    """ランタイム毎のスレッド割り当て"""
+    mode: str
+    parallelism: int
+    cpus: int
+    torch_intra: int
+    torch_inter: int
+    ort_intra: int
+    ort_inter: int
+    opencv: int
+    ort_spinning: bool
+
+    def describe(self) -> str:
+        return (f"Thread layout: mode={self.mode} x{self.parallelism}, cpus={self.cpus} | "
+                f"torch intra={self.torch_intra} inter={self.torch_inter} | "
+                f"ORT intra={self.ort_intra} inter={self.ort_inter} spin={'on' if self.ort_spinning else 'off'} | "
+                f"OpenCV={self.opencv}")
+
+
+_current: Optional[ThreadLayout] = None
+
+
+def plan_threads(mode: str = MODE_SINGLE, parallelism: int = 1,
+                 cpus: Optional[int] = None) -> ThreadLayout:
+    """
+    Thread counts per runtime for one process/stage.
+
+    Args:
+        mode: MODE_SINGLE, MODE_PIPELINE or MODE_PROCESSES
+        parallelism: Number of concurrent stages / worker processes
+        cpus: Core count (default: os.cpu_count())
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown thread budget mode: {mode}")
+    cpus = max(1, cpus or os.cpu_count() or 1)
+    parallelism = 1 if mode == MODE_SINGLE else max(1, parallelism)
+    share = max(1, cpus // parallelism)
+    return ThreadLayout(
+        mode=mode,
+        parallelism=parallelism,
+        cpus=cpus,
+        torch_intra=share,
+        torch_inter=1,
+        ort_intra=share,
+        ort_inter=1,
+        # OpenCV work here is resize/convert/encode glue; one thread per
+        # worker process is enough, stages share what is left
+        opencv=1 if mode == MODE_PROCESSES and share < 4 else share,
+        # Spinning ORT threads keep burning the cores torch/OpenCV use next,
+        # even when the runtimes only run back to back
+        ort_spinning=False,
+    )
+
+
+def apply_threads(layout: ThreadLayout):
+    """Apply a layout to this process (OpenCV, torch if importable, env for OpenMP/BLAS)."""
+    global _current
+    for var in _THREAD_ENV_VARS:
+        os.environ.setdefault(var, str(layout.torch_intra))
+    cv2.setNumThreads(layout.opencv)
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    if torch is not None:
+        torch.set_num_threads(layout.torch_intra)
+        try:
+            torch.set_num_interop_threads(layout.torch_inter)
+        except RuntimeError:
+            pass  # Only settable before torch runs any parallel work
+    _current = layout
+
+
+def configure_threads(mode: str = MODE_SINGLE, parallelism: int = 1,
+                      report: bool = True) -> ThreadLayout:
+    """Plan, apply and (optionally) print the layout. Call once at startup."""
+    layout = plan_threads(mode, parallelism)
+    apply_threads(layout)
+    if report:
+        print(f"[INFO] {layout.describe()}")
+    return layout
+
+
+def current_layout() -> ThreadLayout:
+    """The applied layout (single-job defaults if none was configured)."""
+    return _current if _current is not None else plan_threads()
+
+
+def ort_session_options(layout: Optional[ThreadLayout] = None):
+    """onnxruntime.SessionOptions matching the layout (None if onnxruntime is missing)."""
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return None
+    layout = layout or current_layout()
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = layout.ort_intra
+    opts.inter_op_num_threads = layout.ort_inter
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if not layout.ort_spinning:
+        opts.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        opts.add_session_config_entry('session.inter_op.allow_spinning', '0')
+    return opts
+
+
+def nudenet_model_path() -> Optional[str]:
+    """Model file nudenet.NudeDetector() loads by default (bundled with the package), or None."""
+    try:
+        import nudenet
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(nudenet.__file__), NUDENET_DEFAULT_MODEL)
+    return path if os.path.exists(path) else None
+
+
+def apply_ort_options(nude_detector, layout: Optional[ThreadLayout] = None,
+                      model_path: Optional[str] = None) -> bool:
+    """
+    Recreate a nudenet.NudeDetector's ONNX session with the layout's options
+    (NudeDetector builds its session without SessionOptions). Returns True on success.
+
+    Args:
+        model_path: Model the detector was built with (default: nudenet's bundled model)
+    """
+    session = getattr(nude_detector, 'onnx_session', None)
+    opts = ort_session_options(layout)
+    if session is None or opts is None:
+        return False
+    model_path = model_path or nudenet_model_path()
+    if not model_path:
+        print("[WARNING] NudeNet model file not found; its session keeps the default thread settings.")
+        return False
+    try:
+        import onnxruntime as ort
+        nude_detector.onnx_session = ort.InferenceSession(
+            model_path, sess_options=opts, providers=session.get_providers())
+        return True
+    except Exception as e:
+        print(f"[WARNING] Could not apply thread budget to NudeNet session: {e}")
+        return False
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Tiled Detection for Very Large Images
+Scans and stitched panoramas (10k-30k px) are detected on a downscaled
+overview plus overlapping full-resolution tiles, so small regions survive
+YOLO's letterboxing. Tile boxes cut by a seam are fused across tiles. The
+image is decoded once and never copied whole: the model only ever sees
+tile-sized crops, the pattern is applied by crop / paste per box, and PIL
+encodes the result to the file in chunks.
+"""
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from mosaic_core.detection import NAMES
+from mosaic_core.images import IMAGE_BATCH_SIZE, Box, Detection, detect_images, to_model_input
+
+IMAGE_TILE_PIXELS = 50_000_000  # Images above this many pixels are detected in tiles
+IMAGE_PIXEL_LIMIT_FACTOR = 10   # PIL bomb check at this x the tile threshold (warns above it, refuses above 2x)
+IMAGE_TILE_SIZE = 1024
+IMAGE_TILE_OVERLAP = 128        # Should exceed the smallest region worth covering
+IMAGE_OVERVIEW_SIDE = 1280      # Long side of the overview (catches regions larger than a tile)
+_FUSE_CONTAINMENT = 0.5         # Same-class boxes overlapping this much of the smaller one are one region
+_SEAM_MARGIN = 2                # Box edge this close to an inner tile edge counts as cut by the seam
+
+
+def open_large(path: str) -> Image.Image:
+    """Decode an image as RGB without the extra full-size copy convert() makes of RGB images."""
+    image = Image.open(path)
+    image.load()
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def tile_grid(width: int, height: int, size: int = IMAGE_TILE_SIZE,
+              overlap: int = IMAGE_TILE_OVERLAP) -> List[Box]:
+    """Overlapping tiles covering the image; the last row / column is aligned to the far edge."""
+    def starts(length):
+        if length <= size:
+            return [0]
+        stride = max(1, size - overlap)
+        out = list(range(0, length - size, stride))
+        out.append(length - size)
+        return out
+    return [(x, y, min(width, x + size), min(height, y + size)) for y in starts(height) for x in starts(width)]
+
+
+def _cut_by_seam(box: Box, tile: Optional[Box], width: int, height: int) -> bool:
+    if tile is None:
+        return False
+    x1, y1, x2, y2 = box
+    tx1, ty1, tx2, ty2 = tile
+    return ((tx1 > 0 and x1 <= tx1 + _SEAM_MARGIN) or (ty1 > 0 and y1 <= ty1 + _SEAM_MARGIN)
+            or (tx2 < width and x2 >= tx2 - _SEAM_MARGIN) or (ty2 < height and y2 >= ty2 - _SEAM_MARGIN))
+
+
+def fuse_detections(detections: Sequence[Tuple[Detection, Optional[Box]]], width: int, height: int) -> List[Detection]:
+    """
+    Fuse detections from overlapping tiles (and the overview) into one per region.
+
+    Same-class boxes are joined when they overlap and one is cut by a tile seam
+    (a region split across tiles), or when they overlap by _FUSE_CONTAINMENT of the
+    smaller box (the same region seen twice). Joined boxes become their union.
+
+    Args:
+        detections: [(detection in image coordinates, tile it came from or None for the overview)]
+    """
+    n = len(detections)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    cut = [_cut_by_seam(d[0], tile, width, height) for d, tile in detections]
+    for i in range(n):
+        (a, cls_a, _), _ = detections[i]
+        for j in range(i + 1, n):
+            (b, cls_b, _), _ = detections[j]
+            if cls_a != cls_b:
+                continue
+            ix = min(a[2], b[2]) - max(a[0], b[0])
+            iy = min(a[3], b[3]) - max(a[1], b[1])
+            if ix <= 0 or iy <= 0:
+                continue
+            smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+            if cut[i] or cut[j] or ix * iy >= _FUSE_CONTAINMENT * smaller:
+                parent[find(i)] = find(j)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(detections[i][0])
+    fused = []
+    for members in groups.values():
+        box = (min(m[0][0] for m in members), min(m[0][1] for m in members),
+               max(m[0][2] for m in members), max(m[0][3] for m in members))
+        fused.append((box, members[0][1], max(m[2] for m in members)))
+    return fused
+
+
+def detect_tiled(model, image: Image.Image, names: Sequence[str] = NAMES, tile_size: int = IMAGE_TILE_SIZE,
+                 overlap: int = IMAGE_TILE_OVERLAP, batch_size: int = IMAGE_BATCH_SIZE,
+                 on_progress: Optional[Callable[[int, int], None]] = None) -> List[Detection]:
+    """
+    Overview + tile detection on a large RGB image.
+
+    Args:
+        on_progress: Called as (tiles done, tiles total) after each batch
+    Returns:
+        Fused detections in image coordinates
+    """
+    width, height = image.size
+    factor = max(1, max(width, height) // IMAGE_OVERVIEW_SIDE)
+    overview = image.reduce(factor) if factor > 1 else image
+    sx, sy = width / overview.width, height / overview.height
+    found: List[Tuple[Detection, Optional[Box]]] = []
+    for (x1, y1, x2, y2), cls_name, conf in detect_images(model, [to_model_input(overview)], names)[0]:
+        box = (int(x1 * sx), int(y1 * sy), min(width, int(x2 * sx + 0.999)), min(height, int(y2 * sy + 0.999)))
+        found.append(((box, cls_name, conf), None))
+    del overview
+
+    tiles = tile_grid(width, height, tile_size, overlap)
+    for k in range(0, len(tiles), max(1, batch_size)):
+        batch = tiles[k:k + batch_size]
+        # Only batch_size tile crops are held at a time
+        crops = [to_model_input(image.crop(tile)) for tile in batch]
+        for tile, dets in zip(batch, detect_images(model, crops, names)):
+            tx, ty = tile[0], tile[1]
+            for (x1, y1, x2, y2), cls_name, conf in dets:
+                found.append((((x1 + tx, y1 + ty, x2 + tx, y2 + ty), cls_name, conf), tile))
+        if on_progress is not None:
+            on_progress(min(len(tiles), k + len(batch)), len(tiles))
+    return fuse_detections(found, width, height)
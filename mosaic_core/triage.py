@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Triage
+Low-fps, low-resolution pre-scan that produces a per-video NSFW timeline
+(flagged intervals + peak confidence) before committing to a full render.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+
+from mosaic_core.decode import BACKEND_OPENCV, open_video
+from mosaic_core.detection import YOLO_CONF, MultiLayerDetector
+
+TRIAGE_SAMPLE_FPS = 2.0     # Frames sampled per second of video
+TRIAGE_MAX_SIDE = 640       # Longest side of the sampled frame (YOLO letterboxes to 640 anyway)
+TRIAGE_THRESHOLD = YOLO_CONF  # Minimum confidence for a sample to be flagged (same as the full render)
+TRIAGE_MERGE_GAP = 2.0      # Flagged samples closer than this (sec) form one interval
+TRIAGE_MARGIN = 2.0         # Margin (sec) added around intervals for the full render
+TRIAGE_SPARSE_INTERVAL = 5  # Outside the intervals the full render still detects every Nth frame
+                            # (below MAX_LOST_FRAMES, so the hold-over bridges the gaps)
+
+REPORT_NAME = "triage_report.json"
+
+
+def _timeline_path(report_dir: str, video_path: str) -> str:
+    return os.path.join(report_dir, os.path.basename(video_path) + ".triage.json")
+
+
+def _build_intervals(samples: List[Tuple[float, float]], threshold: float,
+                     half_step: float, merge_gap: float) -> List[Dict[str, float]]:
+    """Merge flagged (time, score) samples into intervals."""
+    intervals = []
+    for t, score in samples:
+        if score < threshold:
+            continue
+        if intervals and t - intervals[-1]['_last'] <= merge_gap:
+            cur = intervals[-1]
+            cur['end'] = t + half_step
+            cur['_last'] = t
+            if score > cur['peak']:
+                cur['peak'] = score
+                cur['peak_time'] = t
+        else:
+            intervals.append({'start': max(0.0, t - half_step), 'end': t + half_step,
+                              'peak': score, 'peak_time': t, '_last': t})
+    for cur in intervals:
+        del cur['_last']
+        cur['start'] = round(cur['start'], 3)
+        cur['end'] = round(cur['end'], 3)
+        cur['peak'] = round(cur['peak'], 3)
+        cur['peak_time'] = round(cur['peak_time'], 3)
+    return intervals
+
+
+def triage_video(video_path: str, detector: MultiLayerDetector,
+                 sample_fps: float = TRIAGE_SAMPLE_FPS, max_side: int = TRIAGE_MAX_SIDE,
+                 threshold: float = TRIAGE_THRESHOLD, merge_gap: float = TRIAGE_MERGE_GAP,
+                 progress_cb: Optional[Callable[[int, int], Any]] = None,
+                 decoder: str = BACKEND_OPENCV) -> Dict[str, Any]:
+    """
+    Sample a video at low fps / low resolution and build its NSFW timeline.
+
+    Only Layer 2 (and Layer 4 when available) run: tracking needs consecutive
+    frames and the hold-over layer has nothing to hold at this sampling rate.
+    Frames are downscaled at decode time and skipped frames are grab()-ed
+    without colour conversion. Sample times are the decoder's frame timestamps.
+
+    Returns:
+        Timeline dict (see write_triage_report for the on-disk layout)
+    """
+    cap = open_video(video_path, decoder, max_side=max_side)
+    fps = cap.fps or 30.0
+    total = cap.frame_count
+    step = max(1, int(round(fps / sample_fps)))
+    started = time.perf_counter()
+
+    samples = []
+    frame_idx = 0
+    try:
+        while True:
+            if frame_idx % step != 0:
+                if not cap.grab():
+                    break
+                frame_idx += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+            score = 0.0
+            try:
+                for _, s in detector.detect(frame_rgb, imgsz=max_side):
+                    score = max(score, s)
+            except Exception as e:
+                print(f"[WARNING] Triage detection failed at frame {frame_idx}: {e}")
+            if detector.has_nudenet:
+                try:
+                    for _, s in detector.nudenet(frame_rgb):
+                        score = max(score, s)
+                except Exception as e:
+                    print(f"[WARNING] Triage NudeNet failed at frame {frame_idx}: {e}")
+
+            samples.append((cap.timestamp if cap.timestamp is not None else frame_idx / fps, score))
+            if progress_cb is not None:
+                progress_cb(frame_idx + 1, total)
+            frame_idx += 1
+    finally:
+        cap.release()
+
+    elapsed = time.perf_counter() - started
+    duration = frame_idx / fps if fps > 0 else 0.0
+    intervals = _build_intervals(samples, threshold, step / fps / 2, merge_gap)
+    flagged = sum(1 for _, s in samples if s >= threshold)
+    flagged_seconds = sum(iv['end'] - iv['start'] for iv in intervals)
+    stat = os.stat(video_path)
+
+    return {
+        'video': os.path.abspath(video_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'fps': fps,
+        'frame_count': frame_idx,
+        'duration': round(duration, 3),
+        'sample_fps': round(fps / step, 3),
+        'threshold': threshold,
+        'samples': len(samples),
+        'flagged_samples': flagged,
+        'flagged_seconds': round(flagged_seconds, 3),
+        'flagged_ratio': round(flagged_seconds / duration, 4) if duration > 0 else 0.0,
+        'peak_confidence': round(max((s for _, s in samples), default=0.0), 3),
+        'intervals': intervals,
+        'elapsed': round(elapsed, 3),
+        'realtime_factor': round(duration / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def write_triage_report(timelines: List[Dict[str, Any]], report_dir: str) -> str:
+    """
+    Write one <video>.triage.json per timeline plus an aggregate triage_report.json
+    (videos sorted by render priority). Returns the aggregate report path.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    for tl in timelines:
+        with open(_timeline_path(report_dir, tl['video']), 'w', encoding='utf-8') as f:
+            json.dump(tl, f, ensure_ascii=False, indent=2)
+
+    ordered = sorted(timelines, key=lambda t: (t['flagged_seconds'], t['peak_confidence']), reverse=True)
+    total_duration = sum(t['duration'] for t in timelines)
+    total_elapsed = sum(t['elapsed'] for t in timelines)
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'total_videos': len(timelines),
+        'flagged_videos': sum(1 for t in timelines if t['intervals']),
+        'total_duration': round(total_duration, 3),
+        'flagged_seconds': round(sum(t['flagged_seconds'] for t in timelines), 3),
+        'elapsed': round(total_elapsed, 3),
+        'realtime_factor': round(total_duration / total_elapsed, 1) if total_elapsed > 0 else 0.0,
+        'videos': [{
+            'video': t['video'],
+            'duration': t['duration'],
+            'flagged_seconds': t['flagged_seconds'],
+            'flagged_ratio': t['flagged_ratio'],
+            'peak_confidence': t['peak_confidence'],
+            'intervals': len(t['intervals']),
+        } for t in ordered],
+    }
+    report_path = os.path.join(report_dir, REPORT_NAME)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report_path
+
+
+def load_timeline(report_dir: str, video_path: str) -> Optional[Dict[str, Any]]:
+    """Load the timeline of a video if it exists, is for this path and the file is unchanged since triage."""
+    path = _timeline_path(report_dir, video_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            tl = json.load(f)
+        if tl.get('video') != os.path.abspath(video_path):
+            return None  # Another video with the same file name
+        stat = os.stat(video_path)
+        if tl.get('size') != stat.st_size or abs(tl.get('mtime', 0) - stat.st_mtime) > 1e-3:
+            return None
+        return tl
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Failed to read triage timeline {path}: {e}")
+        return None
+
+
+def prioritize(video_paths: List[str], timelines: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Order videos by flagged duration (most work first). Untriaged videos come first, clean ones last."""
+    def key(path):
+        tl = timelines.get(path)
+        if tl is None:
+            return (0, 0.0)
+        if not tl['intervals']:
+            return (2, 0.0)
+        return (1, -tl['flagged_seconds'])
+    return sorted(video_paths, key=key)
+
+
+def dense_frame_ranges(timeline: Dict[str, Any], fps: float,
+                       margin: float = TRIAGE_MARGIN) -> List[Tuple[int, int]]:
+    """Convert flagged intervals (+ margin) to sorted, merged, inclusive frame ranges."""
+    ranges = []
+    for iv in timeline.get('intervals', []):
+        start = max(0, int((iv['start'] - margin) * fps))
+        end = int((iv['end'] + margin) * fps) + 1
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
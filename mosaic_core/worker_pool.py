@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-mosaic-auto - Shared-Memory Detection Worker Pool
+Decoded frames live in a multiprocessing.shared_memory ring. Detection
+worker processes (each with its own YOLO / NudeNet) read the slots in place
+and send back only box arrays; the main process tracks, composites and
+writes frames in order. No frame pixels are pickled between processes.
+"""
+
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from mosaic_core.detection import (
+    HoldOverState, IouTracker, LAYER_CODES, LAYER_DETECT, LAYER_HISTORY, LAYER_NAMES,
+    LAYER_NUDENET, merge_boxes,
+)
+from mosaic_core.detection_cache import VideoDetectionCache
+from mosaic_core.frame_cache import FrameFingerprintCache, frame_fingerprint
+from mosaic_core.metrics import RssMonitor
+from mosaic_core.profiler import profiler
+from mosaic_core.render import composite_frame, in_frame_ranges
+from mosaic_core.thread_budget import ThreadLayout, apply_threads
+from mosaic_core.triage import TRIAGE_SPARSE_INTERVAL
+
+SLOTS_PER_WORKER = 2     # Ring slots per worker (one being detected, one queued)
+WORKER_START_TIMEOUT = 300.0
+_RESULT_POLL = 1.0
+
+
+def _attach(name: str, shape: Tuple[int, ...], n_slots: int):
+    # Spawned workers share the parent's resource tracker, so attaching here
+    # doesn't make the segment owned (or unlinked) by the worker
+    shm = shared_memory.SharedMemory(name=name)
+    frames = np.ndarray((n_slots,) + tuple(shape), dtype=np.uint8, buffer=shm.buf)
+    return shm, frames
+
+
+def _detect_frame(detector, frame_rgb, idx: int) -> np.ndarray:
+    """Layer 2 + Layer 4 on one frame. Returns merged boxes as an int32 (N, 5) array."""
+    boxes = []
+    try:
+        boxes.extend(b + (LAYER_DETECT,) for b, _ in detector.detect(frame_rgb))
+    except Exception as e:
+        print(f"[WARNING] Layer 2 (detection) failed on frame {idx}: {e}")
+    if detector.has_nudenet:
+        try:
+            boxes.extend(b + (LAYER_NUDENET,) for b, _ in detector.nudenet(frame_rgb))
+        except Exception as e:
+            print(f"[WARNING] Layer 4 (NudeNet) failed on frame {idx}: {e}")
+    merged = merge_boxes(boxes)
+    return np.asarray([b[:4] + (LAYER_CODES[b[4]],) for b in merged], dtype=np.int32).reshape(-1, 5)
+
+
+def _worker_main(worker_id: int, factory: Callable[..., Any], task_q, result_q,
+                 layout: Optional[ThreadLayout]):
+    """Detection worker: load the models once, then serve (frame, slot) tasks."""
+    if layout is not None:
+        apply_threads(layout)  # Before the models create their thread pools
+    try:
+        detector = factory(nn_tmp_name=f'_nn_tmp_w{worker_id}.jpg')
+    except Exception as e:
+        result_q.put(('error', worker_id, str(e)))
+        return
+    result_q.put(('ready', worker_id, None))
+
+    shm, frames, ring = None, None, None
+    rgb = None
+    try:
+        while True:
+            task = task_q.get()
+            if task is None:
+                break
+            frame_idx, slot, ring_key = task
+            if ring_key != ring:
+                # New video: attach its ring (and let go of the previous one)
+                frames = None
+                if shm is not None:
+                    shm.close()
+                shm, frames = _attach(*ring_key)
+                ring = ring_key
+                rgb = np.empty(frames.shape[1:], dtype=np.uint8)
+            cv2.cvtColor(frames[slot], cv2.COLOR_BGR2RGB, dst=rgb)
+            result_q.put(('result', frame_idx, _detect_frame(detector, rgb, frame_idx)))
+    finally:
+        frames = None
+        if shm is not None:
+            shm.close()
+
+
+class FrameRing:
+    """共有メモリ上のフレームリングバッファ (1 動画分)"""
+
+    def __init__(self, shape: Tuple[int, ...], n_slots: int):
+        self.shape = tuple(shape)
+        self.n_slots = n_slots
+        size = n_slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.frames = np.ndarray((n_slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.free: List[int] = list(range(n_slots))
+
+    @property
+    def key(self) -> Tuple[str, Tuple[int, ...], int]:
+        """What a worker needs to attach: (shm name, frame shape, slot count)."""
+        return (self.shm.name, self.shape, self.n_slots)
+
+    def close(self):
+        self.frames = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class DetectionWorkerPool:
+    """検出ワーカープロセスプール (YOLO / NudeNet をワーカー毎に保持)"""
+
+    def __init__(self, factory: Callable[..., Any], workers: int, layout: Optional[ThreadLayout] = None):
+        """
+        Args:
+            factory: Picklable callable returning a MultiLayerDetector; called in each
+                worker as factory(nn_tmp_name=...), e.g. functools.partial(load_detector, ...)
+            workers: Number of worker processes
+            layout: Thread budget applied in each worker (see thread_budget.plan_threads)
+
+        Raises:
+            RuntimeError: if a worker fails to load its models
+        """
+        ctx = mp.get_context('spawn')
+        self.workers = workers
+        self._task_q = ctx.Queue()
+        self._result_q = ctx.Queue()
+        self._procs = [ctx.Process(target=_worker_main, daemon=True,
+                                   args=(i, factory, self._task_q, self._result_q, layout))
+                       for i in range(workers)]
+        for p in self._procs:
+            p.start()
+
+        ready = 0
+        while ready < workers:
+            try:
+                kind, worker_id, payload = self._result_q.get(timeout=WORKER_START_TIMEOUT)
+            except queue.Empty:
+                self.close()
+                raise RuntimeError("Detection workers did not start in time")
+            if kind == 'error':
+                self.close()
+                raise RuntimeError(f"Detection worker {worker_id} failed to load models: {payload}")
+            ready += 1
+        print(f"[INFO] Detection worker pool: {workers} processes ready.")
+
+    def ring(self, shape: Tuple[int, ...]) -> FrameRing:
+        return FrameRing(shape, self.workers * SLOTS_PER_WORKER + 2)
+
+    def submit(self, frame_idx: int, slot: int, ring: FrameRing):
+        self._task_q.put((frame_idx, slot, ring.key))
+
+    def result(self) -> Tuple[int, np.ndarray]:
+        """Next finished frame (any order). Raises RuntimeError if a worker died."""
+        while True:
+            try:
+                kind, frame_idx, boxes = self._result_q.get(timeout=_RESULT_POLL)
+                return frame_idx, boxes
+            except queue.Empty:
+                dead = [p for p in self._procs if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Detection worker exited (code {dead[0].exitcode})")
+
+    def close(self):
+        for p in self._procs:
+            if p.is_alive():
+                self._task_q.put(None)
+        for p in self._procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def render_video_pooled(cap, writer, pool: DetectionWorkerPool, pattern: str, total: int = 0,
+                        progress_cb: Optional[Callable[[int, int], Any]] = None,
+                        recorder: Optional[VideoDetectionCache] = None,
+                        dense_ranges: Optional[List[Tuple[int, int]]] = None,
+                        frame_cache: Optional[FrameFingerprintCache] = None,
+                        out_size: Optional[Tuple[int, int]] = None,
+                        outlines: bool = False,
+                        monitor: Optional[RssMonitor] = None) -> Dict[str, int]:
+    """
+    render_video with Layer 2/4 detection fanned out to the worker pool.
+
+    Frames are decoded straight into shared-memory slots, detected in place by
+    the workers, then tracked (IoU association + Layer 3 hold-over),
+    composited and written in frame order from the same slot. ByteTrack
+    (Layer 1) is inherently sequential, so it is replaced by IoU association
+    of the merged boxes here.
+
+    Returns:
+        {'frames', 'detected_frames', 'dense_frames', 'cache_hits'}
+    """
+    stats = {'frames': 0, 'detected_frames': 0, 'dense_frames': 0, 'cache_hits': 0}
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    ring = pool.ring((height, width, 3))
+    out_buf = np.empty((out_size[1], out_size[0], 3), np.uint8) if out_size is not None else None
+    starts = [r[0] for r in dense_ranges] if dense_ranges is not None else None
+    tracker = IouTracker()
+    hold = HoldOverState()
+
+    slot_of: Dict[int, int] = {}
+    pending: Dict[int, list] = {}        # frame_idx -> merged boxes, ready to composite
+    fingerprints: Dict[int, Tuple[str, np.ndarray]] = {}
+    next_read = next_write = 0
+    eof = False
+
+    def to_boxes(arr) -> list:
+        return [(int(b[0]), int(b[1]), int(b[2]), int(b[3]), LAYER_NAMES[int(b[4])]) for b in arr]
+
+    try:
+        while True:
+            # Fill free slots with decoded frames and dispatch them
+            while not eof and ring.free:
+                slot = ring.free.pop()
+                view = ring.frames[slot]
+                with profiler.span('decode'):
+                    ret, frame = cap.read(view)
+                if not ret:
+                    ring.free.append(slot)
+                    eof = True
+                    break
+                if frame is not view:
+                    view[:] = frame  # Backend ignored the target buffer
+                idx = next_read
+                next_read += 1
+                slot_of[idx] = slot
+                if starts is not None and not in_frame_ranges(idx, starts, dense_ranges):
+                    if idx % TRIAGE_SPARSE_INTERVAL != 0:
+                        pending[idx] = []  # Outside triage intervals: sparse detection + hold-over
+                        continue
+                else:
+                    stats['dense_frames'] += 1
+                if frame_cache is not None:
+                    with profiler.span('frame_cache'):
+                        fp = frame_fingerprint(view, bgr=True)
+                        cached = frame_cache.get(fp[0], fp[1], width, height)
+                    if cached is not None:
+                        pending[idx] = cached
+                        stats['cache_hits'] += 1
+                        continue
+                    fingerprints[idx] = fp
+                pool.submit(idx, slot, ring)
+
+            if eof and next_write == next_read:
+                break
+
+            # Wait until the next frame in order has its boxes
+            while next_write not in pending:
+                with profiler.span('detect_wait'):
+                    idx, arr = pool.result()
+                pending[idx] = to_boxes(arr)
+                if idx in fingerprints:
+                    key, thumb = fingerprints.pop(idx)
+                    frame_cache.put(key, thumb, pending[idx], width, height)
+
+            # Track, composite and write every frame that is ready, in order
+            while next_write in pending:
+                idx = next_write
+                merged = pending.pop(idx)
+                with profiler.span('track'):
+                    current_ids = hold.observe_tracks(tracker.update(merged))
+                boxes = merged + [b[:4] + (LAYER_HISTORY,) for b in hold.update(merged, current_ids)]
+                if recorder is not None:
+                    recorder.add_frame(boxes)
+                if boxes:
+                    stats['detected_frames'] += 1
+
+                slot = slot_of.pop(idx)
+                with profiler.span('composite'):
+                    composited = composite_frame(ring.frames[slot], boxes, pattern, out_size, out_buf, outlines)
+                with profiler.span('write'):
+                    writer.write(composited)
+                ring.free.append(slot)
+                next_write += 1
+                stats['frames'] += 1
+                if progress_cb is not None and (next_write % 10 == 0 or next_write == 1 or next_write == total):
+                    progress_cb(next_write, total)
+                if monitor is not None:
+                    monitor.tick()
+    finally:
+        ring.close()
+    return stats
@@ -116,6 +116,13 @@ ENGINE_WEIGHTS = {
 # ============================================================
 SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
 
+# ============================================================
+# Performance
+# ============================================================
+PARALLEL_JOBS = 1   # Images analyzed concurrently (>1 splits the CPU threads between them).
+                    # The engines are shared and each runs one image at a time (per-engine lock),
+                    # so concurrent images overlap in different engines; the Scorer is stateless
+
 # ============================================================
 # UI Settings
 # ============================================================
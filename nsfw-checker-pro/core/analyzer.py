@@ -4,6 +4,8 @@ nsfw-checker-pro - Multi-Engine Analyzer
 Orchestrates all detection engines and produces unified analysis results.
 """
 
+import threading
+
 import cv2
 import numpy as np
 from pathlib import Path
@@ -18,12 +20,14 @@ from engines.anime_engine import AnimeEngine
 from engines.vision_engine import VisionEngine
 from engines.vit_engine import ViTNSFWEngine
 from engines.lfm_engine import LFMEngine
+from core.threads import configure as configure_threads
 
 
 class MultiEngineAnalyzer:
     """マルチエンジン統合アナライザ"""
 
-    def __init__(self, enable_vision: bool = True, enable_vit: bool = True, enable_lfm: bool = True):
+    def __init__(self, enable_vision: bool = True, enable_vit: bool = True, enable_lfm: bool = True,
+                 parallel_jobs: int = 1):
         """
         Initialize all available engines.
 
@@ -31,11 +35,16 @@ class MultiEngineAnalyzer:
             enable_vision: Enable Google Cloud Vision API engine
             enable_vit: Enable ViT NSFW Classifier engine
             enable_lfm: Enable LFM2.5-VL Vision Language Model engine
+            parallel_jobs: Number of images analyzed concurrently (sizes the
+                torch / ONNX Runtime / OpenCV thread pools)
         """
         print("=" * 60)
         print("nsfw-checker-pro: Initializing engines...")
         print("=" * 60)
 
+        # Thread budget must be applied before any session/model is created
+        self.thread_layout = configure_threads(parallel_jobs)
+
         self.engines = {}
 
         # Always try to initialize core engines
@@ -73,6 +82,10 @@ class MultiEngineAnalyzer:
             except Exception as e:
                 print(f"[ERROR] LFMEngine init failed: {e}")
 
+        # One call per engine at a time: concurrent images (parallel_jobs) overlap
+        # in different engines, never inside the same session / pipeline
+        self._locks = {name: threading.Lock() for name in self.engines}
+
         # Summary
         available = [name for name, eng in self.engines.items() if eng.available]
         print(f"\n[INFO] Available engines: {', '.join(available)} ({len(available)}/{len(self.engines)})")
@@ -84,7 +97,7 @@ class MultiEngineAnalyzer:
 
     def analyze_image(self, image_path: Path) -> Dict[str, Any]:
         """
-        Analyze a single image with all available engines.
+        Analyze a single image with all available engines. Thread-safe.
 
         Returns:
             {
@@ -119,11 +132,12 @@ class MultiEngineAnalyzer:
                 continue
 
             try:
-                if name in ('vision_api', 'nudenet', 'lfm_vl'):
-                    # These engines benefit from file path access
-                    result[name] = engine.analyze(image_array, image_path=image_path)
-                else:
-                    result[name] = engine.analyze(image_array)
+                with self._locks[name]:
+                    if name in ('vision_api', 'nudenet', 'lfm_vl'):
+                        # These engines benefit from file path access
+                        result[name] = engine.analyze(image_array, image_path=image_path)
+                    else:
+                        result[name] = engine.analyze(image_array)
             except Exception as e:
                 result[name] = {'error': str(e)}
 
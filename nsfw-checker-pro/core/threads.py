@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+nsfw-checker-pro - Thread Budget
+Uses the shared mosaic_core thread budget when the checker runs from the
+nsfw-mosaic-auto tree; standalone installs keep the runtime defaults.
+"""
+
+from pathlib import Path
+
+import sys
+_REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+if (_REPO_ROOT / "mosaic_core").is_dir() and str(_REPO_ROOT) not in sys.path:
+    sys.path.append(str(_REPO_ROOT))
+
+try:
+    from mosaic_core.thread_budget import (
+        MODE_PIPELINE, MODE_SINGLE, configure_threads, ort_session_options,
+    )
+except ImportError:
+    MODE_SINGLE, MODE_PIPELINE = 'single', 'pipeline'
+    configure_threads = None
+    ort_session_options = None
+
+
+def configure(parallel_jobs: int = 1):
+    """Apply and report the thread layout for `parallel_jobs` concurrent analyses."""
+    if configure_threads is None:
+        print("[INFO] Thread budget: mosaic_core not found, using runtime defaults.")
+        return None
+    if parallel_jobs > 1:
+        return configure_threads(MODE_PIPELINE, parallel_jobs)
+    return configure_threads(MODE_SINGLE)
+
+
+def session_options():
+    """onnxruntime.SessionOptions for the current layout (None = ORT defaults)."""
+    return ort_session_options() if ort_session_options is not None else None
@@ -14,6 +14,7 @@ import onnxruntime as ort
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from config import ANIME_MODEL_URL
+from core.threads import session_options
 
 
 class AnimeEngine:
@@ -35,9 +36,11 @@ class AnimeEngine:
 
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
             try:
-                self.session = ort.InferenceSession(self.model_path, providers=providers)
+                self.session = ort.InferenceSession(self.model_path, sess_options=session_options(),
+                                                    providers=providers)
             except Exception:
-                self.session = ort.InferenceSession(self.model_path, providers=['CPUExecutionProvider'])
+                self.session = ort.InferenceSession(self.model_path, sess_options=session_options(),
+                                                    providers=['CPUExecutionProvider'])
 
             self.input_name = self.session.get_inputs()[0].name
             self.available = True
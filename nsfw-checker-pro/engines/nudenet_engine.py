@@ -11,6 +11,9 @@ try:
 except ImportError:
     onnxruntime = None
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from core.threads import session_options
+
 # NudeNet v3 labels
 NUDENET_LABELS = [
     "FEMALE_GENITALIA_COVERED", "FACE_FEMALE", "BUTTOCKS_EXPOSED",
@@ -77,7 +80,8 @@ class NudeNetEngine:
         try:
             # Enable GPU if possible
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            self.session = onnxruntime.InferenceSession(str(self.model_path), providers=providers)
+            self.session = onnxruntime.InferenceSession(str(self.model_path), sess_options=session_options(),
+                                                        providers=providers)
             self.available = True
             print(f"[OK] {self.DISPLAY_NAME} initialized (Custom ONNX).")
         except Exception as e:
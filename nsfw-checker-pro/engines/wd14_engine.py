@@ -16,6 +16,7 @@ import onnxruntime as ort
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from config import WD14_TAGGER_URL, WD14_TAGS_URL
+from core.threads import session_options
 
 
 class WD14Engine:
@@ -34,9 +35,11 @@ class WD14Engine:
             self._ensure_model()
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
             try:
-                self.session = ort.InferenceSession(str(self.model_path), providers=providers)
+                self.session = ort.InferenceSession(str(self.model_path), sess_options=session_options(),
+                                                    providers=providers)
             except Exception:
-                self.session = ort.InferenceSession(str(self.model_path), providers=['CPUExecutionProvider'])
+                self.session = ort.InferenceSession(str(self.model_path), sess_options=session_options(),
+                                                    providers=['CPUExecutionProvider'])
 
             self.input_name = self.session.get_inputs()[0].name
             self.tags_df = pd.read_csv(self.tags_path)
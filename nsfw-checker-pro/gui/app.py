@@ -11,6 +11,7 @@ import threading
 import queue
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image, ImageTk, ImageDraw
 import cv2
@@ -21,7 +22,7 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from config import (
     UI_THEME, UI_COLOR_THEME, SUPPORTED_EXTENSIONS,
-    VERDICT_ICONS, STYLE_COLORS, CATEGORY_SCORE_COLORS
+    VERDICT_ICONS, STYLE_COLORS, CATEGORY_SCORE_COLORS, PARALLEL_JOBS
 )
 from core.analyzer import MultiEngineAnalyzer
 from core.scorer import Scorer, ScoringResult
@@ -87,7 +88,8 @@ class NSFWCheckerApp:
         """Initialize engines in background thread."""
         def init_worker():
             try:
-                self.analyzer = MultiEngineAnalyzer(enable_vision=True, enable_vit=True, enable_lfm=True)
+                self.analyzer = MultiEngineAnalyzer(enable_vision=True, enable_vit=True, enable_lfm=True,
+                                                    parallel_jobs=PARALLEL_JOBS)
                 self.scorer = Scorer()
                 self.root.after(0, self._on_engines_loaded)
             except Exception as e:
@@ -335,25 +337,28 @@ class NSFWCheckerApp:
         self.status_label.configure(text="停止中...")
 
     def _process_worker(self, items):
-        """Worker thread for processing files."""
-        total = len(items)
-        for i, (item_id, path) in enumerate(items):
-            if self.stop_flag:
-                self.result_queue.put(('stopped', None, None))
-                return
+        """Worker thread for processing files (PARALLEL_JOBS images at a time; the analyzer locks each engine)."""
+        with ThreadPoolExecutor(max_workers=max(1, PARALLEL_JOBS)) as pool:
+            finished = all(list(pool.map(self._process_item, items)))
+        self.result_queue.put(('done' if finished else 'stopped', None, None))
 
-            try:
-                raw = self.analyzer.analyze_image(path)
-                scored = self.scorer.score(raw)
-                self.result_queue.put(('result', item_id, scored))
-            except Exception as e:
-                err_result = ScoringResult()
-                err_result.verdict = 'ERROR'
-                err_result.verdict_icon = '❌'
-                err_result.labels_summary = str(e)
-                self.result_queue.put(('result', item_id, err_result))
+    def _process_item(self, item) -> bool:
+        """Analyze one file and queue its result. Returns False if skipped after a stop."""
+        item_id, path = item
+        if self.stop_flag:
+            return False
 
-        self.result_queue.put(('done', None, None))
+        try:
+            raw = self.analyzer.analyze_image(path)
+            scored = self.scorer.score(raw)
+            self.result_queue.put(('result', item_id, scored))
+        except Exception as e:
+            err_result = ScoringResult()
+            err_result.verdict = 'ERROR'
+            err_result.verdict_icon = '❌'
+            err_result.labels_summary = str(e)
+            self.result_queue.put(('result', item_id, err_result))
+        return True
 
     def _poll_results(self):
         """Poll result queue and update UI."""
@@ -14,7 +14,7 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from core.analyzer import MultiEngineAnalyzer
 from core.scorer import Scorer
-from config import THRESHOLDS
+from config import PARALLEL_JOBS, THRESHOLDS
 
 def verify():
     print("=" * 60)
@@ -24,7 +24,8 @@ def verify():
     # 1. Initialize Analyzer
     # Note: enable_vision depends on API key. enable_lfm will attempt download.
     try:
-        analyzer = MultiEngineAnalyzer(enable_vision=True, enable_vit=True, enable_lfm=True)
+        analyzer = MultiEngineAnalyzer(enable_vision=True, enable_vit=True, enable_lfm=True,
+                                       parallel_jobs=PARALLEL_JOBS)
     except Exception as e:
         print(f"[FAIL] Analyzer initialization error: {e}")
         return
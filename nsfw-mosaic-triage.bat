@@ -0,0 +1,3 @@
+@echo off
+REM 動画トリアージ (NSFW区間タイムライン作成) スクリプト
+python mosaic-triage.py %*
@@ -13,11 +13,12 @@ echo  [1] 画像自動モザイク (nsfw-mosaic-image.bat)
 echo  [2] 動画自動モザイク - 標準 (nsfw-mosaic-video.bat)
 echo  [3] 動画自動モザイク - 音声調整付き (nsfw-mosaic-video-speek.bat)
 echo  [4] 統合型NSFWチェッカー (nsfw-checker-pro/run.bat)
+echo  [5] 動画トリアージ - NSFW区間の事前スキャン (nsfw-mosaic-triage.bat)
 echo.
 echo  [Q] 終了
 echo.
 echo ============================================================
-set /p choice="選択肢を入力してください (1-4, Q): "
+set /p choice="選択肢を入力してください (1-5, Q): "
 
 if "%choice%"=="1" (
     start "" "nsfw-mosaic-image.bat"
@@ -37,6 +38,10 @@ if "%choice%"=="4" (
     cd ..
     goto MENU
 )
+if "%choice%"=="5" (
+    start "" "nsfw-mosaic-triage.bat"
+    goto MENU
+)
 if /i "%choice%"=="Q" exit
 
 echo 無効な選択です。